@@ -6,21 +6,45 @@
 # been successfully added. These variables can be used throughout the application to provide
 # consistent and meaningful messages or status updates.
 # Application Message Properties
+# The responses are ConstantResponse mappings, read-only with their JSON body encoded once, see
+# json_responses. A response carrying request data is a new dictionary built from them.
+from json_responses import ConstantResponse
 
-BAD_EMAIL_VALUE = {"message": "bad value to the parameter email"}
-BAD_PASSWORD_VALUE = {"message": "bad value to the parameter password"}
-USER_ADDED = {"status": "user added successfully"}
-EMAIL_ALREADY_EXISTS = {"status": "please try with new email address"}
-MONGODB_CONNECTIVITY_ISSUE = {"exception": "Some issue with MongoDB Connectivity"}
-USER_DELETED = {"status": "user deleted successfully"}
-USER_DELETE_FAILED =  {"status": "user delete failed"}
-USER_UPDATE = {"status": "user profile updated successfully"}
-USER_UPDATE_FAILED = {"status": "user profile update failed"}
-USER_NOT_FOUND =  {"user": "user not found"}
+BAD_EMAIL_VALUE = ConstantResponse({"message": "bad value to the parameter email"})
+BAD_PASSWORD_VALUE = ConstantResponse({"message": "bad value to the parameter password"})
+BAD_LIMIT_VALUE = ConstantResponse({"message": "bad value to the parameter limit"})
+BAD_BEFORE_VALUE = ConstantResponse({"message": "bad value to the parameter before"})
+BAD_RATE_VALUE = ConstantResponse({"message": "bad value to the parameter rate"})
+BAD_SECONDS_VALUE = ConstantResponse({"message": "bad value to the parameter seconds"})
+BAD_FORMAT_VALUE = ConstantResponse({"message": "bad value to the parameter format, collapsed or svg"})
+ADMIN_TOKEN_INVALID = ConstantResponse({"message": "admin token missing or invalid"})
+USER_ADDED = ConstantResponse({"status": "user added successfully"})
+EMAIL_ALREADY_EXISTS = ConstantResponse({"status": "please try with new email address"})
+USER_ADD_FAILED = ConstantResponse({"status": "user add failed"})
+MONGODB_CONNECTIVITY_ISSUE = ConstantResponse({"exception": "Some issue with MongoDB Connectivity"})
+REDIS_CONNECTIVITY_ISSUE = ConstantResponse({"exception": "Some issue with Redis Connectivity"})
+PASSWORD_HASHER_BUSY = ConstantResponse({"exception": "password hashing is busy, please retry later"})
+EMAIL_INDEXES_MISSING = ConstantResponse({"exception": "unique email indexes are not in place, users can not be added"})
+USER_DELETED = ConstantResponse({"status": "user deleted successfully"})
+USER_DELETE_FAILED = ConstantResponse({"status": "user delete failed"})
+USER_UPDATE = ConstantResponse({"status": "user profile updated successfully"})
+USER_UPDATE_FAILED = ConstantResponse({"status": "user profile update failed"})
+USER_NOT_FOUND = ConstantResponse({"user": "user not found"})
 USER_FIRST_LOGIN = "user has not logged in"
-USER_LOGIN_FAILED = {"status": "user login failed"}
-USER_LOGIN_SUCCESS = {"status": "user login successful"}
-PARAM_EMAIL_ABSENT = {"message": "parameter email missing"}
-MANDATORY_PARAMETER_U_E_P_MISSING = {"message": "one of the mandatory parameter is missing ( username, email, password )"}
-MANDATORY_PARAMETER_E_P_MISSING = {"message": "one of the mandatory parameter is missing ( email, password )"}
-MANDATORY_PARAMETER_E_U_MISSING = {"message": "one of the mandatory parameter is missing ( email, username )"}
\ No newline at end of file
+USER_LOGIN_FAILED = ConstantResponse({"status": "user login failed"})
+USER_LOGIN_SUCCESS = ConstantResponse({"status": "user login successful"})
+PARAM_EMAIL_ABSENT = ConstantResponse({"message": "parameter email missing"})
+PARAM_TOKEN_ABSENT = ConstantResponse({"message": "parameter token missing"})
+BAD_JSON_LINE = ConstantResponse({"message": "line is not a JSON object"})
+BAD_JSON_BODY = ConstantResponse({"message": "request body is not a JSON object"})
+PARAM_EMAILS_ABSENT = ConstantResponse({"message": "parameter emails missing, a list of emails"})
+BATCH_TOO_LARGE = ConstantResponse({"message": "too many emails in the batch"})
+MANDATORY_PARAMETER_U_E_P_MISSING = ConstantResponse({"message": "one of the mandatory parameter is missing ( username, email, password )"})
+MANDATORY_PARAMETER_E_P_MISSING = ConstantResponse({"message": "one of the mandatory parameter is missing ( email, password )"})
+MANDATORY_PARAMETER_E_U_MISSING = ConstantResponse({"message": "one of the mandatory parameter is missing ( email, username )"})
+SERVICE_ALIVE = ConstantResponse({"status": "alive"})
+SERVICE_READY = "ready"
+SERVICE_NOT_READY = "not ready"
+BACKEND_UP = "up"
+BACKEND_DOWN = "down"
+TOO_MANY_REQUESTS = ConstantResponse({"message": "too many attempts, please retry later"})
@@ -0,0 +1,584 @@
+"""
+    This is the ASGI entry point of the CRUD REST API for managing user objects. It serves the
+    same routes and responses as the Flask app of server.py, with asyncio MongoDB and Redis
+    clients, so a request holds no thread while it waits on I/O.
+
+    $ uvicorn asgi_server:APP --host 0.0.0.0 --port 5000 --workers 4
+"""
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.requests import ClientDisconnect
+import redis_cache
+import async_redis_cache
+import mongo_db_connector
+import async_mongo_db_connector
+import session_token
+import profile_cache
+import email_filter
+import bulk_users
+import batch_lookup
+import metrics
+import profiler
+import circuit_breaker
+import validate_param
+import request_schema
+import health
+import rate_limiter
+import json_responses
+import appconstants
+
+
+class AppJSONResponse(JSONResponse):
+    """
+    The class AppJSONResponse renders JSON like the Flask app, see json_responses.
+    """
+
+    def render(self, content):
+        return json_responses.encode(content)
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    The class RequestStreamingResponse streams a response which is produced while the request
+    body is still being read. The disconnect listener of StreamingResponse would consume the
+    body messages, hence it is not started, a disconnect surfaces while reading the body.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError as ex:
+            raise ClientDisconnect() from ex
+
+
+class MetricsMiddleware:
+    """
+    The class MetricsMiddleware records the count, the status code and the latency of the
+    requests, see server.record_request. The latency is the time to the complete response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            metrics.inc(metrics.HTTP_REQUESTS, (route, scope["method"], str(status[0])))
+            metrics.observe(metrics.HTTP_DURATION, (route, scope["method"]),
+                            time.perf_counter() - started)
+
+
+class ProfilerMiddleware:
+    """
+    The class ProfilerMiddleware registers a sample of the requests with the profiler, keyed by
+    their task, while the profiler is on, see server.start_profiling.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.PROFILER.should_sample():
+            await self.app(scope, receive, send)
+            return
+        task = asyncio.current_task()
+
+        def route():
+            matched = scope.get("route")
+            return scope["method"] + " " + (matched.path if matched is not None else "unmatched")
+
+        profiler.PROFILER.begin(task, route)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.PROFILER.end(task)
+
+
+def _client_ip(request):
+    """
+    The function _client_ip returns the IP address of the client, or None, see
+    rate_limiter.client_ip.
+    """
+    return rate_limiter.client_ip(request.client.host if request.client is not None else None,
+                                  ",".join(request.headers.getlist("x-forwarded-for")) or None)
+
+
+async def request_params(request, schema):
+    """
+    The function `request_params` validates the parameters of a request, see
+    server.request_params.
+    """
+    body = None
+    if request_schema.is_json(request.headers.get("content-type")):
+        body = await request.body()
+    return schema.validate(request.query_params, body)
+
+
+def versioned(response, version):
+    """
+    The function `versioned` labels a profile response with the ETag of its version, see
+    server.versioned.
+    """
+    response.headers["ETag"] = profile_cache.etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def too_many_requests(retry_after):
+    """
+    The function `too_many_requests` builds the response of an attempt over a rate limit, see
+    server.too_many_requests.
+    """
+    return AppJSONResponse(appconstants.TOO_MANY_REQUESTS, 429,
+                           headers={"Retry-After": str(retry_after)})
+
+
+def exception_status_code(response):
+    """
+    The function `exception_status_code` maps an exception response to its status code, see
+    server.exception_status_code.
+    """
+    if response in (appconstants.PASSWORD_HASHER_BUSY, appconstants.MONGODB_CONNECTIVITY_ISSUE,
+                    appconstants.REDIS_CONNECTIVITY_ISSUE, appconstants.EMAIL_INDEXES_MISSING):
+        return 503
+    return 500
+
+
+async def liveness(request):  # pylint: disable=unused-argument
+    """
+    The function `liveness()` answers the liveness probe, without calling a backend.
+    """
+    return AppJSONResponse(appconstants.SERVICE_ALIVE, 200)
+
+
+async def readiness(request):  # pylint: disable=unused-argument
+    """
+    The function `readiness()` answers the readiness probe, see server.readiness.
+    """
+    response = await health.READINESS.check_async(async_mongo_db_connector.ping,
+                                                  async_redis_cache.ping)
+    return AppJSONResponse(response, 200 if health.is_ready(response) else 503)
+
+
+async def list_user(request):
+    """
+    The function "list_user" returns the user profile of the email parameter, see
+    server.list_user.
+    """
+    params, error = await request_params(request, request_schema.LIST_USER)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    email = params["email"]
+    status_code = 200
+    version = None
+    if profile_cache.should_version(email):
+        version = await async_redis_cache.profile_version(email)
+    if version is not None and profile_cache.etag_matches(
+            request.headers.get("If-None-Match"), version):
+        return versioned(Response(status_code=304), version)
+    response = await async_mongo_db_connector.list_user(email, params["limit"], params["before"],
+                                                        version)
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+        version = None
+    if version is not None:
+        return versioned(AppJSONResponse(response, status_code), version)
+    return AppJSONResponse(response, status_code)
+
+
+async def create_user(request):
+    """
+    The `create_user` function creates a new user, see server.create_user.
+    """
+    params, error = await request_params(request, request_schema.CREATE_USER)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    retry_after = await rate_limiter.LIMITER.check_async(
+        "create_user", async_redis_cache.hit_rate_limits, ip=_client_ip(request))
+    if retry_after:
+        return too_many_requests(retry_after)
+    status_code = 200
+    response = await async_mongo_db_connector.add_user(params["username"], params["email"],
+                                                       params["password"])
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return AppJSONResponse(response, status_code)
+
+
+async def login_user(request):
+    """
+    The function `login_user()` logs in a user, see server.login_user.
+    """
+    params, error = await request_params(request, request_schema.LOGIN_USER)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    email = params["email"]
+    retry_after = await rate_limiter.LIMITER.check_async(
+        "login_user", async_redis_cache.hit_rate_limits, email=email, ip=_client_ip(request))
+    if retry_after:
+        return too_many_requests(retry_after)
+    status_code = 200
+    response = await async_mongo_db_connector.login_user(email, params["password"])
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return AppJSONResponse(response, status_code)
+
+
+async def check_logged_in(request):
+    """
+    The function `check_logged_in` checks if a user is logged in, see server.check_logged_in.
+    """
+    params, error = await request_params(request, request_schema.CHECK_LOGGED_IN)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    email, token = params["email"], params["token"]
+    if session_token.is_signed_mode():
+        if not validate_param.is_parameter_value_valid(token):
+            return AppJSONResponse(appconstants.PARAM_TOKEN_ABSENT, 400)
+        logged_in = session_token.is_token_valid(email, token)
+    else:
+        logged_in = await async_redis_cache.is_client_token_persists(email, token)
+    if logged_in:
+        return AppJSONResponse({"message": email + " is logged in"}, 200)
+    return AppJSONResponse({"message": email + " is not logged in"}, 200)
+
+
+async def log_out_signed(email, token):
+    """
+    The function `log_out_signed()` logs out a user in the signed token mode, see
+    server.log_out_signed. The revocation is a rare, single Redis write, it runs on a worker
+    thread with the sync client.
+    """
+    if validate_param.is_parameter_value_valid(token):
+        if not session_token.is_token_valid(email, token):
+            return {"message": email + " not logged in. Hence cannot log out"}
+        logged_out = await run_in_threadpool(session_token.revoke_token, email, token)
+    else:
+        logged_out = await run_in_threadpool(session_token.revoke_all_tokens, email)
+    if logged_out:
+        return {"message": email + " logged out"}
+    return {"message": email + " failed to logged out"}
+
+
+async def log_out(request):
+    """
+    The function `log_out()` logs out a user, see server.log_out.
+    """
+    params, error = await request_params(request, request_schema.LOG_OUT)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    email, token = params["email"], params["token"]
+    if session_token.is_signed_mode():
+        response = await log_out_signed(email, token)
+    else:
+        removed = await async_redis_cache.remove_client_tokens(email, token)
+        if removed is None:
+            response = {"message": email + " failed to logged out"}
+        elif removed > 0:
+            response = {"message": email + " logged out"}
+        else:
+            response = {"message": email + " not logged in. Hence cannot log out"}
+    return AppJSONResponse(response, 200)
+
+
+async def update_user(request):
+    """
+    The function `update_user()` updates the password of a user, see server.update_user.
+    """
+    params, error = await request_params(request, request_schema.UPDATE_USER)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    status_code = 200
+    response = await async_mongo_db_connector.update_user(params["username"], params["email"],
+                                                          params["password"])
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return AppJSONResponse(response, status_code)
+
+
+async def delete_user(request):
+    """
+    The function `delete_user()` deletes a user, see server.delete_user.
+    """
+    params, error = await request_params(request, request_schema.DELETE_USER)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    status_code = 200
+    response = await async_mongo_db_connector.delete_user(params["username"], params["email"])
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return AppJSONResponse(response, status_code)
+
+
+async def session_stats(request):  # pylint: disable=unused-argument
+    """
+    The function `session_stats()` reports the session store statistics, see
+    server.session_stats.
+    """
+    response = await run_in_threadpool(redis_cache.session_stats)
+    if response is None:
+        return AppJSONResponse(appconstants.REDIS_CONNECTIVITY_ISSUE, 503)
+    return AppJSONResponse(response, 200)
+
+
+async def breaker_stats(request):  # pylint: disable=unused-argument
+    """
+    The function `breaker_stats()` reports the state of the circuit breakers of this worker.
+    """
+    return AppJSONResponse(circuit_breaker.stats(), 200)
+
+
+async def rate_limit_stats(request):  # pylint: disable=unused-argument
+    """
+    The function `rate_limit_stats()` reports the rate limits and the rejected attempts of this
+    worker.
+    """
+    return AppJSONResponse(rate_limiter.LIMITER.stats(), 200)
+
+
+async def login_history_stats(request):  # pylint: disable=unused-argument
+    """
+    The function `login_history_stats()` reports the login history write-behind of this worker.
+    """
+    return AppJSONResponse(mongo_db_connector.LOGIN_HISTORY.stats(), 200)
+
+
+async def profile_cache_stats(request):  # pylint: disable=unused-argument
+    """
+    The function `profile_cache_stats()` reports the profile cache counters of this worker.
+    """
+    return AppJSONResponse(profile_cache.CACHE.stats(), 200)
+
+
+async def email_filter_stats(request):  # pylint: disable=unused-argument
+    """
+    The function `email_filter_stats()` reports the email filter of this worker.
+    """
+    return AppJSONResponse(email_filter.FILTER.stats(), 200)
+
+
+async def start_profiler(request):
+    """
+    The function `start_profiler()` switches the profiler of this worker on, see
+    server.start_profiler.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    params, error = await request_params(request, request_schema.START_PROFILER)
+    if error is not None:
+        return AppJSONResponse(error, 400)
+    return AppJSONResponse(profiler.PROFILER.start(params["rate"], params["seconds"]), 200)
+
+
+async def stop_profiler(request):
+    """
+    The function `stop_profiler()` switches the profiler of this worker off, see
+    server.stop_profiler.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    return AppJSONResponse(profiler.PROFILER.stop(), 200)
+
+
+async def profiler_status(request):
+    """
+    The function `profiler_status()` reports the state of the profiler of this worker.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    return AppJSONResponse(profiler.PROFILER.status(), 200)
+
+
+async def download_profile(request):
+    """
+    The function `download_profile()` downloads the profile of this worker, see
+    server.download_profile.
+    """
+    output_format = request.query_params.get("format", "collapsed")
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    if output_format not in profiler.FORMATS:
+        return AppJSONResponse(appconstants.BAD_FORMAT_VALUE, 400)
+    media_type, render = profiler.FORMATS[output_format]
+    return Response(render(), media_type=media_type, headers={
+        "Content-Disposition": "attachment; filename=profile-%d.%s" % (os.getpid(),
+                                                                        output_format)})
+
+
+async def metrics_endpoint(request):  # pylint: disable=unused-argument
+    """
+    The function `metrics_endpoint()` exposes the metrics, see
+    server.metrics_endpoint.
+    """
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+async def _request_lines(request):
+    """
+    The function _request_lines splits the streamed request body into lines.
+    """
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+async def bulk_create_user(request):
+    """
+    The function `bulk_create_user()` creates the users of an NDJSON request body, see
+    server.bulk_create_user. Each batch is processed on a worker thread.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    async def results():
+        batch = []
+        line_number = 0
+        async for line in _request_lines(request):
+            line_number += 1
+            if line.strip():
+                batch.append((line_number, line))
+            if len(batch) == bulk_users.BULK_BATCH_SIZE:
+                for result in await run_in_threadpool(bulk_users.create_batch, batch):
+                    yield json_responses.encode(result)
+                batch = []
+        if batch:
+            for result in await run_in_threadpool(bulk_users.create_batch, batch):
+                yield json_responses.encode(result)
+    return RequestStreamingResponse(results(), media_type="application/x-ndjson")
+
+
+async def export_users(request):
+    """
+    The function `export_users()` streams every user, see server.export_users. The export is
+    read on a worker thread.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    after = request.query_params.get("after")
+    return StreamingResponse(bulk_users.export_users(after), media_type="application/x-ndjson")
+
+
+async def batch_check_logged_in(request):
+    """
+    The function `batch_check_logged_in()` checks the sessions of a batch of users, see
+    server.batch_check_logged_in.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    entries, error, status_code = batch_lookup.parse_batch(await request.body())
+    if error is not None:
+        return AppJSONResponse(error, status_code)
+
+    async def results():
+        for start, chunk in batch_lookup.chunks(entries):
+            chunk_results, pending = batch_lookup.session_chunk(start, chunk)
+            if pending:
+                batch_lookup.session_fill(pending, await async_redis_cache.check_client_tokens(
+                    [(email, token) for _, email, token in pending]))
+            for result in chunk_results:
+                yield json_responses.encode(result)
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+async def batch_list_user(request):
+    """
+    The function `batch_list_user()` returns the profiles of a batch of users, see
+    server.batch_list_user.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return AppJSONResponse(appconstants.ADMIN_TOKEN_INVALID, 403)
+    entries, error, status_code = batch_lookup.parse_batch(await request.body())
+    if error is not None:
+        return AppJSONResponse(error, status_code)
+
+    async def results():
+        for start, chunk in batch_lookup.chunks(entries):
+            chunk_results, pending = batch_lookup.profile_chunk(start, chunk)
+            if pending:
+                batch_lookup.profile_fill(pending, await async_mongo_db_connector.list_users(
+                    [email for _, email in pending]))
+            for result in chunk_results:
+                yield json_responses.encode(result)
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):  # pylint: disable=unused-argument
+    """
+    The function lifespan creates the unique email indexes and installs the profiler signal
+    handler at startup, see server.py, the startup fails if the indexes are not in place. At
+    shutdown it flushes the login history write-behind and closes the clients of the worker.
+    """
+    profiler.install_signal_handler()
+    if not await async_mongo_db_connector.create_indexes():
+        raise RuntimeError("Unique email indexes are not in place")
+    yield
+    await run_in_threadpool(mongo_db_connector.LOGIN_HISTORY.flush)
+    await asyncio.gather(async_mongo_db_connector.close(), async_redis_cache.close())
+
+
+def create_app():
+    """
+    The function `create_app()` creates the ASGI app, see server.create_app.
+    """
+    middleware = [Middleware(MetricsMiddleware), Middleware(ProfilerMiddleware)]
+    if json_responses.RESPONSE_GZIP_ENABLED:
+        middleware.append(Middleware(GZipMiddleware,
+                                     minimum_size=json_responses.RESPONSE_GZIP_MIN_SIZE,
+                                     compresslevel=json_responses.RESPONSE_GZIP_LEVEL))
+    return Starlette(routes=[
+        Route('/health/live', liveness, methods=['GET']),
+        Route('/health/ready', readiness, methods=['GET']),
+        Route('/list/user', list_user, methods=['GET']),
+        Route('/create/user', create_user, methods=['POST']),
+        Route('/login/user', login_user, methods=['POST']),
+        Route('/login/user', check_logged_in, methods=['GET']),
+        Route('/logout/user', log_out, methods=['GET']),
+        Route('/batch/login/user', batch_check_logged_in, methods=['POST']),
+        Route('/batch/list/user', batch_list_user, methods=['POST']),
+        Route('/stats/sessions', session_stats, methods=['GET']),
+        Route('/stats/breakers', breaker_stats, methods=['GET']),
+        Route('/stats/rate-limits', rate_limit_stats, methods=['GET']),
+        Route('/stats/login-history', login_history_stats, methods=['GET']),
+        Route('/stats/profile-cache', profile_cache_stats, methods=['GET']),
+        Route('/stats/email-filter', email_filter_stats, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/admin/profile/start', start_profiler, methods=['POST']),
+        Route('/admin/profile/stop', stop_profiler, methods=['POST']),
+        Route('/admin/profile/status', profiler_status, methods=['GET']),
+        Route('/admin/profile', download_profile, methods=['GET']),
+        Route('/bulk/create/user', bulk_create_user, methods=['POST']),
+        Route('/export/users', export_users, methods=['GET']),
+        Route('/update/user', update_user, methods=['PUT']),
+        Route('/delete/user', delete_user, methods=['DELETE']),
+    ], middleware=middleware, lifespan=lifespan)
+
+
+APP = create_app()
@@ -0,0 +1,345 @@
+"""
+    The module provides the asyncio counterparts of the mongo_db_connector functions, used by the
+    ASGI server. It connects with the asyncio client of pymongo, and shares the collections,
+    the queries and the responses with mongo_db_connector.
+
+    Independent I/O of a request runs concurrently, ex. a successful login writes the login
+    history, persists the token and publishes the profile invalidation at the same time.
+"""
+import time
+import asyncio
+import uuid
+import logging
+import pymongo
+from pymongo import AsyncMongoClient
+import mongo_db_connector
+import async_redis_cache
+import password_hasher
+import session_token
+import profile_cache
+import email_filter
+import metrics
+import circuit_breaker
+import appconstants
+
+# Client and collections of this process, created on first use by _connection
+_CONNECTION = None
+
+
+def _connection():
+    """
+    The function _connection returns the asyncio client and the collections of this process,
+    creating them on first use, inside the event loop of the worker, see
+    mongo_db_connector._connection.
+
+    :return: a tuple of the client, the users collection and the userlogin collection.
+    """
+    global _CONNECTION
+    if _CONNECTION is None:
+        dbclient = AsyncMongoClient(mongo_db_connector.connection_string(),
+                                    **mongo_db_connector.client_options())
+        user_db = dbclient[mongo_db_connector.DATABASE_NAME]
+        _CONNECTION = (
+            dbclient,
+            circuit_breaker.GuardedCollection(user_db[mongo_db_connector.USERS_COLLECTION],
+                                              circuit_breaker.MONGODB),
+            circuit_breaker.GuardedCollection(user_db[mongo_db_connector.USERLOGIN_COLLECTION],
+                                              circuit_breaker.MONGODB))
+    return _CONNECTION
+
+
+def users():
+    """
+    The function users returns the users collection of this process.
+    """
+    return _connection()[1]
+
+
+def userlogin():
+    """
+    The function userlogin returns the userlogin collection of this process.
+    """
+    return _connection()[2]
+
+
+async def close():
+    """
+    The function close closes the asyncio client of this process, at the shutdown of the server.
+    """
+    global _CONNECTION
+    connection, _CONNECTION = _CONNECTION, None
+    if connection is not None:
+        await connection[0].close()
+
+
+async def ping():
+    """
+    The function ping checks, through the MongoDB circuit breaker, that MongoDB answers.
+
+    :return: a boolean value. It returns True if MongoDB answered the ping command.
+    """
+    try:
+        await circuit_breaker.MONGODB.call(_connection()[0].admin.command, "ping")
+        return True
+    except pymongo.errors.ConnectionFailure as ex:
+        logging.error('Exception at ping %s', str(ex))
+        return False
+
+
+async def _in_thread(function, *args):
+    """
+    The function _in_thread runs a blocking function ( ex. a password hash, which waits on the
+    password_hasher process pool ) on the default executor of the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def _invalidate(email):
+    """
+    The function _invalidate evicts the cached profile of the user, see profile_cache.invalidate.
+    """
+    if profile_cache.PROFILE_CACHE_ENABLED or profile_cache.PROFILE_ETAG_ENABLED:
+        if profile_cache.PROFILE_CACHE_ENABLED:
+            profile_cache.CACHE.evict(email)
+        await async_redis_cache.publish_profile_invalidation(
+            email, profile_cache.PROFILE_CACHE_ENABLED, profile_cache.PROFILE_ETAG_ENABLED)
+
+
+async def _added(email):
+    """
+    The function _added adds a new user to the email filters, see email_filter.added.
+    """
+    if email_filter.EMAIL_FILTER_ENABLED:
+        email_filter.FILTER.add(email)
+        if not await async_redis_cache.publish_email_addition(email):
+            email_filter.FILTER.unpublished([email])
+
+
+async def create_indexes():
+    """
+    The function `create_indexes` creates the unique email indexes, see
+    mongo_db_connector.create_indexes.
+
+    :return: a boolean value. It returns True if the indexes exist after the call.
+    """
+    try:
+        await asyncio.gather(
+            users().create_index("email", unique=True, name="email_unique"),
+            userlogin().create_index("email", unique=True, name="email_unique"))
+        mongo_db_connector.INDEXES_CREATED = True
+        return True
+    except (pymongo.errors.ConnectionFailure, pymongo.errors.OperationFailure) as ex:
+        logging.error('Exception at create_indexes %s', str(ex))
+        return False
+
+
+async def add_user(username, email, password):
+    """
+    The function `add_user` adds a user to a MongoDB document, see mongo_db_connector.add_user.
+
+    :param username: The username parameter is the username of the user
+    :param email: The email parameter is the email address of the user
+    :param password: The password parameter is the plain text password of the user
+    :return: a dictionary with a "status" key, or an exception response.
+    """
+    if not mongo_db_connector.INDEXES_CREATED:
+        return appconstants.EMAIL_INDEXES_MISSING
+    response = {}
+    try:
+        encrypted_password = await _in_thread(password_hasher.hash_password, password)
+        entry = {"username": username, "email": email, "password": encrypted_password}
+        await users().insert_one(entry)
+        response = appconstants.USER_ADDED
+        await asyncio.gather(_added(email), _invalidate(email))
+    except pymongo.errors.DuplicateKeyError:
+        response = appconstants.EMAIL_ALREADY_EXISTS
+    except password_hasher.PasswordHasherBusy as ex:
+        response = appconstants.PASSWORD_HASHER_BUSY
+        logging.error('Exception at add_user %s', str(ex))
+    except pymongo.errors.ConnectionFailure as ex:
+        response = appconstants.MONGODB_CONNECTIVITY_ISSUE
+        logging.error('Exception at add_user %s', str(ex))
+    return response
+
+
+async def delete_user(username, email):
+    """
+    The function `delete_user` deletes a user from a MongoDB document, see
+    mongo_db_connector.delete_user.
+
+    :param username: The username parameter is the username of the user
+    :param email: The email parameter is the email address of the user
+    :return: a response dictionary with the status of the user deletion.
+    """
+    response = {}
+    try:
+        delete_cursor = await users().delete_one({"email": email, "username": username})
+        if delete_cursor.deleted_count == 1:
+            response = appconstants.USER_DELETED
+            # waits for a login history batch of the user being written
+            await _in_thread(mongo_db_connector.LOGIN_HISTORY.discard, email)
+            await asyncio.gather(userlogin().delete_one({"email": email}), _invalidate(email))
+        else:
+            response = appconstants.USER_DELETE_FAILED
+    except pymongo.errors.ConnectionFailure as ex:
+        response = appconstants.MONGODB_CONNECTIVITY_ISSUE
+        logging.error('Exception at delete_user %s', str(ex))
+    return response
+
+
+async def update_user(username, email, password):
+    """
+    The function updates a user's password in a MongoDB document, see
+    mongo_db_connector.update_user. The password is hashed here.
+
+    :param username: The username parameter is the username of the user
+    :param email: The email parameter is the email address of the user
+    :param password: The password parameter is the new plain text password of the user
+    :return: a dictionary response with a "status" key, or an exception response.
+    """
+    response = {}
+    try:
+        encrypted_password = await _in_thread(password_hasher.hash_password, password)
+        update_cursor = await users().update_one({"username": username, "email": email},
+                                               {"$set": {"password": encrypted_password}})
+        if update_cursor.modified_count == 1:
+            response = appconstants.USER_UPDATE
+            await _invalidate(email)
+        else:
+            response = appconstants.USER_UPDATE_FAILED
+    except password_hasher.PasswordHasherBusy as ex:
+        response = appconstants.PASSWORD_HASHER_BUSY
+        logging.error('Exception at update_user %s', str(ex))
+    except pymongo.errors.ConnectionFailure as ex:
+        response = appconstants.MONGODB_CONNECTIVITY_ISSUE
+        logging.error('Exception at update_user %s', str(ex))
+    return response
+
+
+async def list_user(email, limit=None, before=None, version=None):
+    """
+    The function "list_user" retrieves user information from a MongoDB document, see
+    mongo_db_connector.list_user.
+
+    :param email: The email parameter is the email address of the user
+    :param limit: The limit parameter is the maximum number of login entries, or None
+    :param before: The before parameter is an epoch timestamp bounding the login entries, or None
+    :param version: The version is the profile version the response is labelled with, or None
+    :return: a dictionary containing information about the user.
+    """
+    if not email_filter.FILTER.might_exist(email):
+        return appconstants.USER_NOT_FOUND
+    cache_key = (email, limit, before)
+    if profile_cache.PROFILE_CACHE_ENABLED:
+        response = profile_cache.CACHE.get(cache_key, version)
+        if response is not None:
+            return response
+        snapshot = profile_cache.CACHE.snapshot(email)
+    response = {}
+    try:
+        cursor = await users().aggregate(
+            mongo_db_connector.list_user_pipeline(email, limit, before))
+        documents = await cursor.to_list(1)
+        response = mongo_db_connector.list_user_response(
+            documents[0] if documents else None, limit)
+        if response is appconstants.USER_NOT_FOUND:
+            email_filter.FILTER.record_false_positive(email)
+        if profile_cache.PROFILE_CACHE_ENABLED:
+            profile_cache.CACHE.put(cache_key, snapshot, response, version)
+    except pymongo.errors.ConnectionFailure as ex:
+        response = appconstants.MONGODB_CONNECTIVITY_ISSUE
+        logging.error('Exception at list_user %s', str(ex))
+    return response
+
+
+async def list_users(emails):
+    """
+    The function `list_users` retrieves the profiles of several users, see
+    mongo_db_connector.list_users. The $in queries of both collections run concurrently.
+
+    :param emails: The emails parameter is a list of email addresses
+    :return: the list of the list_user responses, in the order of emails.
+    """
+    responses, missing, snapshots = mongo_db_connector.list_users_lookup(emails)
+    if missing:
+        try:
+            profiles, logins = await asyncio.gather(
+                users().find({"email": {"$in": missing}},
+                             {"_id": 0, "username": 1, "email": 1}).to_list(None),
+                userlogin().find({"email": {"$in": missing}},
+                                 {"_id": 0, "email": 1, "lastlogin": 1}).to_list(None))
+            mongo_db_connector.list_users_fill(
+                responses, {email: snapshots.get(email) for email in missing}, profiles, logins)
+        except pymongo.errors.ConnectionFailure as ex:
+            logging.error('Exception at list_users %s', str(ex))
+    return [responses.get(email, appconstants.MONGODB_CONNECTIVITY_ISSUE) for email in emails]
+
+
+async def login_user(email, password):
+    """
+    The function `login_user` verifies the password of the user, and on success records the
+    login and issues a token, see mongo_db_connector.login_user. The login history update runs
+    concurrently with the rehash of an outdated password hash, the profile is invalidated once
+    the update is written. The token is stored once the MongoDB writes are done.
+
+    :param email: The email parameter is the email address of the user trying to log in
+    :param password: The password is the user's plain text password
+    :return: a dictionary containing the status of the user login and a token, or the Redis
+    connectivity exception if the token could not be stored.
+    """
+    response = {}
+    if not session_token.is_signed_mode() and not circuit_breaker.REDIS.available():
+        return appconstants.REDIS_CONNECTIVITY_ISSUE
+    if not email_filter.FILTER.might_exist(email):
+        return appconstants.USER_LOGIN_FAILED
+    try:
+        cursor = await users().find_one({"email": email}, {"password": 1})
+        if cursor is None:
+            email_filter.FILTER.record_false_positive(email)
+        if cursor is None or not await _in_thread(
+                password_hasher.verify_password, password, cursor["password"]):
+            response = appconstants.USER_LOGIN_FAILED
+        else:
+            writes = []
+            if not mongo_db_connector.LOGIN_HISTORY.record(email, time.time()):
+                writes = [_record_login(email)]
+            if password_hasher.needs_rehash(cursor["password"]):
+                writes.append(_rehash_password(cursor, password))
+            await asyncio.gather(*writes)
+            if session_token.is_signed_mode():
+                token = session_token.issue_token(email)
+            else:
+                token = uuid.uuid4().hex[:6].upper()
+                if not await async_redis_cache.persist_client_token(email, token):
+                    return appconstants.REDIS_CONNECTIVITY_ISSUE
+            response = dict(appconstants.USER_LOGIN_SUCCESS, token=token)
+    except password_hasher.PasswordHasherBusy as ex:
+        response = appconstants.PASSWORD_HASHER_BUSY
+        logging.error('Exception at login_user %s', str(ex))
+    except pymongo.errors.ConnectionFailure as ex:
+        response = appconstants.MONGODB_CONNECTIVITY_ISSUE
+        logging.error('Exception at login_user %s', str(ex))
+    return response
+
+
+async def _record_login(email):
+    """
+    The function `_record_login` writes the login history of a user, then invalidates the
+    cached profile, a reader in between would cache the previous login again.
+    """
+    await userlogin().update_one({"email": email}, mongo_db_connector.login_history_update(),
+                                 upsert=True)
+    await _invalidate(email)
+
+
+async def _rehash_password(cursor, password):
+    """
+    The function `_rehash_password` replaces an outdated password hash, see
+    mongo_db_connector._rehash_password.
+    """
+    try:
+        encrypted_password = await _in_thread(password_hasher.hash_password, password)
+        await users().update_one({"_id": cursor["_id"], "password": cursor["password"]},
+                               {"$set": {"password": encrypted_password}})
+    except password_hasher.PasswordHasherBusy as ex:
+        logging.error('Exception at _rehash_password %s', str(ex))
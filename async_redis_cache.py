@@ -0,0 +1,267 @@
+"""
+    The module provides the asyncio counterparts of the redis_cache functions, used by the
+    ASGI server. The keys, the Lua scripts, the configuration and the placement of the keys on
+    the Redis nodes are shared with redis_cache.
+"""
+import time
+import asyncio
+import logging
+import redis.asyncio
+import redis_cache
+import hash_ring
+import metrics
+import circuit_breaker
+
+# Ring and nodes of this process, created on first use by _connection
+_CONNECTION = None
+
+
+def _connection():
+    """
+    The function _connection returns the hash ring and the nodes of this process, creating them
+    on first use, see redis_cache._connection.
+
+    :return: a tuple of the hash ring and the list of the nodes, each a tuple of its asyncio
+    connection pool, its client and the dictionary of its registered scripts.
+    """
+    global _CONNECTION
+    if _CONNECTION is None:
+        nodes = []
+        for node in redis_cache.redis_nodes():
+            pool = redis.asyncio.BlockingConnectionPool(**redis_cache.connection_options(node))
+            client_ = metrics.instrument_async_redis(circuit_breaker.guard_redis(
+                redis.asyncio.Redis(connection_pool=pool), circuit_breaker.REDIS))
+            nodes.append((pool, client_, {source: client_.register_script(source)
+                                          for source in redis_cache.SCRIPTS}))
+        _CONNECTION = (hash_ring.HashRing(redis_cache.redis_nodes(),
+                                          hash_ring.REDIS_VIRTUAL_NODES), nodes)
+    return _CONNECTION
+
+
+def _node(key=None):
+    """
+    The function _node returns the node of a key, or the primary node.
+    """
+    ring, nodes = _connection()
+    return nodes[0 if key is None else ring.index(key)]
+
+
+def client(key=None):
+    """
+    The function client returns the asyncio Redis client of the node of a key, or of the
+    primary node, see redis_cache.client.
+    """
+    return _node(key)[1]
+
+
+def _script(source, key=None):
+    """
+    The function _script returns the registered script of a Lua source on the node of a key.
+    """
+    return _node(key)[2][source]
+
+
+async def close():
+    """
+    The function close disconnects the asyncio connection pools of this process, at the
+    shutdown of the server.
+    """
+    global _CONNECTION
+    connection, _CONNECTION = _CONNECTION, None
+    if connection is not None:
+        await asyncio.gather(*(pool.disconnect() for pool, _, _ in connection[1]))
+
+
+async def ping():
+    """
+    The function ping checks, through the Redis circuit breaker, that every Redis node answers,
+    concurrently.
+
+    :return: a boolean value. It returns True if every node answered the PING command.
+    """
+    try:
+        return all(await asyncio.gather(*(node[1].ping() for node in _connection()[1])))
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at ping %s', str(ex))
+        return False
+
+async def persist_client_token(email, token):
+    """
+    The function persist_client_token stores a client token in Redis as a new session of the
+    client, see redis_cache.persist_client_token.
+
+    :param email: The email parameter is a string that represents the email address of the client
+    :param token: The token is the token of the new session
+    :return: a boolean value. It returns True if the token was stored.
+    """
+    key = redis_cache.SESSION_KEY_PREFIX + email
+    try:
+        await _script(redis_cache.PERSIST_LUA, key)(
+            keys=[key], args=[time.time(), redis_cache.SESSION_TTL, token])
+        return True
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at persist_client_token %s', str(ex))
+        return False
+
+
+async def remove_client_tokens(email, token=None):
+    """
+    The function `remove_client_tokens` removes a session of the client, or every session of the
+    client if no token is given, see redis_cache.remove_client_tokens.
+
+    :param email: The email parameter is a string that represents the email address of a client
+    :param token: The token parameter is the token of the session to remove, or None
+    :return: the number of live sessions removed, or None if Redis could not be reached.
+    """
+    key = redis_cache.SESSION_KEY_PREFIX + email
+    try:
+        return await _script(redis_cache.REMOVE_LUA, key)(
+            keys=[key], args=[time.time(), token or ""])
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at remove_client_tokens %s', str(ex))
+        return None
+
+
+async def is_client_token_persists(email, token=None):
+    """
+    The function checks if a client token persists in Redis for a given email, see
+    redis_cache.is_client_token_persists.
+
+    :param email: The email parameter is a string that represents the email address of a client
+    :param token: The token parameter is the token of the session to check, or None
+    :return: a boolean value. It returns True if a live token of the client exists.
+    """
+    key = redis_cache.SESSION_KEY_PREFIX + email
+    try:
+        alive = await _script(redis_cache.CHECK_LUA, key)(
+            keys=[key],
+            args=[time.time(), redis_cache.SESSION_TTL,
+                  1 if redis_cache.SESSION_SLIDING_EXPIRY else 0, token or ""])
+        return alive > 0
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at is_client_token_persists %s', str(ex))
+        return False
+
+
+async def check_client_tokens(sessions):
+    """
+    The function check_client_tokens checks the sessions of several clients, the nodes being
+    called concurrently, see redis_cache.check_client_tokens.
+
+    :param sessions: The sessions is a list of ( email, token ) tuples
+    :return: the list of the boolean values of the sessions, or None if Redis could not be
+    reached.
+    """
+    keys = [redis_cache.SESSION_KEY_PREFIX + email for email, _ in sessions]
+    now = time.time()
+
+    async def execute(index, positions):
+        node = _connection()[1][index]
+        pipeline = node[1].pipeline(transaction=False)
+        for position in positions:
+            await node[2][redis_cache.CHECK_LUA](
+                keys=[keys[position]],
+                args=[now, redis_cache.SESSION_TTL, 0, sessions[position][1] or ""],
+                client=pipeline)
+        return positions, await pipeline.execute()
+
+    try:
+        alive = [False] * len(sessions)
+        for positions, results in await asyncio.gather(
+                *(execute(index, positions)
+                  for index, positions in _connection()[0].group(keys).items())):
+            for position, result in zip(positions, results):
+                alive[position] = result > 0
+        return alive
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at check_client_tokens %s', str(ex))
+        return None
+
+
+async def hit_rate_limits(keys, limits, now):
+    """
+    The function hit_rate_limits counts an attempt against the rate limit counters of its
+    subjects, see redis_cache.hit_rate_limits.
+
+    :return: a ( index, retry after ) tuple, or None if Redis could not be reached.
+    """
+    async def hit(index, positions):
+        args = [now]
+        for position in positions:
+            args.extend(limits[position])
+        rejected, retry_after = await _connection()[1][index][2][redis_cache.RATE_LIMIT_LUA](
+            keys=[keys[position] for position in positions], args=args)
+        return (positions[int(rejected) - 1] + 1 if rejected else 0), int(retry_after)
+
+    try:
+        results = await asyncio.gather(*(hit(index, positions) for index, positions
+                                         in _connection()[0].group(keys).items()))
+        return min((result for result in results if result[0]), default=(0, 0))
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at hit_rate_limits %s', str(ex))
+        return None
+
+
+async def profile_version(email):
+    """
+    The function profile_version returns the version of the profile of the user, see
+    redis_cache.profile_version.
+
+    :return: the version, as a string, or None if Redis could not be reached.
+    """
+    key = redis_cache.PROFILE_VERSION_KEY_PREFIX + email
+    try:
+        version = await _script(redis_cache.PROFILE_VERSION_LUA, key)(
+            keys=[key],
+            args=[int(time.time() * 1000), redis_cache.PROFILE_VERSION_TTL])
+        return version.decode('utf-8') if isinstance(version, bytes) else str(version)
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at profile_version %s', str(ex))
+        return None
+
+
+async def publish_profile_invalidation(email, publish=True, bump_version=True):
+    """
+    The function publish_profile_invalidation asks every worker to evict the cached profile of
+    the user, and bumps the version of the profile, see
+    redis_cache.publish_profile_invalidations. The node of the version and the primary node
+    are called concurrently if they differ.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :return: a boolean value. It returns True if the message was published.
+    """
+    key = redis_cache.PROFILE_VERSION_KEY_PREFIX + email
+    ring, nodes = _connection()
+    pipelines = {}
+    try:
+        if bump_version:
+            index = ring.index(key)
+            pipelines[index] = nodes[index][1].pipeline(transaction=False)
+            await nodes[index][2][redis_cache.BUMP_PROFILE_VERSIONS_LUA](
+                keys=[key], args=[int(time.time() * 1000), redis_cache.PROFILE_VERSION_TTL],
+                client=pipelines[index])
+        if publish:
+            if 0 not in pipelines:
+                pipelines[0] = nodes[0][1].pipeline(transaction=False)
+            pipelines[0].publish(redis_cache.PROFILE_INVALIDATION_CHANNEL, email)
+        await asyncio.gather(*(pipeline.execute() for pipeline in pipelines.values()))
+        return True
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at publish_profile_invalidation %s', str(ex))
+        return False
+
+
+async def publish_email_addition(email):
+    """
+    The function publish_email_addition asks every worker to add a new user to its email
+    filter, see redis_cache.publish_email_additions.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :return: a boolean value. It returns True if the message was published.
+    """
+    try:
+        await client().publish(redis_cache.EMAIL_ADDITION_CHANNEL, email)
+        return True
+    except redis_cache.REDIS_ERRORS as ex:
+        logging.error('Exception at publish_email_addition %s', str(ex))
+        return False
@@ -0,0 +1,183 @@
+"""
+    The module provides the batch lookups of the admin tooling, the session status and the
+    profiles of many users in a single request.
+
+    A batch is a JSON object body {"emails": [...]} of at most BATCH_MAX_SIZE entries, an entry
+    being an email, or an object {"email": ..., "token": ...} to check a single session. The
+    batch is resolved LOOKUP_CHUNK_SIZE entries at a time: the session status with a single
+    pipelined Redis round trip per node, the profiles with a single $in query on each MongoDB
+    collection. The results are streamed as NDJSON, one line per entry, in input order, each
+    chunk being written before the next one is resolved.
+"""
+import os
+import json
+import redis_cache
+import mongo_db_connector
+import session_token
+import request_schema
+import json_responses
+import appconstants
+
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "1000"))
+
+# Number of entries resolved per round trip
+LOOKUP_CHUNK_SIZE = 250
+
+
+def parse_batch(body):
+    """
+    The function parse_batch parses the body of a batch request.
+
+    :param body: The body is the request body, as bytes
+    :return: a ( entries, error, status code ) tuple, entries is the list of the entries if the
+    batch is valid, otherwise error is the error response and status code its status code.
+    """
+    try:
+        document = json.loads(body) if body else None
+    except ValueError:
+        return None, appconstants.BAD_JSON_BODY, 400
+    if not isinstance(document, dict):
+        return None, appconstants.BAD_JSON_BODY, 400
+    entries = document.get("emails")
+    if not isinstance(entries, list):
+        return None, appconstants.PARAM_EMAILS_ABSENT, 400
+    if len(entries) > BATCH_MAX_SIZE:
+        return None, appconstants.BATCH_TOO_LARGE, 413
+    return entries, None, 200
+
+
+def _entry(entry):
+    """
+    The function _entry validates an entry of a batch.
+
+    :return: a ( email, token, error ) tuple, error is the error response of an invalid entry.
+    """
+    email, token = entry, None
+    if isinstance(entry, dict):
+        email, token = entry.get("email"), entry.get("token")
+    if not isinstance(email, str) or not email:
+        return None, None, appconstants.PARAM_EMAIL_ABSENT
+    if request_schema.EMAIL.match(email) is None:
+        return None, None, appconstants.BAD_EMAIL_VALUE
+    return email, token if isinstance(token, str) and token else None, None
+
+
+def chunks(entries):
+    """
+    The function chunks splits the entries of a batch into ( start index, chunk ) tuples.
+    """
+    for start in range(0, len(entries), LOOKUP_CHUNK_SIZE):
+        yield start, entries[start:start + LOOKUP_CHUNK_SIZE]
+
+
+def session_chunk(start, chunk):
+    """
+    The function session_chunk validates a chunk of a session status batch. In the signed token
+    mode the sessions are checked here, in-process, and the token of an entry is mandatory.
+
+    :param start: The start is the index of the first entry of the chunk in the batch
+    :param chunk: The chunk is the list of the entries
+    :return: a ( results, pending ) tuple, results is the list of the result dictionaries of the
+    chunk, pending the list of the ( result, email, token ) tuples of the sessions to check in
+    Redis.
+    """
+    results = []
+    pending = []
+    signed = session_token.is_signed_mode()
+    for index, entry in enumerate(chunk, start):
+        email, token, error = _entry(entry)
+        result = {"index": index}
+        if error is not None:
+            result.update(error)
+        else:
+            result["email"] = email
+            if not signed:
+                pending.append((result, email, token))
+            elif token is None:
+                result.update(appconstants.PARAM_TOKEN_ABSENT)
+            else:
+                result["logged_in"] = session_token.is_token_valid(email, token)
+        results.append(result)
+    return results, pending
+
+
+def session_fill(pending, alive):
+    """
+    The function session_fill completes the results of the sessions checked in Redis.
+
+    :param pending: The pending is the list returned by session_chunk
+    :param alive: The alive is the list returned by redis_cache.check_client_tokens, or None
+    """
+    for position, (result, _, _) in enumerate(pending):
+        if alive is None:
+            result.update(appconstants.REDIS_CONNECTIVITY_ISSUE)
+        else:
+            result["logged_in"] = alive[position]
+
+
+def session_status(entries):
+    """
+    The function session_status checks the sessions of a batch, chunk by chunk.
+
+    :param entries: The entries is the list returned by parse_batch
+    :return: a generator of NDJSON result lines as bytes, one per entry, in input order, with
+    the keys "index", "email" and "logged_in", or the error of the entry.
+    """
+    for start, chunk in chunks(entries):
+        results, pending = session_chunk(start, chunk)
+        if pending:
+            session_fill(pending, redis_cache.check_client_tokens(
+                [(email, token) for _, email, token in pending]))
+        for result in results:
+            yield json_responses.encode(result)
+
+
+def profile_chunk(start, chunk):
+    """
+    The function profile_chunk validates a chunk of a profile batch.
+
+    :param start: The start is the index of the first entry of the chunk in the batch
+    :param chunk: The chunk is the list of the entries
+    :return: a ( results, pending ) tuple, results is the list of the result dictionaries of the
+    chunk, pending the list of the ( result, email ) tuples of the profiles to fetch.
+    """
+    results = []
+    pending = []
+    for index, entry in enumerate(chunk, start):
+        email, _, error = _entry(entry)
+        result = {"index": index}
+        if error is not None:
+            result.update(error)
+        else:
+            result["email"] = email
+            pending.append((result, email))
+        results.append(result)
+    return results, pending
+
+
+def profile_fill(pending, responses):
+    """
+    The function profile_fill completes the results of the profiles fetched.
+
+    :param pending: The pending is the list returned by profile_chunk
+    :param responses: The responses is the list returned by mongo_db_connector.list_users
+    """
+    for (result, _), response in zip(pending, responses):
+        result.update(response)
+
+
+def profiles(entries):
+    """
+    The function profiles fetches the profiles of a batch, chunk by chunk.
+
+    :param entries: The entries is the list returned by parse_batch
+    :return: a generator of NDJSON result lines as bytes, one per entry, in input order, with
+    the key "index" and the list_user response of the entry, or the error of the entry.
+    """
+    for start, chunk in chunks(entries):
+        results, pending = profile_chunk(start, chunk)
+        if pending:
+            profile_fill(pending, mongo_db_connector.list_users(
+                [email for _, email in pending]))
+        for result in results:
+            yield json_responses.encode(result)
@@ -0,0 +1,80 @@
+"""
+    The module benchmarks the hash_ring module, reporting as JSON, for several numbers of Redis
+    nodes and virtual nodes:
+        the balance of the session keys over the nodes, the largest and the smallest share
+        the share of the keys which move when a node is added, or the last node removed, the
+        ideal being 1 / n of the keys
+        the time to place a key
+
+    $ python benchmark/bench_hash_ring.py --keys 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import hash_ring  # pylint: disable=wrong-import-position
+
+
+def nodes_of(count):
+    """
+    The function nodes_of returns the ( host, port ) of count local Redis nodes.
+    """
+    return [("localhost", 6379 + index) for index in range(count)]
+
+
+def moved_share(keys, before, after):
+    """
+    The function moved_share returns the share of the keys placed on another node by the ring
+    after, nodes being compared by address.
+    """
+    moved = sum(1 for key in keys
+                if before.nodes[before.index(key)] != after.nodes[after.index(key)])
+    return moved / len(keys)
+
+
+def run(keys, node_count, virtual_nodes):
+    """
+    The function run measures a ring of node_count nodes.
+    """
+    ring = hash_ring.HashRing(nodes_of(node_count), virtual_nodes)
+    started = time.perf_counter()
+    counts = [0] * node_count
+    for key in keys:
+        counts[ring.index(key)] += 1
+    elapsed = time.perf_counter() - started
+    added = hash_ring.HashRing(nodes_of(node_count + 1), virtual_nodes)
+    removed = None
+    if node_count > 1:
+        removed = hash_ring.HashRing(nodes_of(node_count - 1), virtual_nodes)
+    return {"nodes": node_count, "virtual_nodes": virtual_nodes,
+            "max_share": round(max(counts) / len(keys), 4),
+            "min_share": round(min(counts) / len(keys), 4),
+            "moved_on_add": round(moved_share(keys, ring, added), 4),
+            "ideal_moved_on_add": round(1 / (node_count + 1), 4),
+            "moved_on_remove": round(moved_share(keys, ring, removed), 4) if removed else None,
+            "us_per_key": round(elapsed / len(keys) * 1e6, 3)}
+
+
+def main():
+    """
+    The function main parses the command line and prints the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--nodes", default="2,3,4,8")
+    parser.add_argument("--virtual-nodes", default="1,40,160")
+    args = parser.parse_args()
+
+    keys = ["session:user%d@example.com" % index for index in range(args.keys)]
+    results = [run(keys, int(node_count), int(virtual_nodes))
+               for node_count in args.nodes.split(",")
+               for virtual_nodes in args.virtual_nodes.split(",")]
+    print(json.dumps({"keys": args.keys, "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
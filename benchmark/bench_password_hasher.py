@@ -0,0 +1,89 @@
+"""
+    The module benchmarks the password_hasher module, reporting the throughput and the latency
+    percentiles of hash_password at several cost settings as JSON.
+
+    $ python benchmark/bench_password_hasher.py --requests 200 --concurrency 16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import password_hasher  # pylint: disable=wrong-import-position
+
+# ( algorithm, cost parameters ) pairs, from cheap to expensive
+COST_SETTINGS = [
+    ("scrypt", {"SCRYPT_N": 2 ** 13, "SCRYPT_R": 8, "SCRYPT_P": 1}),
+    ("scrypt", {"SCRYPT_N": 2 ** 14, "SCRYPT_R": 8, "SCRYPT_P": 1}),
+    ("scrypt", {"SCRYPT_N": 2 ** 15, "SCRYPT_R": 8, "SCRYPT_P": 1}),
+    ("pbkdf2_sha256", {"PBKDF2_ITERATIONS": 100000}),
+    ("pbkdf2_sha256", {"PBKDF2_ITERATIONS": 260000}),
+    ("pbkdf2_sha256", {"PBKDF2_ITERATIONS": 600000}),
+]
+
+
+def percentile(samples, fraction):
+    """
+    The function percentile returns the given percentile of a sorted list of samples.
+    """
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+def timed_hash(password):
+    """
+    The function timed_hash hashes a password and returns the latency in seconds, or None if
+    the request was shed.
+    """
+    started = time.perf_counter()
+    try:
+        password_hasher.hash_password(password)
+    except password_hasher.PasswordHasherBusy:
+        return None
+    return time.perf_counter() - started
+
+
+def run_setting(algorithm, params, requests, concurrency):
+    """
+    The function run_setting runs the benchmark for one cost setting.
+    """
+    password_hasher.PASSWORD_HASH_ALGORITHM = algorithm
+    for name, value in params.items():
+        setattr(password_hasher, name, value)
+    # warm up the process pool
+    password_hasher.hash_password("warmup-password")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_hash, ["benchmark-password"] * requests))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(result for result in results if result is not None)
+    report = {"algorithm": algorithm, "params": params, "requests": requests,
+              "concurrency": concurrency, "shed": results.count(None),
+              "throughput_per_sec": round(len(latencies) / elapsed, 2)}
+    if latencies:
+        report.update({"p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+                       "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                       "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)})
+    return report
+
+
+def main():
+    """
+    The function main parses the command line and prints the report of every cost setting.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    reports = [run_setting(algorithm, params, args.requests, args.concurrency)
+               for algorithm, params in COST_SETTINGS]
+    print(json.dumps({"workers": password_hasher.PASSWORD_HASH_WORKERS,
+                      "queue_size": password_hasher.PASSWORD_HASH_QUEUE_SIZE,
+                      "results": reports}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
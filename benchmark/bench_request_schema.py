@@ -0,0 +1,127 @@
+"""
+    The module benchmarks the validation of the request parameters, reporting as JSON, for valid
+    and invalid requests of several routes, the time per request of:
+        the chains of validate_param checks the routes used before request_schema
+        the compiled validator of request_schema, with the parameters in the query string
+        the compiled validator of request_schema, with the parameters in a JSON body
+
+    Only the validation is measured, without the request handling, the parameters being held in
+    a werkzeug MultiDict as the query string of a Flask request.
+
+    $ python benchmark/bench_request_schema.py --iterations 200000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from werkzeug.datastructures import MultiDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import validate_param  # pylint: disable=wrong-import-position
+import request_schema  # pylint: disable=wrong-import-position
+import appconstants  # pylint: disable=wrong-import-position
+
+
+def create_user_chain(args):
+    """
+    The function create_user_chain validates the parameters of /create/user as the route did
+    before request_schema.
+    """
+    username = args.get("username")
+    email = args.get("email")
+    password = args.get("password")
+    if not (validate_param.is_parameter_value_valid(username)
+            and validate_param.is_parameter_value_valid(email)
+            and validate_param.is_parameter_value_valid(password)):
+        return appconstants.MANDATORY_PARAMETER_U_E_P_MISSING
+    if not validate_param.is_parameter_value_valid_email(email):
+        return appconstants.BAD_EMAIL_VALUE
+    if not validate_param.is_parameter_value_valid_password(password):
+        return appconstants.BAD_PASSWORD_VALUE
+    return None
+
+
+def list_user_chain(args):
+    """
+    The function list_user_chain validates the parameters of /list/user as the route did before
+    request_schema.
+    """
+    email = args.get("email")
+    limit = args.get("limit")
+    before = args.get("before")
+    if not validate_param.is_parameter_value_valid(email):
+        return appconstants.PARAM_EMAIL_ABSENT
+    if not validate_param.is_parameter_value_valid_email(email):
+        return appconstants.BAD_EMAIL_VALUE
+    if limit is not None and not validate_param.is_parameter_value_valid_limit(limit):
+        return appconstants.BAD_LIMIT_VALUE
+    if before is not None and not validate_param.is_parameter_value_valid_timestamp(before):
+        return appconstants.BAD_BEFORE_VALUE
+    # the route converted the values after the checks
+    _ = None if limit is None else int(limit), None if before is None else float(before)
+    return None
+
+
+# ( name, chain, schema, parameters )
+CASES = [
+    ("create_user_valid", create_user_chain, request_schema.CREATE_USER,
+     {"username": "bench", "email": "bench@example.com", "password": "12345678"}),
+    ("create_user_missing", create_user_chain, request_schema.CREATE_USER,
+     {"username": "bench"}),
+    ("create_user_bad_email", create_user_chain, request_schema.CREATE_USER,
+     {"username": "bench", "email": "bad", "password": "12345678"}),
+    ("create_user_bad_password", create_user_chain, request_schema.CREATE_USER,
+     {"username": "bench", "email": "bench@example.com", "password": "short"}),
+    ("list_user_valid", list_user_chain, request_schema.LIST_USER,
+     {"email": "bench@example.com", "limit": "10", "before": "1700000000.5"}),
+    ("list_user_bad_limit", list_user_chain, request_schema.LIST_USER,
+     {"email": "bench@example.com", "limit": "0"}),
+]
+
+
+def measure(function, iterations):
+    """
+    The function measure returns the time of a call of function, in microseconds.
+    """
+    for _ in range(min(iterations, 1000)):
+        function()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return round((time.perf_counter() - started) / iterations * 1e6, 3)
+
+
+def run(name, chain, schema, params, iterations):
+    """
+    The function run measures a case, after checking that both validators agree.
+    """
+    args = MultiDict(params)
+    body = json.dumps(params).encode('utf-8')
+    empty = MultiDict()
+    _, error = schema.validate(args)
+    if error != chain(args):
+        raise AssertionError("%s: request_schema and the chain disagree" % name)
+    chain_us = measure(lambda: chain(args), iterations)
+    schema_us = measure(lambda: schema.validate(args), iterations)
+    return {"case": name, "chain_us": chain_us, "schema_us": schema_us,
+            "schema_json_body_us": measure(lambda: schema.validate(empty, body), iterations),
+            "speedup": round(chain_us / schema_us, 2)}
+
+
+def main():
+    """
+    The function main parses the command line and prints the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    results = [run(name, chain, schema, params, args.iterations)
+               for name, chain, schema, params in CASES]
+    print(json.dumps({"iterations": args.iterations, "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
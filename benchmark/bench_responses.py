@@ -0,0 +1,111 @@
+"""
+    The module benchmarks the per-request cost of the error and status responses of the Flask
+    app, which answer without a backend call, hence their cost is the request handling and the
+    JSON rendering of the response. For each path it reports, as JSON, the time per request and
+    the peak memory allocated while handling a request, and the time of the view and its
+    response alone.
+
+    A request is dispatched inside a request context, without the WSGI test client, so that the
+    measure is not dominated by the client.
+
+    $ python benchmark/bench_responses.py --iterations 20000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# ( name, method, path, query parameters ), paths answered without a backend call
+PATHS = [
+    ("list_user_missing_email", "GET", "/list/user", {}),
+    ("list_user_bad_email", "GET", "/list/user", {"email": "bad"}),
+    ("create_user_missing", "POST", "/create/user", {}),
+    ("create_user_bad_email", "POST", "/create/user",
+     {"username": "bench", "email": "bad", "password": "12345678"}),
+    ("login_user_missing", "POST", "/login/user", {}),
+    ("update_user_missing", "PUT", "/update/user", {}),
+    ("delete_user_bad_email", "DELETE", "/delete/user", {"username": "bench", "email": "bad"}),
+    ("admin_token_invalid", "POST", "/admin/profile/stop", {}),
+    ("health_live", "GET", "/health/live", {}),
+]
+
+
+def dispatch(app, method, path, params):
+    """
+    The function dispatch handles a request and returns the response body.
+    """
+    with app.test_request_context(path, method=method, query_string=params):
+        return app.full_dispatch_request().get_data()
+
+
+def view_response(app, method, path, params, iterations):
+    """
+    The function view_response measures the view of a path and the building of its response,
+    within a single request context.
+    """
+    with app.test_request_context(path, method=method, query_string=params) as context:
+        view = app.view_functions[context.request.url_rule.endpoint]
+        for _ in range(min(iterations, 1000)):
+            app.make_response(view()).get_data()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            app.make_response(view()).get_data()
+        return time.perf_counter() - started
+
+
+def run_path(app, method, path, params, iterations):
+    """
+    The function run_path measures a path, the time over every iteration and the allocation
+    peak over a tenth of them, traced separately since tracing slows the requests down.
+    """
+    for _ in range(min(iterations, 1000)):
+        dispatch(app, method, path, params)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        dispatch(app, method, path, params)
+    elapsed = time.perf_counter() - started
+
+    peaks = []
+    tracemalloc.start()
+    for _ in range(max(1, iterations // 10)):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        dispatch(app, method, path, params)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    peaks.sort()
+    view_elapsed = view_response(app, method, path, params, iterations)
+    return {"us_per_request": round(elapsed / iterations * 1e6, 2),
+            "view_us_per_request": round(view_elapsed / iterations * 1e6, 2),
+            "peak_bytes_per_request": peaks[len(peaks) // 2],
+            "body": dispatch(app, method, path, params).decode("utf-8").strip()}
+
+
+def main():
+    """
+    The function main parses the command line and prints the report of every path.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    for name in ("MONGODB_HOST", "REDIS_HOST"):
+        os.environ.setdefault(name, "localhost")
+    for name, port in (("MONGODB_PORT", "27017"), ("REDIS_PORT", "6379")):
+        os.environ.setdefault(name, port)
+    import standins  # pylint: disable=import-outside-toplevel
+    standins.install()
+    import server  # pylint: disable=import-outside-toplevel
+
+    report = {name: run_path(server.APP, method, path, params, args.iterations)
+              for name, method, path, params in PATHS}
+    print(json.dumps({"iterations": args.iterations, "results": report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,418 @@
+"""
+    The module is the load test harness of the Application. It drives the routes of server.py at
+    a configurable concurrency and request mix, or replays a trace, and reports the throughput
+    and the p50 / p95 / p99 latency of every endpoint as JSON.
+
+    By default the Flask app runs in-process against the stand-ins of benchmark/standins.py, so
+    no MongoDB or Redis is needed. With --url the requests are sent over HTTP to a running
+    server instead ( WSGI or ASGI ).
+
+    A trace is a JSON lines file, one request per line:
+        {"method": "GET", "path": "/list/user", "params": {"email": "a@b.com"}}
+        {"method": "POST", "path": "/bulk/create/user", "params": {}, "body": "...", "admin": true}
+
+    The requests of the admin endpoints are marked "admin", they are sent with the X-Admin-Token
+    header holding --admin-token, which is not written to the traces. The requests marked
+    "revalidate" are conditional, they are sent with If-None-Match holding the ETag of the last
+    response to the same request, as a caching client does, and reported apart.
+
+    In the regression mode ( --baseline ), the report is compared with a stored report, and the
+    run fails if an endpoint's p99 latency grew, or its throughput dropped, by more than
+    --threshold.
+
+    $ python benchmark/load_test.py --requests 5000 --concurrency 16 --output report.json
+    $ python benchmark/load_test.py --requests 5000 --concurrency 16 --baseline report.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PASSWORD = "benchmark1"
+
+# Default request mix, endpoint name: weight
+DEFAULT_MIX = {
+    "list_user": 30, "list_user_etag": 10, "check_logged_in": 30, "login_user": 10, "log_out": 5,
+    "create_user": 5, "update_user": 4, "delete_user": 3, "export_users": 1,
+    "bulk_create_user": 1, "batch_check_logged_in": 1, "batch_list_user": 1, "metrics": 1,
+    "health_live": 1, "health_ready": 1, "session_stats": 1, "profile_cache_stats": 1,
+}
+# Users per request of the batch endpoints
+BATCH_SIZE = 20
+
+
+def percentile(samples, fraction):
+    """
+    The function percentile returns the given percentile of a sorted list of samples.
+    """
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+class Workload:
+    """
+    The class Workload generates the requests of the request mix. The requests refer to the
+    users created by the setup, new users get unique emails.
+    """
+
+    def __init__(self, mix, users, seed):
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.random = random.Random(seed)
+        self.users = ["bench%d@bench.com" % number for number in range(users)]
+        self.created = 0
+
+    def setup(self):
+        """
+        The function setup returns the requests creating and logging in the initial users.
+        """
+        requests = [self._request("POST", "/create/user", username=email.split("@")[0],
+                                  email=email, password=PASSWORD) for email in self.users]
+        requests += [self._request("POST", "/login/user", email=email, password=PASSWORD)
+                     for email in self.users]
+        return requests
+
+    @staticmethod
+    def _request(method, path, body=None, admin=False, revalidate=False, **params):
+        request = {"method": method, "path": path, "params": params}
+        if body is not None:
+            request["body"] = body
+        if admin:
+            request["admin"] = True
+        if revalidate:
+            request["revalidate"] = True
+        return request
+
+    def _new_email(self):
+        self.created += 1
+        return "new%d-%d@bench.com" % (int(time.time()), self.created)
+
+    def next_requests(self):
+        """
+        The function next_requests draws the next endpoint of the mix, and returns its request.
+        A delete is preceded by the creation of the user it deletes, so that the run does not
+        deplete the initial users.
+        """
+        name = self.random.choices(self.names, self.weights)[0]
+        email = self.random.choice(self.users)
+        username = email.split("@")[0]
+        if name == "list_user":
+            return [self._request("GET", "/list/user", email=email)]
+        if name == "list_user_etag":
+            return [self._request("GET", "/list/user", revalidate=True, email=email)]
+        if name == "check_logged_in":
+            return [self._request("GET", "/login/user", email=email)]
+        if name == "login_user":
+            return [self._request("POST", "/login/user", email=email, password=PASSWORD)]
+        if name == "log_out":
+            return [self._request("GET", "/logout/user", email=email)]
+        if name == "update_user":
+            return [self._request("PUT", "/update/user", username=username, email=email,
+                                  password=PASSWORD)]
+        if name == "export_users":
+            return [self._request("GET", "/export/users", admin=True)]
+        if name in ("batch_check_logged_in", "batch_list_user"):
+            path = "/batch/login/user" if name == "batch_check_logged_in" else "/batch/list/user"
+            body = json.dumps({"emails": self.random.sample(self.users,
+                                                            min(BATCH_SIZE, len(self.users)))})
+            return [self._request("POST", path, body=body, admin=True)]
+        if name == "metrics":
+            return [self._request("GET", "/metrics")]
+        if name == "health_live":
+            return [self._request("GET", "/health/live")]
+        if name == "health_ready":
+            return [self._request("GET", "/health/ready")]
+        if name == "session_stats":
+            return [self._request("GET", "/stats/sessions")]
+        if name == "profile_cache_stats":
+            return [self._request("GET", "/stats/profile-cache")]
+        if name == "bulk_create_user":
+            lines = []
+            for _ in range(10):
+                email = self._new_email()
+                lines.append(json.dumps({"username": email.split("@")[0], "email": email,
+                                         "password": PASSWORD}))
+            return [self._request("POST", "/bulk/create/user", body="\n".join(lines),
+                                  admin=True)]
+        email = self._new_email()
+        username = email.split("@")[0]
+        requests = [self._request("POST", "/create/user", username=username, email=email,
+                                  password=PASSWORD)]
+        if name == "delete_user":
+            requests.append(self._request("DELETE", "/delete/user", username=username,
+                                          email=email))
+        elif name != "create_user":
+            raise ValueError("unknown endpoint " + name)
+        return requests
+
+    def requests(self, count):
+        """
+        The function requests draws count endpoints of the mix.
+
+        :return: a list of requests
+        """
+        requests = []
+        for _ in range(count):
+            requests.extend(self.next_requests())
+        return requests
+
+
+class Target:
+    """
+    The class Target builds the headers of the requests, and keeps the ETags of the responses
+    the conditional requests revalidate.
+    """
+
+    def __init__(self, admin_token):
+        self.admin_token = admin_token
+        self.etags = {}
+
+    @staticmethod
+    def _key(request):
+        return request["method"], request["path"], tuple(sorted(request["params"].items()))
+
+    def headers(self, request):
+        """
+        The function headers returns the headers of a request.
+        """
+        headers = {"X-Admin-Token": self.admin_token} if request.get("admin") else {}
+        if request.get("revalidate"):
+            etag = self.etags.get(self._key(request))
+            if etag is not None:
+                headers["If-None-Match"] = etag
+        return headers
+
+    def remember(self, request, etag):
+        """
+        The function remember keeps the ETag of the response to a request.
+        """
+        if etag is not None:
+            self.etags[self._key(request)] = etag
+
+
+class InProcessTarget(Target):
+    """
+    The class InProcessTarget sends the requests to the Flask app of server.py, in-process. The
+    unique email indexes are created as the launchers do at startup.
+    """
+
+    def __init__(self, admin_token):
+        super().__init__(admin_token)
+        import server  # pylint: disable=import-outside-toplevel
+        import mongo_db_connector  # pylint: disable=import-outside-toplevel
+        if not mongo_db_connector.create_indexes():
+            raise RuntimeError("Unique email indexes are not in place")
+        self.app = server.APP
+        self.local = threading.local()
+
+    def send(self, request):
+        """
+        The function send sends a request and returns the status code of the response.
+        """
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(request["path"], method=request["method"],
+                               query_string=request.get("params"), data=request.get("body"),
+                               headers=self.headers(request))
+        response.get_data()
+        self.remember(request, response.headers.get("ETag"))
+        return response.status_code
+
+
+class HttpTarget(Target):
+    """
+    The class HttpTarget sends the requests over HTTP, one keep-alive connection per thread.
+    """
+
+    def __init__(self, url, admin_token):
+        super().__init__(admin_token)
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.local = threading.local()
+
+    def send(self, request):
+        """
+        The function send sends a request and returns the status code of the response.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=30)
+        path = request["path"]
+        if request.get("params"):
+            path += "?" + urllib.parse.urlencode(request["params"])
+        body = request.get("body")
+        try:
+            connection.request(request["method"], path,
+                               body=None if body is None else body.encode('utf-8'),
+                               headers=self.headers(request))
+            response = connection.getresponse()
+            response.read()
+            self.remember(request, response.getheader("ETag"))
+            return response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            return 599
+
+
+def run(target, requests, concurrency):
+    """
+    The function run sends the requests with concurrency threads, and returns the report. It
+    raises the exception of a failed thread, the report would miss the requests it left.
+    """
+    samples = {}
+    statuses = {}
+    lock = threading.Lock()
+    iterator = iter(requests)
+
+    def worker():
+        while True:
+            with lock:
+                request = next(iterator, None)
+            if request is None:
+                return
+            endpoint = request["method"] + " " + request["path"]
+            if request.get("revalidate"):
+                endpoint += " If-None-Match"
+            started = time.perf_counter()
+            status = target.send(request)
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.setdefault(endpoint, []).append(elapsed)
+                counts = statuses.setdefault(endpoint, {})
+                counts[str(status)] = counts.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(worker) for _ in range(concurrency)]
+    duration = time.perf_counter() - started
+    for future in futures:
+        future.result()
+
+    endpoints = {}
+    for endpoint, latencies in sorted(samples.items()):
+        latencies.sort()
+        endpoints[endpoint] = {
+            "requests": len(latencies),
+            "throughput_per_sec": round(len(latencies) / duration, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "status": statuses[endpoint]}
+    total = sum(len(latencies) for latencies in samples.values())
+    return {"duration_sec": round(duration, 3), "requests": total,
+            "throughput_per_sec": round(total / duration, 2), "endpoints": endpoints}
+
+
+def compare(report, baseline, threshold):
+    """
+    The function compare lists the endpoints of the report which regressed against the baseline.
+
+    :return: a list of regression messages, empty if there is no regression
+    """
+    regressions = []
+    for endpoint, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if previous is None:
+            continue
+        if current["p99_ms"] > previous["p99_ms"] * (1 + threshold):
+            regressions.append("%s p99 %.3f ms > baseline %.3f ms" % (
+                endpoint, current["p99_ms"], previous["p99_ms"]))
+        if current["throughput_per_sec"] < previous["throughput_per_sec"] * (1 - threshold):
+            regressions.append("%s throughput %.2f/s < baseline %.2f/s" % (
+                endpoint, current["throughput_per_sec"], previous["throughput_per_sec"]))
+    return regressions
+
+
+def parse_mix(value):
+    """
+    The function parse_mix parses a request mix, "list_user=40,login_user=10".
+    """
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main():
+    """
+    The function main parses the command line, runs the load test and prints the report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server, default in-process")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=100,
+                        help="users created and logged in before the run, bench<n>@bench.com")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="request mix, ex. list_user=40,login_user=10")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--admin-token", default=os.environ.get("ADMIN_TOKEN", ""),
+                        help="X-Admin-Token of the admin endpoints, default ADMIN_TOKEN")
+    parser.add_argument("--trace", help="JSON lines trace to replay instead of the mix")
+    parser.add_argument("--write-trace", help="write the generated requests as a trace")
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--baseline", help="report to compare with, fail on regression")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed relative regression, default 0.2")
+    args = parser.parse_args()
+
+    if args.url:
+        target = HttpTarget(args.url, args.admin_token)
+    else:
+        for name in ("MONGODB_HOST", "REDIS_HOST"):
+            os.environ.setdefault(name, "localhost")
+        for name, port in (("MONGODB_PORT", "27017"), ("REDIS_PORT", "6379")):
+            os.environ.setdefault(name, port)
+        # every request comes from a single client IP, which the login rate limits would shed
+        os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+        os.environ["ADMIN_TOKEN"] = args.admin_token = args.admin_token or "benchmark"
+        import standins  # pylint: disable=import-outside-toplevel
+        standins.install()
+        target = InProcessTarget(args.admin_token)
+
+    # The setup is not measured, it also runs before a trace replay, so that a written trace
+    # replays against the same users.
+    workload = Workload(args.mix, args.users, args.seed)
+    run(target, workload.setup(), args.concurrency)
+    if args.trace:
+        with open(args.trace, encoding='utf-8') as trace:
+            requests = [json.loads(line) for line in trace if line.strip()]
+    else:
+        requests = workload.requests(args.requests)
+        if args.write_trace:
+            with open(args.write_trace, "w", encoding='utf-8') as trace:
+                trace.writelines(json.dumps(request) + "\n" for request in requests)
+
+    report = run(target, requests, args.concurrency)
+    report["config"] = {"url": args.url or "in-process", "concurrency": args.concurrency,
+                        "trace": args.trace, "mix": None if args.trace else args.mix}
+    if args.output:
+        with open(args.output, "w", encoding='utf-8') as output:
+            json.dump(report, output, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline:
+            regressions = compare(report, json.load(baseline), args.threshold)
+        for regression in regressions:
+            print("REGRESSION " + regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+    The module provides in-process stand-ins for MongoDB and Redis, so that the benchmarks run
+    offline. It replaces the pymongo and redis-py clients with mongomock and fakeredis clients.
+
+    install() must be called before the Application modules create their clients, ex. before
+    they are imported.
+
+    $ pip install mongomock "fakeredis[lua]"
+"""
+import pymongo
+import redis
+
+
+def _install_info():
+    """
+    The function _install_info adds the INFO command, which fakeredis does not know, to the fake
+    servers. It reports no memory and no expired or evicted keys, so that /stats/sessions runs.
+    """
+    from fakeredis._commands import command  # pylint: disable=import-outside-toplevel
+    try:
+        # pylint: disable-next=import-outside-toplevel
+        from fakeredis._socket._fakesocket import FakeSocket
+    except ImportError:
+        # older fakeredis releases
+        from fakeredis._fakesocket import FakeSocket  # pylint: disable=import-outside-toplevel
+    if hasattr(FakeSocket, "info"):
+        return
+
+    def info(self, *sections):  # pylint: disable=unused-argument
+        return b"used_memory:0\r\nused_memory_peak:0\r\nmaxmemory:0\r\nexpired_keys:0\r\n" \
+               b"evicted_keys:0\r\n"
+
+    FakeSocket.info = command((), (bytes,))(info)
+
+
+def install():
+    """
+    The function install patches pymongo.MongoClient and redis.Redis with the stand-ins. Every
+    Redis ( host, port ) gets its own fake server, hence several Redis nodes can be simulated.
+
+    :return: the dictionary of fake Redis servers, keyed by ( host, port )
+    """
+    import mongomock  # pylint: disable=import-outside-toplevel
+    import fakeredis  # pylint: disable=import-outside-toplevel
+
+    servers = {}
+
+    def fake_redis(*args, connection_pool=None, **kwargs):  # pylint: disable=unused-argument
+        options = connection_pool.connection_kwargs if connection_pool is not None else kwargs
+        address = (options.get("host", "localhost"), options.get("port", 6379))
+        if address not in servers:
+            servers[address] = fakeredis.FakeServer()
+        return fakeredis.FakeRedis(server=servers[address])
+
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+
+    def bulk_add_update(self, *args, sort=None, **kwargs):  # pylint: disable=unused-argument
+        # pymongo 4.11+ passes the sort of UpdateOne, which mongomock does not know
+        return add_update(self, *args, **kwargs)
+
+    mongomock.collection.BulkOperationBuilder.add_update = bulk_add_update
+    _install_info()
+    pymongo.MongoClient = mongomock.MongoClient
+    redis.Redis = fake_redis
+    return servers
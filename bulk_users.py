@@ -0,0 +1,106 @@
+"""
+    The module provides the streaming bulk import and export of users.
+
+    The import reads an NDJSON stream, one user per line, and processes it in batches of
+    BULK_BATCH_SIZE lines: the lines are validated, the passwords of the batch are hashed in
+    parallel on the password_hasher pool, and the batch is written with a single unordered
+    insert_many. One result line is produced per input line, in input order.
+
+    The export streams the users as NDJSON, fetched by keyset pagination on the email.
+"""
+import os
+import logging
+import pymongo
+import request_schema
+import password_hasher
+import mongo_db_connector
+import json_responses
+import appconstants
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "500"))
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "1000"))
+
+
+def _validate_line(line):
+    """
+    The function _validate_line parses and validates a line of the import, with the schema of
+    /create/user, a line is valid if the same JSON body is a valid signup.
+
+    :param line: The line is a line of the NDJSON stream, as bytes
+    :return: a ( user, error ) tuple, user is a dictionary with the keys "username", "email" and
+    "password" if the line is valid, otherwise error is the error response of the line.
+    """
+    user, error = request_schema.CREATE_USER.validate({}, line)
+    if error is appconstants.BAD_JSON_BODY:
+        return None, appconstants.BAD_JSON_LINE
+    return user, error
+
+
+def create_batch(batch):
+    """
+    The function create_batch validates, hashes and inserts a batch of lines.
+
+    :param batch: The batch is a list of ( line number, line ) tuples
+    :return: a list of result dictionaries, one per line, in the order of the batch
+    """
+    results = []
+    valid = []
+    for line_number, line in batch:
+        user, error = _validate_line(line)
+        result = {"line": line_number}
+        if user is None:
+            result.update(error)
+        else:
+            result["email"] = user["email"]
+            valid.append((result, user))
+        results.append(result)
+
+    hashes = password_hasher.hash_passwords([user["password"] for _, user in valid])
+    entries = []
+    inserted = []
+    for (result, user), encrypted_password in zip(valid, hashes):
+        if encrypted_password is None:
+            result.update(appconstants.PASSWORD_HASHER_BUSY)
+        else:
+            entries.append({"username": user["username"], "email": user["email"],
+                            "password": encrypted_password})
+            inserted.append(result)
+    for result, response in zip(inserted, mongo_db_connector.add_users(entries)):
+        result.update(response)
+    return results
+
+
+def create_users(lines):
+    """
+    The function create_users imports the users of an NDJSON stream, batch by batch.
+
+    :param lines: The lines is an iterable of the lines of the stream, as bytes
+    :return: a generator of NDJSON result lines as bytes, one per non blank input line
+    """
+    batch = []
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip():
+            batch.append((line_number, line))
+        if len(batch) == BULK_BATCH_SIZE:
+            for result in create_batch(batch):
+                yield json_responses.encode(result)
+            batch = []
+    if batch:
+        for result in create_batch(batch):
+            yield json_responses.encode(result)
+
+
+def export_users(after=None):
+    """
+    The function export_users streams the users in email order.
+
+    :param after: The after parameter is the email to resume after, or None
+    :return: a generator of NDJSON lines as bytes, with the keys "username" and "email". If
+    MongoDB can not be reached, the last line is the MongoDB connectivity exception.
+    """
+    try:
+        for user in mongo_db_connector.export_users(after, EXPORT_PAGE_SIZE):
+            yield json_responses.encode(user)
+    except pymongo.errors.ConnectionFailure as ex:
+        logging.error('Exception at export_users %s', str(ex))
+        yield json_responses.encode(appconstants.MONGODB_CONNECTIVITY_ISSUE)
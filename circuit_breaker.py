@@ -0,0 +1,352 @@
+"""
+    The module provides the circuit breakers of the MongoDB and Redis backends.
+
+    A breaker counts the consecutive connectivity failures of its backend. After
+    <BACKEND>_BREAKER_FAILURES failures it opens, and the calls to the backend fail immediately,
+    instead of each request waiting for the backend timeouts. After <BACKEND>_BREAKER_RECOVERY
+    seconds it is half-open: a single call goes through as a probe, its success closes the
+    breaker and its failure opens it again.
+
+    The calls fail with MongoDBUnavailable and RedisUnavailable, subclasses of the connectivity
+    errors the Application already handles, hence an open breaker is answered like an
+    unreachable backend, without the wait.
+
+    A MongoDB find only creates a lazy cursor, the outcome of the call is the outcome of the
+    first fetch of the cursor, which does the I/O.
+"""
+import os
+import time
+import inspect
+import threading
+import pymongo
+import redis
+import metrics
+
+CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Value of a state in the circuit_breaker_state gauge
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class MongoDBUnavailable(pymongo.errors.ConnectionFailure):
+    """
+    Raised instead of calling MongoDB while its circuit breaker is open.
+    """
+
+
+class RedisUnavailable(redis.exceptions.ConnectionError):
+    """
+    Raised instead of calling Redis while its circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    The class CircuitBreaker is the breaker of a backend.
+
+    :param name: The name is the name of the backend
+    :param failure_threshold: The failure_threshold is the number of consecutive failures
+    which opens the breaker
+    :param recovery_timeout: The recovery_timeout is the number of seconds the breaker stays
+    open before a probe is let through
+    :param failures: The failures is the tuple of the exception types which count as a failure
+    of the backend, other exceptions mean the backend answered
+    :param error: The error is the exception type raised while the breaker is open
+    """
+
+    def __init__(self, name, failure_threshold, recovery_timeout, failures, error):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = failures
+        self.error = error
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        The function reset closes the breaker in a forked child.
+        """
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def available(self):
+        """
+        The function available checks, without taking the probe, if a call would be let through.
+        It is used to refuse a request before doing any work for it.
+
+        :return: a boolean value. It returns False while the breaker is open and the recovery
+        timeout has not passed.
+        """
+        return (not CIRCUIT_BREAKER_ENABLED or self.state == CLOSED
+                or (self.state == OPEN
+                    and time.monotonic() - self.opened_at >= self.recovery_timeout))
+
+    def before_call(self):
+        """
+        The function before_call lets a call through, or raises the error of the breaker. In the
+        half-open state only the probe call is let through.
+
+        :return: a boolean value. It returns True if the call is the probe.
+        """
+        if not CIRCUIT_BREAKER_ENABLED or self.state == CLOSED:
+            return False
+        with self._lock:
+            if (self.state == OPEN and not self._probing
+                    and time.monotonic() - self.opened_at >= self.recovery_timeout):
+                self.state = HALF_OPEN
+                self._probing = True
+                return True
+            if self.state == CLOSED:
+                return False
+        self.rejected += 1
+        raise self.error("%s circuit breaker is %s" % (self.name, self.state))
+
+    def release_probe(self):
+        """
+        The function release_probe gives back the probe of a call which did no I/O, the breaker
+        is open again and the next call is the probe.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._probing:
+                self.state = OPEN
+                self._probing = False
+
+    def record_success(self):
+        """
+        The function record_success records a call answered by the backend.
+        """
+        if self.consecutive_failures or self.state != CLOSED:
+            with self._lock:
+                self.consecutive_failures = 0
+                self.state = CLOSED
+                self._probing = False
+
+    def record_failure(self):
+        """
+        The function record_failure records a connectivity failure, opening the breaker after
+        failure_threshold consecutive failures, or if the probe failed.
+        """
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+            self._probing = False
+
+    def call(self, function, *args, **kwargs):
+        """
+        The function call calls a function through the breaker. If it returns an awaitable, the
+        outcome is recorded when the awaitable completes.
+        """
+        self.before_call()
+        return self.record(function, *args, **kwargs)
+
+    def record(self, function, *args, **kwargs):
+        """
+        The function record calls a function already let through by before_call, and records
+        its outcome, see call.
+        """
+        try:
+            result = function(*args, **kwargs)
+        except self.failures:
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_success()
+            raise
+        if inspect.isawaitable(result):
+            return self._await(result)
+        self.record_success()
+        return result
+
+    async def _await(self, awaitable):
+        try:
+            result = await awaitable
+        except self.failures:
+            self.record_failure()
+            raise
+        except Exception:
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        """
+        The function stats reports the state and the counters of the breaker.
+        """
+        return {"state": self.state if CIRCUIT_BREAKER_ENABLED else "disabled",
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "recovery_timeout": self.recovery_timeout,
+                "opened": self.opened,
+                "rejected": self.rejected}
+
+
+# The methods of a collection which return a lazy cursor without any I/O
+CURSOR_FACTORIES = ("find", "find_raw_batches")
+
+
+class GuardedCollection:
+    """
+    The class GuardedCollection calls the methods of a MongoDB collection ( sync or asyncio )
+    through a breaker. The cursor of a find is a GuardedCursor.
+    """
+
+    def __init__(self, collection, breaker):
+        self._collection = collection
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+        if name in CURSOR_FACTORIES:
+            def guarded_cursor(*args, **kwargs):
+                probe = self._breaker.before_call()
+                try:
+                    cursor = attribute(*args, **kwargs)
+                except Exception:
+                    if probe:
+                        self._breaker.release_probe()
+                    raise
+                return GuardedCursor(cursor, self._breaker, probe)
+            return guarded_cursor
+
+        def guarded(*args, **kwargs):
+            return self._breaker.call(attribute, *args, **kwargs)
+        return guarded
+
+
+class GuardedCursor:
+    """
+    The class GuardedCursor records the outcome of the first fetch of a MongoDB cursor ( sync or
+    asyncio ), the call was let through when the cursor was created. The next fetches are not
+    guarded. A probe cursor dropped before any fetch gives the probe back.
+
+    :param cursor: The cursor is the cursor returned by the collection
+    :param breaker: The breaker is the breaker of the collection
+    :param probe: The probe is True if the creation of the cursor took the probe
+    """
+
+    def __init__(self, cursor, breaker, probe):
+        self._cursor = cursor
+        self._breaker = breaker
+        self._probe = probe
+        self._pending = True
+
+    def __del__(self):
+        if self._pending and self._probe:
+            self._breaker.release_probe()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def chained(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+    def _fetch(self, function, *args, **kwargs):
+        if not self._pending:
+            return function(*args, **kwargs)
+        self._pending = False
+        return self._breaker.record(function, *args, **kwargs)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._fetch(self._cursor.__next__)
+
+    next = __next__
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._fetch(self._cursor.__anext__)
+
+    def to_list(self, *args, **kwargs):
+        """
+        The function to_list fetches the documents of an asyncio cursor, see
+        pymongo.asynchronous.cursor.AsyncCursor.to_list.
+        """
+        return self._fetch(self._cursor.to_list, *args, **kwargs)
+
+
+def guard_redis(client, breaker):
+    """
+    The function guard_redis calls the commands and the pipelines of a redis-py client ( sync
+    or asyncio ) through a breaker.
+
+    :param client: The client is a redis.Redis or redis.asyncio.Redis client, it is guarded in
+    place
+    :return: the client
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def guarded_execute_command(*args, **options):
+        return breaker.call(execute_command, *args, **options)
+
+    def guarded_pipeline(*args, **kwargs):
+        instance = pipeline(*args, **kwargs)
+        execute = instance.execute
+
+        def guarded_execute(*execute_args, **execute_kwargs):
+            return breaker.call(execute, *execute_args, **execute_kwargs)
+        instance.execute = guarded_execute
+        return instance
+
+    client.execute_command = guarded_execute_command
+    client.pipeline = guarded_pipeline
+    return client
+
+
+MONGODB = CircuitBreaker(
+    "mongodb", int(os.environ.get("MONGODB_BREAKER_FAILURES", "5")),
+    float(os.environ.get("MONGODB_BREAKER_RECOVERY", "10")),
+    (pymongo.errors.ConnectionFailure,), MongoDBUnavailable)
+REDIS = CircuitBreaker(
+    "redis", int(os.environ.get("REDIS_BREAKER_FAILURES", "5")),
+    float(os.environ.get("REDIS_BREAKER_RECOVERY", "5")),
+    (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError), RedisUnavailable)
+BREAKERS = (MONGODB, REDIS)
+
+if hasattr(os, "register_at_fork"):
+    for _breaker in BREAKERS:
+        os.register_at_fork(after_in_child=_breaker.reset)
+
+
+def stats():
+    """
+    The function stats reports the breakers of this worker, by backend.
+    """
+    return {breaker.name: breaker.stats() for breaker in BREAKERS}
+
+
+metrics.register_gauge("circuit_breaker_state", "State of the circuit breaker, 0 closed, 1 open, "
+                       "2 half-open", ("backend",),
+                       lambda series: [((breaker.name,), STATE_VALUES[breaker.state])
+                                       for breaker in BREAKERS])
+metrics.register_gauge("circuit_breaker_rejected_total", "Calls rejected by the open breaker",
+                       ("backend",), lambda series: [((breaker.name,), breaker.rejected)
+                                                     for breaker in BREAKERS],
+                       metric_type="counter")
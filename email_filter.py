@@ -0,0 +1,414 @@
+"""
+    The module provides the negative lookup filter of the registered emails, which answers the
+    requests for an unknown email ( bots, typos, stale clients ) without a MongoDB call.
+
+    Each worker holds a Bloom filter of the emails of the users collection. A definite miss of
+    the filter answers /login/user, /list/user and /delete/user as if MongoDB found no user, a
+    possible hit ( a registered email, or a false positive ) queries MongoDB as before. The
+    filter is sized for EMAIL_FILTER_FP_RATE false positives at twice the number of users, at
+    least EMAIL_FILTER_CAPACITY emails and at most EMAIL_FILTER_MAX_BYTES bytes.
+
+    A background thread of each worker subscribes to the additions published over Redis pub/sub
+    by add_user, then builds the filter by streaming the emails of the users collection, and
+    rebuilds it every EMAIL_FILTER_REBUILD_INTERVAL seconds, or once it holds more emails than it
+    was sized for. The builds run on their own thread, the additions received meanwhile are
+    added to the current filter and replayed on the new one. A Bloom filter can not forget an
+    email, the deleted users are dropped by the next rebuild, until then they are possible hits.
+
+    The filter must not answer a registered email as unknown. Additions may have been missed
+    while disconnected from Redis, hence the filter answers every email as a possible hit from a
+    disconnection until the rebuild which follows the ( re ) subscription. An addition whose
+    publication failed is kept by its worker and published again, with a bump of the epoch of
+    the filters kept in Redis: every worker polls the epoch, and on a change answers every email
+    as a possible hit until a filter built after the change is in place. /delete/user does not
+    use the filter, a write is never refused on its answer.
+"""
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+import pymongo
+import redis_cache
+import metrics
+
+EMAIL_FILTER_ENABLED = os.environ.get("EMAIL_FILTER_ENABLED", "true").lower() == "true"
+EMAIL_FILTER_FP_RATE = float(os.environ.get("EMAIL_FILTER_FP_RATE", "0.01"))
+EMAIL_FILTER_CAPACITY = int(os.environ.get("EMAIL_FILTER_CAPACITY", "100000"))
+EMAIL_FILTER_MAX_BYTES = int(os.environ.get("EMAIL_FILTER_MAX_BYTES", "16777216"))
+EMAIL_FILTER_REBUILD_INTERVAL = float(os.environ.get("EMAIL_FILTER_REBUILD_INTERVAL", "3600"))
+
+# Number of emails fetched per round trip while building the filter
+BUILD_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    """
+    The class BloomFilter is a Bloom filter of strings, its bits held in a bytearray. The bit
+    positions of a string are derived from a single blake2b digest by double hashing.
+
+    :param capacity: The capacity is the number of strings the filter is sized for
+    :param fp_rate: The fp_rate is the false positive rate at capacity
+    :param max_bytes: The max_bytes bounds the size of the bits, the false positive rate at
+    capacity is higher than fp_rate if the bound applies
+    """
+
+    def __init__(self, capacity, fp_rate, max_bytes):
+        capacity = max(1, capacity)
+        bits = math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))
+        self.size = max(64, min(bits, max_bytes * 8))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, value):
+        """
+        The function add adds a string to the filter.
+
+        :return: a boolean value. It returns False if the string was a possible hit already.
+        """
+        added = False
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not self._bits[position >> 3] & mask:
+                self._bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, value):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+    def memory_bytes(self):
+        """
+        The function memory_bytes returns the size of the bits of the filter.
+        """
+        return len(self._bits)
+
+    def expected_fp_rate(self):
+        """
+        The function expected_fp_rate returns the false positive rate expected with the strings
+        added so far.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class EmailFilter:
+    """
+    The class EmailFilter holds the Bloom filter of the worker, its maintenance thread and its
+    counters.
+
+    :param count_emails: The count_emails is the function returning the ( estimated ) number of
+    registered emails
+    :param stream_emails: The stream_emails is the function returning an iterable of every
+    registered email. Both raise pymongo.errors.ConnectionFailure if MongoDB can not be reached
+    :param fp_rate: The fp_rate is the targeted false positive rate
+    :param capacity: The capacity is the minimum number of emails the filter is sized for
+    :param max_bytes: The max_bytes bounds the memory of the filter
+    :param rebuild_interval: The rebuild_interval is the number of seconds between two rebuilds
+    """
+
+    def __init__(self, count_emails, stream_emails, fp_rate, capacity, max_bytes,
+                 rebuild_interval):
+        self.count_emails = count_emails
+        self.stream_emails = stream_emails
+        self.fp_rate = fp_rate
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.rebuild_interval = rebuild_interval
+        self.checks = 0
+        self.negatives = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+        self.rebuild_seconds = 0.0
+        self.publish_failures = 0
+        self._bloom = None
+        self._built_at = 0.0
+        self._building = None
+        self._generation = 0
+        self._rebuilding = False
+        self._epoch = None
+        self._unpublished = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def reset(self):
+        """
+        The function reset drops the filter inherited by a forked child, its thread is started
+        again on next use. The additions the parent could not publish are published by the
+        parent.
+        """
+        self._bloom = None
+        self._building = None
+        self._rebuilding = False
+        self._epoch = None
+        self._unpublished = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _ensure_started(self):
+        """
+        The function _ensure_started starts the maintenance thread on first use.
+        """
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    threading.Thread(target=self._maintain, daemon=True,
+                                     name="email-filter").start()
+                    self._started = True
+
+    def might_exist(self, email, record=True):
+        """
+        The function might_exist checks an email against the filter.
+
+        :param email: The email parameter is the email address of the request
+        :param record: The record parameter is False not to count the check, ex. when the
+        request checks the email again
+        :return: a boolean value. It returns False only if the email is definitely not
+        registered, and True if it may be, or if the filter is not built.
+        """
+        if not EMAIL_FILTER_ENABLED:
+            return True
+        self._ensure_started()
+        bloom = self._bloom
+        if bloom is None:
+            return True
+        if email in bloom:
+            if record:
+                self.checks += 1
+            return True
+        if record:
+            self.checks += 1
+            self.negatives += 1
+        return False
+
+    def record_false_positive(self, email):
+        """
+        The function record_false_positive counts a possible hit of the filter MongoDB did not
+        find.
+
+        :param email: The email parameter is the email address of the request
+        """
+        bloom = self._bloom
+        if bloom is not None and email in bloom:
+            self.false_positives += 1
+
+    def add(self, email):
+        """
+        The function add adds a registered email to the filter of this worker, and to the
+        filter being built, if any.
+
+        :param email: The email parameter is the email address of the new user
+        """
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(email)
+            if self._building is not None:
+                self._building.append(email)
+
+    def unpublished(self, emails):
+        """
+        The function unpublished keeps new users whose publication failed, the maintenance
+        thread publishes them again with a bump of the epoch.
+
+        :param emails: The emails parameter is a list of email addresses
+        """
+        with self._lock:
+            self._unpublished.extend(emails)
+            self.publish_failures += 1
+
+    def _publish_unpublished(self):
+        """
+        The function _publish_unpublished publishes again the new users whose publication
+        failed, and bumps the epoch, the other workers may have answered them as unknown.
+        """
+        with self._lock:
+            emails, self._unpublished = self._unpublished, []
+        if emails and not redis_cache.publish_email_additions(emails, bump_epoch=True):
+            with self._lock:
+                self._unpublished[:0] = emails
+
+    def _check_epoch(self):
+        """
+        The function _check_epoch drops the filter when the epoch changed, a new filter is built.
+        It raises one of REDIS_ERRORS if Redis could not be reached.
+        """
+        epoch = redis_cache.email_filter_epoch()
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self._disable()
+
+    def _disable(self):
+        """
+        The function _disable drops the filter, every email is a possible hit until the next
+        build. A build in progress is discarded, it may miss the emails added before the call.
+        """
+        with self._lock:
+            self._bloom = None
+            self._building = None
+            self._generation += 1
+
+    def _rebuild(self):
+        """
+        The function _rebuild builds a new filter from the users collection and swaps it in, the
+        emails added meanwhile are replayed on it. The current filter, if any, answers until then.
+
+        :return: a boolean value. It returns False if MongoDB could not be reached, or if the
+        filter was dropped during the build.
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._building = []
+            generation = self._generation
+        try:
+            bloom = BloomFilter(max(self.capacity, 2 * self.count_emails()), self.fp_rate,
+                                self.max_bytes)
+            for email in self.stream_emails():
+                bloom.add(email)
+        except pymongo.errors.ConnectionFailure as ex:
+            logging.error('Exception at email filter rebuild %s', str(ex))
+            with self._lock:
+                if generation == self._generation:
+                    self._building = None
+            return False
+        with self._lock:
+            if generation != self._generation:
+                return False
+            for email in self._building or ():
+                bloom.add(email)
+            self._building = None
+            self._bloom = bloom
+        self._built_at = time.monotonic()
+        self.rebuilds += 1
+        self.rebuild_seconds = round(self._built_at - started, 3)
+        return True
+
+    def _run_rebuild(self):
+        """
+        The function _run_rebuild is the body of the rebuild thread.
+        """
+        try:
+            if not self._rebuild():
+                time.sleep(1)
+        finally:
+            self._rebuilding = False
+
+    def _rebuild_due(self):
+        bloom = self._bloom
+        return not self._rebuilding and (
+            bloom is None or bloom.count > bloom.capacity
+            or time.monotonic() - self._built_at >= self.rebuild_interval)
+
+    def _maintain(self):
+        """
+        The function _maintain adds the emails published by the other workers, publishes the
+        additions of this worker which failed, follows the epoch and starts the rebuilds when
+        due, it is the body of the maintenance thread. The connection of a broken subscription
+        is released to the pool before subscribing again.
+        """
+        while True:
+            pubsub = None
+            try:
+                pubsub = redis_cache.subscribe_email_additions()
+                self._disable()
+                while True:
+                    self._publish_unpublished()
+                    self._check_epoch()
+                    if self._rebuild_due():
+                        self._rebuilding = True
+                        threading.Thread(target=self._run_rebuild, daemon=True,
+                                         name="email-filter-rebuild").start()
+                    message = pubsub.get_message(timeout=1.0)
+                    while message is not None:
+                        self.add(message["data"].decode('utf-8'))
+                        message = pubsub.get_message()
+            except redis_cache.REDIS_ERRORS as ex:
+                logging.error('Exception at email filter subscriber %s', str(ex))
+                self._disable()
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    def stats(self):
+        """
+        The function stats reports the size, the false positive rates and the counters of the
+        filter of this worker.
+        """
+        bloom = self._bloom
+        stats = {"enabled": EMAIL_FILTER_ENABLED, "ready": bloom is not None,
+                 "fp_rate": self.fp_rate, "checks": self.checks, "negatives": self.negatives,
+                 "false_positives": self.false_positives, "rebuilds": self.rebuilds,
+                 "publish_failures": self.publish_failures,
+                 "unpublished": len(self._unpublished),
+                 "rebuild_seconds": self.rebuild_seconds,
+                 "rebuild_interval": self.rebuild_interval}
+        if bloom is not None:
+            positives = self.checks - self.negatives
+            stats.update({"emails": bloom.count, "capacity": bloom.capacity,
+                          "bits": bloom.size, "hashes": bloom.hashes,
+                          "memory_bytes": bloom.memory_bytes(),
+                          "expected_fp_rate": round(bloom.expected_fp_rate(), 6),
+                          "observed_fp_rate": round(self.false_positives / positives, 6)
+                                              if positives else 0.0})
+        return stats
+
+
+def count_emails():
+    """
+    The function count_emails returns the number of users from the collection metadata.
+    """
+    import mongo_db_connector  # pylint: disable=import-outside-toplevel
+    return mongo_db_connector.users().estimated_document_count()
+
+
+def stream_emails():
+    """
+    The function stream_emails returns a generator of every registered email, fetched in
+    batches of BUILD_BATCH_SIZE.
+    """
+    import mongo_db_connector  # pylint: disable=import-outside-toplevel
+    cursor = mongo_db_connector.users().find({}, {"_id": 0, "email": 1},
+                                             batch_size=BUILD_BATCH_SIZE)
+    return (document["email"] for document in cursor)
+
+
+FILTER = EmailFilter(count_emails, stream_emails, EMAIL_FILTER_FP_RATE, EMAIL_FILTER_CAPACITY,
+                     EMAIL_FILTER_MAX_BYTES, EMAIL_FILTER_REBUILD_INTERVAL)
+os.register_at_fork(after_in_child=FILTER.reset)
+
+
+def added(emails):
+    """
+    The function added adds new users to the filter of this worker, and publishes them to the
+    other workers. The users whose publication failed are published again by the maintenance
+    thread.
+
+    :param emails: The emails parameter is a list of email addresses
+    """
+    if EMAIL_FILTER_ENABLED and emails:
+        for email in emails:
+            FILTER.add(email)
+        if not redis_cache.publish_email_additions(emails):
+            FILTER.unpublished(emails)
+
+
+metrics.register_gauge("email_filter_negatives_total", "Requests answered by a definite miss "
+                       "of the email filter", (), lambda series: [((), FILTER.negatives)],
+                       metric_type="counter")
+metrics.register_gauge("email_filter_false_positives_total", "Possible hits of the email "
+                       "filter MongoDB did not find", (),
+                       lambda series: [((), FILTER.false_positives)], metric_type="counter")
+metrics.register_gauge("email_filter_memory_bytes", "Size of the email filter", (),
+                       lambda series: [((), FILTER.stats().get("memory_bytes", 0))])
@@ -0,0 +1,90 @@
+"""
+    The module is the gunicorn configuration of the production launcher, a pre-forking master
+    running one worker per core.
+
+    $ gunicorn -c gunicorn.conf.py
+
+    The app is imported once in the master ( preload_app ) and the workers are forked from it.
+    The imports connect to no backend, each worker creates its MongoDB and Redis pools on first
+    use, see mongo_db_connector._connection and redis_cache._connection. The master creates the
+    unique email indexes once before forking.
+
+    The workers share the port, a scrape of /metrics is answered by any one worker. Every worker
+    writes its metrics to its own file of METRICS_DIR, emptied when the master starts, and the
+    worker answering a scrape sums the files of all the workers, see metrics. Without
+    METRICS_DIR ( METRICS_DIR= ) a scrape reports the metrics of a single, arbitrary worker.
+
+    The ASGI app is served with WORKER_CLASS=uvicorn.workers.UvicornWorker and
+    APP_MODULE=asgi_server:create_app().
+"""
+import os
+import glob
+import tempfile
+import multiprocessing
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = os.environ.get("WORKER_CLASS", "gthread")
+threads = int(os.environ.get("WORKER_THREADS", "8"))
+timeout = int(os.environ.get("WORKER_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("WORKER_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("WORKER_KEEPALIVE", "5"))
+# Recycling the workers bounds the growth of a leaking worker, jitter spreads the restarts
+max_requests = int(os.environ.get("WORKER_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.environ.get("WORKER_MAX_REQUESTS_JITTER", "0"))
+preload_app = True
+wsgi_app = os.environ.get("APP_MODULE", "server:create_app()")
+accesslog = os.environ.get("ACCESS_LOG") or None
+
+# The password hash processes of the workers share the cores, unless sized explicitly
+os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+# The workers aggregate their metrics in a shared directory, read by the preloaded app
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(),
+                                                  "user-manage-auth-metrics-%d" % os.getpid()))
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """
+    The function on_starting empties METRICS_DIR, the counters of the workers of a previous run
+    are not reported.
+    """
+    if os.environ["METRICS_DIR"]:
+        os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
+        for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json*")):
+            os.remove(path)
+
+
+def when_ready(server):
+    """
+    The function when_ready creates the unique email indexes in the master, and closes its
+    MongoDB client before the workers are forked. The master halts if the indexes are not in
+    place, the workers would refuse every signup.
+    """
+    import mongo_db_connector  # pylint: disable=import-outside-toplevel
+    created = mongo_db_connector.create_indexes()
+    mongo_db_connector.close()
+    if not created:
+        server.log.error("Unique email indexes are not in place, halting")
+        server.halt("Unique email indexes are not in place", 1)
+
+
+def post_worker_init(worker):  # pylint: disable=unused-argument
+    """
+    The function post_worker_init installs the profiler signal handler in the worker, gunicorn
+    resets the signal handlers of a forked worker, and starts the metrics writer of the worker.
+    The profiler signal ( profiler.PROFILE_SIGNAL ) is sent to the pid of a worker only, the
+    master handles its own signals ( SIGUSR2 re-executes it ) and ignores SIGURG.
+    """
+    import profiler  # pylint: disable=import-outside-toplevel
+    import metrics  # pylint: disable=import-outside-toplevel
+    profiler.install_signal_handler()
+    metrics.start_writer()
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """
+    The function worker_exit writes the logins queued by the login history write-behind of the
+    exiting worker.
+    """
+    import mongo_db_connector  # pylint: disable=import-outside-toplevel
+    mongo_db_connector.LOGIN_HISTORY.flush()
@@ -0,0 +1,76 @@
+"""
+    The module provides the consistent hash ring which spreads the keys of the session store
+    over the Redis nodes of REDIS_NODES.
+
+    Each node is placed on the ring at REDIS_VIRTUAL_NODES points, and a key belongs to the node
+    of the first point at or after the hash of the key. Adding or removing one of n nodes moves
+    about 1 / n of the keys, the keys of the other nodes stay where they are.
+"""
+import os
+import bisect
+import hashlib
+
+REDIS_VIRTUAL_NODES = int(os.environ.get("REDIS_VIRTUAL_NODES", "160"))
+
+
+def _hash(value):
+    """
+    The function _hash places a string on the ring, a 64 bit integer.
+    """
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], "big")
+
+
+def parse_nodes(value):
+    """
+    The function parse_nodes parses the REDIS_NODES configuration.
+
+    :param value: The value is a comma separated list of <host>:<port>
+    :return: the list of ( host, port ) tuples, in the order of the configuration.
+    """
+    nodes = []
+    for item in value.split(","):
+        if item.strip():
+            host, port = item.strip().rsplit(":", 1)
+            nodes.append((host, int(port)))
+    return nodes
+
+
+class HashRing:
+    """
+    The class HashRing maps keys to nodes by consistent hashing.
+
+    :param nodes: The nodes is the list of ( host, port ) tuples of the nodes, a node is named
+    "<host>:<port>" on the ring, hence its keys do not depend on its position in the list
+    :param virtual_nodes: The virtual_nodes is the number of points of each node on the ring
+    """
+
+    def __init__(self, nodes, virtual_nodes):
+        self.nodes = list(nodes)
+        points = sorted((_hash("%s:%d#%d" % (host, port, replica)), index)
+                        for index, (host, port) in enumerate(self.nodes)
+                        for replica in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._indexes = [index for _, index in points]
+
+    def index(self, key):
+        """
+        The function index returns the index of the node of a key in the list of the nodes.
+
+        :param key: The key is the routing key, ex. the email of a session
+        """
+        if len(self.nodes) == 1:
+            return 0
+        position = bisect.bisect_left(self._hashes, _hash(key))
+        return self._indexes[position % len(self._hashes)]
+
+    def group(self, keys):
+        """
+        The function group groups keys by node.
+
+        :param keys: The keys is a list of routing keys
+        :return: a dictionary of the positions ( in keys ) of the keys of each node index.
+        """
+        groups = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(self.index(key), []).append(position)
+        return groups
@@ -0,0 +1,110 @@
+"""
+    The module provides the liveness and the readiness checks of a worker.
+
+    The liveness check answers without calling a backend, a worker answering it is alive. The
+    readiness check pings MongoDB and Redis, and its result is reused for HEALTH_CHECK_INTERVAL
+    seconds, hence frequent probes of an orchestrator or a load balancer add no load to the
+    backends. A backend whose circuit breaker is open is reported down without a ping.
+"""
+import os
+import time
+import asyncio
+import threading
+import circuit_breaker
+import appconstants
+
+# Seconds a readiness result is reused before the backends are pinged again
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "5"))
+
+
+def _backend_status(up):
+    return appconstants.BACKEND_UP if up else appconstants.BACKEND_DOWN
+
+
+class Readiness:
+    """
+    The class Readiness holds the last readiness result of the worker.
+    """
+
+    def __init__(self):
+        self._response = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        The function reset drops the result inherited by a forked child.
+        """
+        self._response = None
+        self._lock = threading.Lock()
+
+    def _cached(self):
+        if (self._response is not None
+                and time.monotonic() - self._checked_at < HEALTH_CHECK_INTERVAL):
+            return self._response
+        return None
+
+    def _store(self, mongodb_up, redis_up):
+        self._response = {
+            "status": (appconstants.SERVICE_READY if mongodb_up and redis_up
+                       else appconstants.SERVICE_NOT_READY),
+            "mongodb": _backend_status(mongodb_up),
+            "redis": _backend_status(redis_up)}
+        self._checked_at = time.monotonic()
+        return self._response
+
+    def check(self, mongodb_ping, redis_ping):
+        """
+        The function check returns the readiness of the worker, pinging the backends if the last
+        result is older than HEALTH_CHECK_INTERVAL seconds. Concurrent checks share one ping.
+
+        :param mongodb_ping: The mongodb_ping is the function pinging MongoDB, ex.
+        mongo_db_connector.ping
+        :param redis_ping: The redis_ping is the function pinging Redis, ex. redis_cache.ping
+        :return: a dictionary with the "status" key, "ready" or "not ready", and the status of
+        each backend.
+        """
+        response = self._cached()
+        if response is None:
+            with self._lock:
+                response = self._cached()
+                if response is None:
+                    response = self._store(
+                        circuit_breaker.MONGODB.available() and mongodb_ping(),
+                        circuit_breaker.REDIS.available() and redis_ping())
+        return response
+
+    async def check_async(self, mongodb_ping, redis_ping):
+        """
+        The function check_async is the asyncio counterpart of check, the backends are pinged
+        concurrently.
+
+        :param mongodb_ping: The mongodb_ping is the coroutine function pinging MongoDB
+        :param redis_ping: The redis_ping is the coroutine function pinging Redis
+        :return: a dictionary with the "status" key and the status of each backend.
+        """
+        response = self._cached()
+        if response is None:
+            mongodb_up, redis_up = await asyncio.gather(
+                _ping_async(circuit_breaker.MONGODB, mongodb_ping),
+                _ping_async(circuit_breaker.REDIS, redis_ping))
+            response = self._store(mongodb_up, redis_up)
+        return response
+
+
+async def _ping_async(breaker, ping):
+    return breaker.available() and await ping()
+
+
+def is_ready(response):
+    """
+    The function is_ready checks a readiness response.
+
+    :param response: The response is the dictionary returned by Readiness.check
+    :return: a boolean value. It returns True if both backends are up.
+    """
+    return response["status"] == appconstants.SERVICE_READY
+
+
+READINESS = Readiness()
+os.register_at_fork(after_in_child=READINESS.reset)
@@ -0,0 +1,98 @@
+"""
+    The module provides the JSON rendering of the responses of the Flask and the ASGI apps.
+
+    The constant responses of appconstants are ConstantResponse mappings, read-only and shared
+    by every request, whose JSON body is encoded once at import. A dynamic response ( ex. a
+    login with its token, a user profile ) is a fresh dictionary built per request, encoded by a
+    single reused encoder. Both produce the bytes of jsonify of the Flask app: sorted keys,
+    compact separators, dates in the HTTP date format and a trailing newline.
+
+    With RESPONSE_GZIP_ENABLED, a response body of at least RESPONSE_GZIP_MIN_SIZE bytes ( ex. a
+    long login history ) is gzip compressed for the clients accepting it.
+"""
+import os
+import gzip
+import json
+from datetime import date
+from types import MappingProxyType
+from collections.abc import Mapping
+from werkzeug.http import http_date
+
+MIMETYPE = "application/json"
+
+RESPONSE_GZIP_ENABLED = os.environ.get("RESPONSE_GZIP_ENABLED", "false").lower() == "true"
+RESPONSE_GZIP_MIN_SIZE = int(os.environ.get("RESPONSE_GZIP_MIN_SIZE", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.environ.get("RESPONSE_GZIP_LEVEL", "6"))
+
+
+def _default(value):
+    """
+    The function _default encodes the values the json module does not know.
+    """
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+
+# json.dumps with options builds an encoder per call, this one is built once
+_ENCODER = json.JSONEncoder(default=_default, sort_keys=True, separators=(",", ":"))
+
+
+class ConstantResponse(Mapping):
+    """
+    The class ConstantResponse is a read-only response shared by every request, with its JSON
+    body encoded once. A response derived from it is a new dictionary, ex.
+    dict(appconstants.USER_LOGIN_SUCCESS, token=token).
+
+    :param fields: The fields is the dictionary of the response
+    """
+
+    __slots__ = ("_fields", "body")
+
+    def __init__(self, fields):
+        self._fields = MappingProxyType(dict(fields))
+        self.body = _ENCODER.encode(fields).encode('utf-8') + b"\n"
+
+    def __getitem__(self, key):
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, ConstantResponse):
+            return self.body == other.body
+        return self._fields == other
+
+    def __hash__(self):
+        return hash(self.body)
+
+    def __repr__(self):
+        return "ConstantResponse(%r)" % (dict(self._fields),)
+
+
+def encode(response):
+    """
+    The function encode renders a response as a JSON body.
+
+    :param response: The response is a ConstantResponse, or a JSON serializable value
+    :return: the JSON body as bytes, the pre-encoded body of a ConstantResponse.
+    """
+    if isinstance(response, ConstantResponse):
+        return response.body
+    return _ENCODER.encode(response).encode('utf-8') + b"\n"
+
+
+def compress(body):
+    """
+    The function compress gzip compresses a response body.
+
+    :param body: The body is the response body, as bytes
+    :return: the compressed body.
+    """
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
@@ -0,0 +1,274 @@
+"""
+    The module provides the write-behind of the login history.
+
+    With LOGIN_HISTORY_MODE=write_behind a successful login only queues its timestamp, and a
+    background flusher thread writes the queued logins to MongoDB in batches, a single unordered
+    bulk_write with one upsert per user, see mongo_db_connector.write_login_history. A batch is
+    written when LOGIN_HISTORY_BATCH_SIZE logins are queued, and at the latest
+    LOGIN_HISTORY_MAX_STALENESS seconds after its oldest login, which bounds how stale the
+    history returned by /list/user is.
+
+    The queue of a worker holds at most LOGIN_HISTORY_QUEUE_SIZE logins, a login finding it full
+    writes its history synchronously ( backpressure ). A batch which could not be written is
+    queued again, the logins which do not fit in the queue any more are dropped and counted. A
+    deleted user has its queued logins discarded, after the write of a batch holding some of
+    them, so that the batch does not create its login history again. The queue is flushed when
+    the worker exits, the logins queued by a worker which is killed are lost.
+    LOGIN_HISTORY_MODE=sync writes the history before the login is answered.
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+import pymongo
+import metrics
+
+WRITE_BEHIND = "write_behind"
+SYNC = "sync"
+
+LOGIN_HISTORY_MODE = os.environ.get("LOGIN_HISTORY_MODE", WRITE_BEHIND)
+LOGIN_HISTORY_QUEUE_SIZE = int(os.environ.get("LOGIN_HISTORY_QUEUE_SIZE", "10000"))
+LOGIN_HISTORY_BATCH_SIZE = int(os.environ.get("LOGIN_HISTORY_BATCH_SIZE", "500"))
+LOGIN_HISTORY_MAX_STALENESS = float(os.environ.get("LOGIN_HISTORY_MAX_STALENESS", "1"))
+
+
+def group_logins(batch):
+    """
+    The function group_logins groups the logins of a batch by user.
+
+    :param batch: The batch is a list of ( email, timestamp ) tuples
+    :return: a dictionary of the timestamps of each email, in the order of the batch.
+    """
+    logins = {}
+    for email, timestamp in batch:
+        logins.setdefault(email, []).append(timestamp)
+    return logins
+
+
+class LoginHistoryWriter:
+    """
+    The class LoginHistoryWriter holds the queue of the logins of a worker and its flusher.
+
+    :param write: The write is the function writing a batch, it takes the dictionary of the
+    timestamps of each email and raises pymongo.errors.ConnectionFailure if MongoDB can not be
+    reached
+    :param queue_size: The queue_size is the maximum number of queued logins
+    :param batch_size: The batch_size is the maximum number of logins written together
+    :param max_staleness: The max_staleness is the number of seconds after which a queued login
+    is written
+    """
+
+    def __init__(self, write, queue_size, batch_size, max_staleness):
+        self.write = write
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.max_staleness = max_staleness
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.overflows = 0
+        self.failures = 0
+        self.dropped = 0
+        self._pending = deque()
+        self._in_flight = None
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._settled = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._started = False
+
+    def reset(self):
+        """
+        The function reset drops, in a forked child, the logins queued by the parent, they are
+        written by the parent. The flusher is started again on next use.
+        """
+        self._pending = deque()
+        self._in_flight = None
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._settled = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._started = False
+
+    def _ensure_started(self):
+        """
+        The function _ensure_started starts the flusher thread on first use.
+        """
+        if not self._started:
+            with self._condition:
+                if not self._started:
+                    threading.Thread(target=self._run, daemon=True,
+                                     name="login-history-flusher").start()
+                    self._started = True
+
+    def record(self, email, timestamp):
+        """
+        The function record queues a login.
+
+        :param email: The email parameter is the email address of the user
+        :param timestamp: The timestamp is the epoch time of the login
+        :return: a boolean value. It returns False if the history is written synchronously, or if
+        the queue is full, then the caller writes the login itself.
+        """
+        if LOGIN_HISTORY_MODE != WRITE_BEHIND:
+            return False
+        self._ensure_started()
+        with self._condition:
+            if len(self._pending) >= self.queue_size:
+                self.overflows += 1
+                return False
+            self._pending.append((email, timestamp))
+            self.queued += 1
+            # the flusher waits for the first login to time the staleness bound, or a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def discard(self, email):
+        """
+        The function discard drops the queued logins of a deleted user. If the batch being
+        written holds some of them, it waits for the write, the caller deletes the login history
+        once the function returns.
+
+        :param email: The email parameter is the email address of the user
+        """
+        with self._condition:
+            while True:
+                if self._pending:
+                    self._pending = deque(login for login in self._pending
+                                          if login[0] != email)
+                if self._in_flight is None or all(login[0] != email
+                                                  for login in self._in_flight):
+                    return
+                self._settled.wait()
+
+    def _take(self):
+        """
+        The function _take takes a batch off the queue, it is called with the lock held.
+        """
+        batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+        self._in_flight = batch or None
+        return batch
+
+    def _settle(self):
+        """
+        The function _settle marks the batch taken as written or queued again.
+        """
+        with self._condition:
+            self._in_flight = None
+            self._settled.notify_all()
+
+    def _next_batch(self):
+        """
+        The function _next_batch waits for a full batch, or for the oldest queued login to reach
+        the staleness bound, and takes the batch off the queue.
+        """
+        with self._condition:
+            while len(self._pending) < self.batch_size:
+                timeout = None
+                if self._pending:
+                    timeout = self._pending[0][1] + self.max_staleness - time.time()
+                    if timeout <= 0:
+                        break
+                self._condition.wait(timeout)
+            return self._take()
+
+    def _write(self, batch):
+        """
+        The function _write writes a batch, a batch which could not be written is queued again
+        in front of the newer logins, as far as the queue has room, the other logins are dropped.
+
+        :return: a boolean value. It returns False if the batch was queued again.
+        """
+        try:
+            self.write(group_logins(batch))
+            self.written += len(batch)
+            self.batches += 1
+            return True
+        except pymongo.errors.ConnectionFailure as ex:
+            logging.error('Exception at login history flush %s', str(ex))
+            self.failures += 1
+            with self._condition:
+                room = max(0, self.queue_size - len(self._pending))
+                self._pending.extendleft(reversed(batch[:room]))
+                lost = max(0, len(batch) - room)
+                self.dropped += lost
+            if lost:
+                logging.error('Exception at login history flush, %d logins dropped, the queue is '
+                              'full', lost)
+            return False
+        except pymongo.errors.PyMongoError as ex:
+            # not a connectivity issue, writing the batch again would fail again
+            logging.error('Exception at login history flush, %d logins dropped %s',
+                          len(batch), str(ex))
+            self.failures += 1
+            self.dropped += len(batch)
+            return True
+        finally:
+            self._settle()
+
+    def _run(self):
+        """
+        The function _run writes the batches, it is the body of the flusher thread.
+        """
+        while True:
+            batch = self._next_batch()
+            with self._write_lock:
+                written = self._write(batch)
+            if not written:
+                time.sleep(min(1.0, self.max_staleness))
+
+    def flush(self):
+        """
+        The function flush writes every queued login, after the batch being written by the
+        flusher, if any. It is called when the worker exits.
+
+        :return: a boolean value. It returns True if every queued login was written.
+        """
+        with self._write_lock:
+            while True:
+                with self._condition:
+                    batch = self._take()
+                if not batch:
+                    return True
+                if not self._write(batch):
+                    return False
+
+    def pending(self):
+        """
+        The function pending returns the number of queued logins.
+        """
+        return len(self._pending)
+
+    def stats(self):
+        """
+        The function stats reports the queue and the counters of the writer.
+        """
+        return {"mode": LOGIN_HISTORY_MODE, "queued": self.queued, "written": self.written,
+                "pending": self.pending(), "batches": self.batches,
+                "overflows": self.overflows, "failures": self.failures,
+                "dropped": self.dropped,
+                "queue_size": self.queue_size, "batch_size": self.batch_size,
+                "max_staleness": self.max_staleness}
+
+
+def create_writer(write):
+    """
+    The function create_writer creates the writer of the worker, configured by the
+    LOGIN_HISTORY_* environment variables, flushed when the worker exits.
+
+    :param write: The write is the function writing a batch, see LoginHistoryWriter
+    :return: the writer
+    """
+    writer = LoginHistoryWriter(write, LOGIN_HISTORY_QUEUE_SIZE, LOGIN_HISTORY_BATCH_SIZE,
+                                LOGIN_HISTORY_MAX_STALENESS)
+    os.register_at_fork(after_in_child=writer.reset)
+    atexit.register(writer.flush)
+    metrics.register_gauge("login_history_pending", "Logins queued for the login history "
+                           "write-behind", (), lambda series: [((), writer.pending())])
+    metrics.register_gauge("login_history_overflows_total", "Logins written synchronously as "
+                           "the write-behind queue was full", (),
+                           lambda series: [((), writer.overflows)], metric_type="counter")
+    return writer
@@ -0,0 +1,562 @@
+"""
+    The module collects the metrics of the Application and renders them in the Prometheus text
+    exposition format, served at /metrics:
+        http_requests_total, http_request_duration_seconds per route, method ( and status )
+        mongodb_command_duration_seconds per collection and command, through a pymongo
+        CommandListener
+        redis_command_duration_seconds per command, through an instrumented client
+        password_hash_duration_seconds per algorithm and operation
+        the MongoDB and Redis connection pool gauges
+
+    Recording takes no lock: every thread records into its own shard, a dictionary which only
+    that thread writes. A scrape merges the shards, and folds the shards of exited threads into
+    a retired shard, so the counters survive the short lived threads of a threaded server.
+
+    The series live in the memory of a worker process. Behind a pre-forking server all the
+    workers share the port, and a scrape is answered by any one of them, hence with
+    METRICS_DIR, a directory shared by the workers ( set by gunicorn.conf.py ), every worker
+    writes its series and gauges to its own file of the directory each METRICS_WRITE_INTERVAL
+    seconds ( see start_writer ) and when it exits, and a scrape sums the files of every
+    worker: the counters and histograms, those of the exited workers included, and the gauges
+    registered as counters. The other gauges are reported per live worker, with a "worker"
+    label holding its pid. Without METRICS_DIR a scrape reports the worker which answered it.
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import bisect
+import logging
+import threading
+import pymongo
+import redis
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = tuple(float(bound) for bound in os.environ.get(
+    "METRICS_LATENCY_BUCKETS",
+    "0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5").split(","))
+
+# Directory shared by the workers, None to report the worker answering the scrape
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+METRICS_WRITE_INTERVAL = float(os.environ.get("METRICS_WRITE_INTERVAL", "1"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Metric families, name: ( type, help, label names )
+FAMILIES = {}
+
+
+def _family(name, metric_type, help_text, labels):
+    FAMILIES[name] = (metric_type, help_text, labels)
+    return name
+
+
+HTTP_REQUESTS = _family("http_requests_total", "counter",
+                        "HTTP requests by route, method and status code",
+                        ("route", "method", "status"))
+HTTP_DURATION = _family("http_request_duration_seconds", "histogram",
+                        "HTTP request latency by route and method", ("route", "method"))
+MONGODB_DURATION = _family("mongodb_command_duration_seconds", "histogram",
+                           "MongoDB command latency by collection and command",
+                           ("collection", "command"))
+MONGODB_FAILURES = _family("mongodb_command_failures_total", "counter",
+                           "MongoDB commands which failed, by collection and command",
+                           ("collection", "command"))
+MONGODB_CHECKOUTS = _family("mongodb_pool_checkouts_total", "counter",
+                            "Connections checked out of the MongoDB pool", ("address",))
+MONGODB_CHECKINS = _family("mongodb_pool_checkins_total", "counter",
+                           "Connections checked in to the MongoDB pool", ("address",))
+MONGODB_CHECKOUT_FAILURES = _family("mongodb_pool_checkout_failures_total", "counter",
+                                    "Failed check outs of the MongoDB pool, by reason",
+                                    ("address", "reason"))
+MONGODB_CREATED = _family("mongodb_pool_connections_created_total", "counter",
+                          "Connections opened by the MongoDB pool", ("address",))
+MONGODB_CLOSED = _family("mongodb_pool_connections_closed_total", "counter",
+                         "Connections closed by the MongoDB pool", ("address",))
+REDIS_DURATION = _family("redis_command_duration_seconds", "histogram",
+                         "Redis command latency by command, a pipeline is a single PIPELINE",
+                         ("command",))
+REDIS_FAILURES = _family("redis_command_failures_total", "counter",
+                         "Redis commands which raised an error, by command", ("command",))
+PASSWORD_HASH_DURATION = _family("password_hash_duration_seconds", "histogram",
+                                 "Password hashing latency by algorithm and operation",
+                                 ("algorithm", "operation"))
+
+_LOCAL = threading.local()
+_SHARDS = []
+_RETIRED = {}
+_SHARDS_LOCK = threading.Lock()
+
+# Gauges computed at scrape time, name: ( help, label names, callback, type )
+_GAUGES = {}
+# maxPoolSize of the MongoDB pools, by address
+_MONGODB_POOL_SIZES = {}
+
+# File of this process in METRICS_DIR, and whether its writer thread runs
+_FILE = None
+_WRITER_STARTED = False
+
+
+def reset():
+    """
+    The function reset drops the metrics recorded by the parent in a forked child, the child
+    writes its own file of METRICS_DIR.
+    """
+    global _LOCAL, _SHARDS_LOCK, _FILE, _WRITER_STARTED
+    _LOCAL = threading.local()
+    _SHARDS_LOCK = threading.Lock()
+    del _SHARDS[:]
+    _RETIRED.clear()
+    _FILE = None
+    _WRITER_STARTED = False
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset)
+
+
+def _write_at_exit():
+    """
+    The function _write_at_exit writes the final series of an exiting worker, they stay in the
+    counters of METRICS_DIR.
+    """
+    if METRICS_DIR is not None and _WRITER_STARTED:
+        try:
+            _write()
+        except OSError as ex:
+            logging.error('Exception at metrics write %s', str(ex))
+
+
+atexit.register(_write_at_exit)
+
+
+def _shard():
+    """
+    The function _shard returns the shard of the current thread, registering it on first use.
+    """
+    try:
+        return _LOCAL.shard
+    except AttributeError:
+        shard = _LOCAL.shard = {}
+        with _SHARDS_LOCK:
+            _SHARDS.append((threading.current_thread(), shard))
+        return shard
+
+
+def inc(name, labels, amount=1):
+    """
+    The function inc increments a counter.
+
+    :param name: The name is the name of the counter family
+    :param labels: The labels is the tuple of the label values, in the order of the family
+    :param amount: The amount is the increment
+    """
+    if METRICS_ENABLED:
+        shard = _shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+def observe(name, labels, value):
+    """
+    The function observe records a value in a histogram.
+
+    :param name: The name is the name of the histogram family
+    :param labels: The labels is the tuple of the label values, in the order of the family
+    :param value: The value is the observed latency, in seconds
+    """
+    if METRICS_ENABLED:
+        shard = _shard()
+        key = (name, labels)
+        series = shard.get(key)
+        if series is None:
+            # a count per bucket, the +Inf bucket, then the sum
+            series = shard[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        series[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        series[-1] += value
+
+
+def register_gauge(name, help_text, labels, callback, metric_type="gauge"):
+    """
+    The function register_gauge registers a gauge which is computed at scrape time. A counter
+    kept by another module is registered the same way, with the metric_type "counter".
+
+    :param callback: The callback is called with the merged series ( see collect ), and returns
+    a list of ( label values tuple, value ) tuples
+    """
+    _GAUGES[name] = (help_text, labels, callback, metric_type)
+
+
+def _merge(target, shard):
+    """
+    The function _merge adds the series of a shard to the target.
+    """
+    for key, value in list(shard.items()):
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            target[key] = [total + part for total, part in zip(current, value)]
+        else:
+            target[key] = current + value
+
+
+def collect():
+    """
+    The function collect merges the shards of every thread.
+
+    :return: a dictionary of the series, ( name, label values ): value
+    """
+    merged = {}
+    with _SHARDS_LOCK:
+        alive = []
+        for thread, shard in _SHARDS:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                _merge(merged, shard)
+            else:
+                _merge(_RETIRED, shard)
+        _SHARDS[:] = alive
+        _merge(merged, _RETIRED)
+    return merged
+
+
+def _gauges(series):
+    """
+    The function _gauges computes the registered gauges.
+
+    :param series: The series is the dictionary returned by collect
+    :return: a list of ( name, label values tuple, value ) tuples
+    """
+    return [(name, tuple(labels), value) for name in sorted(_GAUGES)
+            for labels, value in _GAUGES[name][2](series)]
+
+
+def _write():
+    """
+    The function _write writes the series and the gauges of this process to its file of
+    METRICS_DIR, the file is replaced atomically.
+    """
+    global _FILE
+    if _FILE is None:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _FILE = os.path.join(METRICS_DIR, "%d-%s.json" % (os.getpid(), uuid.uuid4().hex[:8]))
+    series = collect()
+    document = {"pid": os.getpid(),
+                "series": [[name, list(labels), value] for (name, labels), value in series.items()],
+                "gauges": [[name, list(labels), value] for name, labels, value in _gauges(series)]}
+    temporary = _FILE + ".tmp"
+    with open(temporary, "w", encoding='utf-8') as file:
+        json.dump(document, file)
+    os.replace(temporary, _FILE)
+
+
+def _run_writer():
+    """
+    The function _run_writer writes the file of this process periodically, it is the body of
+    the writer thread.
+    """
+    while True:
+        time.sleep(METRICS_WRITE_INTERVAL)
+        try:
+            _write()
+        except OSError as ex:
+            logging.error('Exception at metrics write %s', str(ex))
+
+
+def start_writer():
+    """
+    The function start_writer starts the writer thread of a worker process, with METRICS_DIR.
+    It is called in the worker after the fork, the master forking the workers runs no thread.
+    """
+    global _WRITER_STARTED
+    if METRICS_DIR is not None and not _WRITER_STARTED:
+        with _SHARDS_LOCK:
+            if _WRITER_STARTED:
+                return
+            _WRITER_STARTED = True
+        threading.Thread(target=_run_writer, daemon=True, name="metrics-writer").start()
+
+
+def _alive(pid):
+    """
+    The function _alive checks if a process is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_workers():
+    """
+    The function _read_workers sums the files of every worker of METRICS_DIR, after writing the
+    file of this process.
+
+    :return: a tuple of the summed series, a dictionary as returned by collect, and the list of
+    the gauges, the gauges registered as counters summed and the others of each live worker
+    labelled with its pid
+    """
+    _write()
+    series = {}
+    counters = {}
+    gauges = []
+    for entry in sorted(os.listdir(METRICS_DIR)):
+        if not entry.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, entry), encoding='utf-8') as file:
+                document = json.load(file)
+        except (OSError, ValueError):
+            # a file of a worker written meanwhile is replaced, never partially read
+            continue
+        _merge(series, {(name, tuple(labels)): value
+                        for name, labels, value in document["series"]})
+        alive = _alive(document["pid"])
+        for name, labels, value in document["gauges"]:
+            if name not in _GAUGES:
+                continue
+            if _GAUGES[name][3] == "counter":
+                key = (name, tuple(labels))
+                counters[key] = counters.get(key, 0) + value
+            elif alive:
+                gauges.append((name, tuple(labels) + (str(document["pid"]),), value))
+    gauges.extend((name, labels, value) for (name, labels), value in counters.items())
+    return series, sorted(gauges)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = ["%s=\"%s\"" % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render():
+    """
+    The function render renders the metrics in the Prometheus text exposition format.
+
+    :return: the metrics as a string
+    """
+    if METRICS_DIR is not None:
+        series, gauges = _read_workers()
+    else:
+        series = collect()
+        gauges = _gauges(series)
+    by_family = {}
+    for (name, labels), value in series.items():
+        by_family.setdefault(name, []).append((labels, value))
+    lines = []
+    for name in sorted(by_family):
+        metric_type, help_text, label_names = FAMILIES[name]
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for labels, value in sorted(by_family[name]):
+            if metric_type == "counter":
+                lines.append("%s%s %s" % (name, _labels(label_names, labels), value))
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + (None,), value):
+                cumulative += count
+                le = "le=\"%s\"" % ("+Inf" if bound is None else repr(bound))
+                lines.append("%s_bucket%s %d" % (name, _labels(label_names, labels, le),
+                                                  cumulative))
+            lines.append("%s_sum%s %r" % (name, _labels(label_names, labels), value[-1]))
+            lines.append("%s_count%s %d" % (name, _labels(label_names, labels), cumulative))
+    by_gauge = {}
+    for name, labels, value in gauges:
+        by_gauge.setdefault(name, []).append((labels, value))
+    for name in sorted(_GAUGES):
+        help_text, label_names, _, metric_type = _GAUGES[name]
+        if METRICS_DIR is not None and metric_type != "counter":
+            label_names = tuple(label_names) + ("worker",)
+        lines.append("# HELP %s %s" % (name, help_text))
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for labels, value in sorted(by_gauge.get(name, ())):
+            lines.append("%s%s %s" % (name, _labels(label_names, labels), value))
+    return "\n".join(lines) + "\n"
+
+
+class MongoCommandListener(pymongo.monitoring.CommandListener):
+    """
+    The class MongoCommandListener times the MongoDB commands by collection and command.
+    """
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else "")
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        observe(MONGODB_DURATION, (collection, event.command_name),
+                event.duration_micros / 1000000.0)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        observe(MONGODB_DURATION, (collection, event.command_name),
+                event.duration_micros / 1000000.0)
+        inc(MONGODB_FAILURES, (collection, event.command_name))
+
+
+class MongoPoolListener(pymongo.monitoring.ConnectionPoolListener):
+    """
+    The class MongoPoolListener counts the connections of the MongoDB pools, the gauges are
+    derived from the counters at scrape time.
+    """
+
+    @staticmethod
+    def _address(event):
+        return "%s:%s" % event.address
+
+    def pool_created(self, event):
+        _MONGODB_POOL_SIZES[self._address(event)] = event.options.get("maxPoolSize", 100)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        inc(MONGODB_CREATED, (self._address(event),))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        inc(MONGODB_CLOSED, (self._address(event),))
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        inc(MONGODB_CHECKOUT_FAILURES, (self._address(event), str(event.reason)))
+
+    def connection_checked_out(self, event):
+        inc(MONGODB_CHECKOUTS, (self._address(event),))
+
+    def connection_checked_in(self, event):
+        inc(MONGODB_CHECKINS, (self._address(event),))
+
+
+def mongo_event_listeners():
+    """
+    The function mongo_event_listeners returns the event listeners to pass to a MongoDB client.
+    """
+    if not METRICS_ENABLED:
+        return []
+    return [MongoCommandListener(), MongoPoolListener()]
+
+
+def _mongodb_pool_gauge(created, closed):
+    def callback(series):
+        return [((address,), series.get((created, (address,)), 0)
+                 - series.get((closed, (address,)), 0))
+                for address in sorted(_MONGODB_POOL_SIZES)]
+    return callback
+
+
+register_gauge("mongodb_pool_connections_in_use", "Connections checked out of the MongoDB pool",
+               ("address",), _mongodb_pool_gauge(MONGODB_CHECKOUTS, MONGODB_CHECKINS))
+register_gauge("mongodb_pool_connections_open", "Connections open in the MongoDB pool",
+               ("address",), _mongodb_pool_gauge(MONGODB_CREATED, MONGODB_CLOSED))
+register_gauge("mongodb_pool_max_connections", "Maximum size of the MongoDB pool",
+               ("address",), lambda series: [((address,), size) for address, size
+                                      in sorted(_MONGODB_POOL_SIZES.items())])
+
+
+def _command_name(args):
+    name = args[0] if args else ""
+    return (name.decode('utf-8') if isinstance(name, bytes) else str(name)).upper()
+
+
+def instrument_redis(client):
+    """
+    The function instrument_redis times the commands and the pipelines of a redis-py client.
+    The Lua scripts run as EVALSHA commands.
+
+    :param client: The client is a redis.Redis client, it is instrumented in place
+    :return: the client
+    """
+    if not METRICS_ENABLED:
+        return client
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return execute_command(*args, **options)
+        except redis.exceptions.NoScriptError:
+            raise
+        except Exception:
+            inc(REDIS_FAILURES, (_command_name(args),))
+            raise
+        finally:
+            observe(REDIS_DURATION, (_command_name(args),), time.perf_counter() - started)
+
+    def timed_pipeline(*args, **kwargs):
+        instance = pipeline(*args, **kwargs)
+        execute = instance.execute
+
+        def timed_execute(*execute_args, **execute_kwargs):
+            started = time.perf_counter()
+            try:
+                return execute(*execute_args, **execute_kwargs)
+            except Exception:
+                inc(REDIS_FAILURES, ("PIPELINE",))
+                raise
+            finally:
+                observe(REDIS_DURATION, ("PIPELINE",), time.perf_counter() - started)
+        instance.execute = timed_execute
+        return instance
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
+
+
+def instrument_async_redis(client):
+    """
+    The function instrument_async_redis times the commands of a redis.asyncio client.
+
+    :param client: The client is a redis.asyncio.Redis client, it is instrumented in place
+    :return: the client
+    """
+    if not METRICS_ENABLED:
+        return client
+    execute_command = client.execute_command
+
+    async def timed_execute_command(*args, **options):
+        started = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        except redis.exceptions.NoScriptError:
+            raise
+        except Exception:
+            inc(REDIS_FAILURES, (_command_name(args),))
+            raise
+        finally:
+            observe(REDIS_DURATION, (_command_name(args),), time.perf_counter() - started)
+
+    client.execute_command = timed_execute_command
+    return client
@@ -14,30 +14,185 @@
     performed:
 """
 import os
-import hashlib
 import uuid
 import time
+import threading
 from datetime import datetime
 import logging
 import pymongo
 import redis_cache
+import password_hasher
+import session_token
+import profile_cache
+import login_history
+import email_filter
+import metrics
+import circuit_breaker
 import appconstants
 
-CONNECTION_STRING = "mongodb://%s:%s" % (
-    os.environ["MONGODB_HOST"], os.environ["MONGODB_PORT"])
-DBCLIENT = pymongo.MongoClient(
-    CONNECTION_STRING, serverSelectionTimeoutMS=5000)
-# Database
-USER_DB = DBCLIENT["userdatabase"]
+# Pool and timeouts of the MongoDB client, see client_options
+MONGODB_MAX_POOL_SIZE = int(os.environ.get("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.environ.get("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+# 0 leaves the socket reads and the wait for a pooled connection without a timeout
+MONGODB_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGODB_SOCKET_TIMEOUT_MS", "0"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "0"))
 
-# Collection
-USERS = USER_DB["users"]
-USERLOGIN = USER_DB["userlogin"]
+# Database and collections
+DATABASE_NAME = "userdatabase"
+USERS_COLLECTION = "users"
+USERLOGIN_COLLECTION = "userlogin"
+
+# Client and collections of this process, created on first use by _connection
+_CONNECTION = None
+_CONNECTION_LOCK = threading.Lock()
+
+
+def connection_string():
+    """
+    The function connection_string builds the MongoDB connection string from the MONGODB_HOST
+    and MONGODB_PORT environment variables, read when the client is created.
+    """
+    return "mongodb://%s:%s" % (os.environ["MONGODB_HOST"], os.environ["MONGODB_PORT"])
+
+
+def client_options():
+    """
+    The function client_options builds the keyword arguments of the MongoDB client ( sync or
+    asyncio ) from the MONGODB_* pool and timeout settings.
+    """
+    options = {"maxPoolSize": MONGODB_MAX_POOL_SIZE,
+               "minPoolSize": MONGODB_MIN_POOL_SIZE,
+               "serverSelectionTimeoutMS": MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+               "connectTimeoutMS": MONGODB_CONNECT_TIMEOUT_MS,
+               "event_listeners": metrics.mongo_event_listeners()}
+    if MONGODB_SOCKET_TIMEOUT_MS > 0:
+        options["socketTimeoutMS"] = MONGODB_SOCKET_TIMEOUT_MS
+    if MONGODB_WAIT_QUEUE_TIMEOUT_MS > 0:
+        options["waitQueueTimeoutMS"] = MONGODB_WAIT_QUEUE_TIMEOUT_MS
+    return options
+
+
+def _connection():
+    """
+    The function _connection returns the client and the collections of this process, creating
+    them on first use. Nothing connects at import, hence a worker forked from a pre-loaded
+    parent creates its own pool instead of inheriting the sockets of the parent.
+
+    :return: a tuple of the client, the users collection and the userlogin collection. The
+    collections are called through the MongoDB circuit breaker.
+    """
+    global _CONNECTION
+    connection = _CONNECTION
+    if connection is None:
+        with _CONNECTION_LOCK:
+            if _CONNECTION is None:
+                dbclient = pymongo.MongoClient(connection_string(), **client_options())
+                user_db = dbclient[DATABASE_NAME]
+                _CONNECTION = (
+                    dbclient,
+                    circuit_breaker.GuardedCollection(user_db[USERS_COLLECTION],
+                                                      circuit_breaker.MONGODB),
+                    circuit_breaker.GuardedCollection(user_db[USERLOGIN_COLLECTION],
+                                                      circuit_breaker.MONGODB))
+            connection = _CONNECTION
+    return connection
+
+
+def client():
+    """
+    The function client returns the MongoDB client of this process.
+    """
+    return _connection()[0]
+
+
+def users():
+    """
+    The function users returns the users collection of this process.
+    """
+    return _connection()[1]
+
+
+def userlogin():
+    """
+    The function userlogin returns the userlogin collection of this process.
+    """
+    return _connection()[2]
+
+
+def close():
+    """
+    The function close closes the MongoDB client of this process, the next call creates a new
+    one. The launcher calls it after creating the indexes, before forking the workers.
+    """
+    global _CONNECTION
+    with _CONNECTION_LOCK:
+        connection, _CONNECTION = _CONNECTION, None
+    if connection is not None:
+        connection[0].close()
+
+
+def _reset_after_fork():
+    """
+    The function _reset_after_fork drops, in a forked child, the client inherited from the
+    parent, it is not closed since its sockets belong to the parent.
+    """
+    global _CONNECTION, _CONNECTION_LOCK
+    _CONNECTION = None
+    _CONNECTION_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def ping():
+    """
+    The function ping checks, through the MongoDB circuit breaker, that MongoDB answers.
+
+    :return: a boolean value. It returns True if MongoDB answered the ping command.
+    """
+    try:
+        circuit_breaker.MONGODB.call(client().admin.command, "ping")
+        return True
+    except pymongo.errors.ConnectionFailure as ex:
+        logging.error('Exception at ping %s', str(ex))
+        return False
+
+
+# Number of login timestamps retained per user in the userlogin collection
+LOGIN_HISTORY_LIMIT = int(os.environ.get("LOGIN_HISTORY_LIMIT", "10"))
+
+# Set once the unique email indexes are in place, add_user relies on them. The indexes are
+# created at startup, by the launcher before forking the workers, never on the request path.
+INDEXES_CREATED = False
+
+
+def create_indexes():
+    """
+    The function `create_indexes` creates the unique email indexes on the users and userlogin
+    collections. Index creation is idempotent, hence it is safe to call on every startup. The
+    launchers call it at startup and refuse to start if it fails.
+
+    :return: a boolean value. It returns True if the indexes exist after the call, and False if
+    MongoDB could not be reached or the index could not be built ( ex. duplicate emails ).
+    """
+    global INDEXES_CREATED
+    try:
+        users().create_index("email", unique=True, name="email_unique")
+        userlogin().create_index("email", unique=True, name="email_unique")
+        INDEXES_CREATED = True
+    except (pymongo.errors.ConnectionFailure, pymongo.errors.OperationFailure) as ex:
+        logging.error('Exception at create_indexes %s', str(ex))
+    return INDEXES_CREATED
 
 
 def add_user(username, email, password):
     """
-    The function `add_user` adds a user to a MongoDB document, encrypting their password using MD5.
+    The function `add_user` adds a user to a MongoDB document, hashing their password with the
+    configured KDF of the password_hasher module.
 
     :param username: The username parameter is a string that represents the username of the user
     you want to add to the MongoDB document
@@ -48,26 +203,91 @@ def add_user(username, email, password):
     :return: a dictionary with a "status" key. The value of the "status" key depends on whether the
     user was successfully added or not. If the user was added, the value will be "user added". If 
     the user was not added because the email already exists in the database, the value will be 
-    "please try with new email address".
+    "please try with new email address". The user is refused with an exception if the unique
+    email indexes are not in place, a duplicate email would not be rejected.
     """
+    if not INDEXES_CREATED:
+        return appconstants.EMAIL_INDEXES_MISSING
     response = {}
 
     try:
-        cursor = USERS.find_one({"email": email})
-        encrypted_password = hashlib.md5(password.encode('utf-8')).hexdigest()
+        encrypted_password = password_hasher.hash_password(password)
 
         entry = {"username": username, "email": email, "password": encrypted_password}
-        if cursor is None:
-            USERS.insert_one(entry)
-            response = appconstants.USER_ADDED
-        else:
-            response = appconstants.EMAIL_ALREADY_EXISTS
+        # The unique index on email rejects duplicates, no lookup is needed beforehand
+        users().insert_one(entry)
+        response = appconstants.USER_ADDED
+        email_filter.added([email])
+        # a "user not found" response may be cached
+        profile_cache.invalidate(email)
+    except pymongo.errors.DuplicateKeyError:
+        response = appconstants.EMAIL_ALREADY_EXISTS
+    except password_hasher.PasswordHasherBusy as ex:
+        response = appconstants.PASSWORD_HASHER_BUSY
+        logging.error('Exception at add_user %s', str(ex))
     except pymongo.errors.ConnectionFailure as ex:
         response = appconstants.MONGODB_CONNECTIVITY_ISSUE
         logging.error('Exception at add_user %s', str(ex))
     return response
 
 
+def add_users(entries):
+    """
+    The function `add_users` adds several users with a single unordered insert_many, it is used
+    by the bulk import. The passwords of the entries must already be hashed.
+
+    :param entries: The entries parameter is a list of dictionaries with the keys "username",
+    "email" and "password"
+    :return: a list of responses, in the order of the entries. Each response is either
+    "user added successfully", "please try with new email address", or an exception, see
+    add_user.
+    """
+    if not entries:
+        return []
+    if not INDEXES_CREATED:
+        return [appconstants.EMAIL_INDEXES_MISSING] * len(entries)
+    responses = [appconstants.USER_ADDED] * len(entries)
+    try:
+        users().insert_many(entries, ordered=False)
+    except pymongo.errors.BulkWriteError as ex:
+        for error in ex.details.get("writeErrors", []):
+            if error.get("code") == 11000:
+                responses[error["index"]] = appconstants.EMAIL_ALREADY_EXISTS
+            else:
+                responses[error["index"]] = appconstants.USER_ADD_FAILED
+                logging.error('Exception at add_users %s', error.get("errmsg"))
+    except pymongo.errors.ConnectionFailure as ex:
+        logging.error('Exception at add_users %s', str(ex))
+        return [appconstants.MONGODB_CONNECTIVITY_ISSUE] * len(entries)
+    emails = [entry["email"] for entry, response in zip(entries, responses)
+              if response is appconstants.USER_ADDED]
+    email_filter.added(emails)
+    profile_cache.invalidate_many(emails)
+    return responses
+
+
+def export_users(after=None, page_size=1000):
+    """
+    The function `export_users` reads the users in email order, one page at a time. Pages are
+    fetched by keyset pagination on the unique email index, hence the whole collection is
+    never held in memory and a page costs the same however deep the export is.
+
+    :param after: The after parameter is the email to resume after, or None to start from the
+    beginning
+    :param page_size: The page_size parameter is the number of users fetched per round trip
+    :return: a generator of dictionaries with the keys "username" and "email". It raises
+    pymongo.errors.ConnectionFailure if MongoDB could not be reached.
+    """
+    while True:
+        query = {} if after is None else {"email": {"$gt": after}}
+        page = list(users().find(query, {"_id": 0, "username": 1, "email": 1})
+                    .sort("email", pymongo.ASCENDING).limit(page_size))
+        yield from page
+        if len(page) < page_size:
+            return
+        after = page[-1]["email"]
+
+
 def delete_user(username, email):
     """
     The function `delete_user` deletes a user from a MongoDB document based on their username
@@ -85,10 +305,12 @@ def delete_user(username, email):
     USER_DELETE["username"] = username
     response = {}
     try:
-        delete_cursor = USERS.delete_one(USER_DELETE)
+        delete_cursor = users().delete_one(USER_DELETE)
         if delete_cursor.deleted_count == 1:
             response = appconstants.USER_DELETED
-            USERLOGIN.delete_one(USERLOGIN_DELETE)
+            LOGIN_HISTORY.discard(email)
+            userlogin().delete_one(USERLOGIN_DELETE)
+            profile_cache.invalidate(email)
         else:
             response = appconstants.USER_DELETE_FAILED
     except pymongo.errors.ConnectionFailure as ex:
@@ -115,9 +337,10 @@ def update_user(username, email, encrypted_password):
     new_value = {"$set": {"password": encrypted_password}}
     response = {}
     try:
-        update_cursor = USERS.update_one(query_parameters, new_value)
+        update_cursor = users().update_one(query_parameters, new_value)
         if update_cursor.modified_count == 1:
             response = appconstants.USER_UPDATE
+            profile_cache.invalidate(email)
         else:
             response = appconstants.USER_UPDATE_FAILED
     except pymongo.errors.ConnectionFailure as ex:
@@ -126,79 +349,272 @@ def update_user(username, email, encrypted_password):
     return response
 
 
-def list_user(email):
+def list_user_pipeline(email, limit=None, before=None):
+    """
+    The function `list_user_pipeline` builds the aggregation of list_user, which fetches the
+    user profile and the requested slice of the login history in a single round trip.
+
+    :param email: The email parameter is the email address of the user
+    :param limit: The limit parameter is the maximum number of login entries, or None
+    :param before: The before parameter is an epoch timestamp bounding the login entries, or None
+    :return: the aggregation pipeline, to run on the users collection
+    """
+    history = {"$arrayElemAt": ["$login.lastlogin", 0]}
+    if before is not None:
+        history = {"$filter": {"input": history, "as": "login",
+                               "cond": {"$lt": ["$$login", before]}}}
+    if limit is not None:
+        history = {"$slice": [history, -min(limit, LOGIN_HISTORY_LIMIT)]}
+    return [
+        {"$match": {"email": email}},
+        {"$limit": 1},
+        {"$lookup": {"from": USERLOGIN_COLLECTION, "localField": "email",
+                     "foreignField": "email", "as": "login"}},
+        {"$project": {"_id": 0, "username": 1, "email": 1, "lastlogin": history}}
+    ]
+
+
+def list_user_response(cursor, limit=None):
+    """
+    The function `list_user_response` formats the result of the list_user aggregation.
+
+    :param cursor: The cursor is the document returned by the aggregation, or None
+    :param limit: The limit parameter is the limit of the request, or None
+    :return: the list_user response
+    """
+    if cursor is None:
+        return appconstants.USER_NOT_FOUND
+    if cursor.get("lastlogin") is None:
+        response = {
+            "username": cursor["username"], "email": cursor["email"]}
+        response["lastlogin"] = appconstants.USER_FIRST_LOGIN
+        return response
+    lastlogin = cursor["lastlogin"]
+    response = {"username": cursor["username"], "email": cursor["email"],
+                "lastlogin": [datetime.fromtimestamp(login) for login in lastlogin]}
+    if limit is not None and lastlogin and len(lastlogin) == limit:
+        response["next_before"] = lastlogin[0]
+    return response
+
+
+def login_history_update(timestamps=None):
+    """
+    The function `login_history_update` builds the update which records logins, a single
+    atomic upsert which keeps only the latest LOGIN_HISTORY_LIMIT entries, in time order.
+
+    :param timestamps: The timestamps is the list of the epoch times of the logins, or None for
+    a login now
+    """
+    return {"$push": {"lastlogin": {"$each": timestamps or [time.time()], "$sort": 1,
+                                    "$slice": -LOGIN_HISTORY_LIMIT}}}
+
+
+def write_login_history(logins):
+    """
+    The function `write_login_history` writes the queued logins of several users with a single
+    unordered bulk_write, then invalidates the cached profiles of the users.
+
+    :param logins: The logins is the dictionary of the login timestamps of each email
+    :raises pymongo.errors.ConnectionFailure: if MongoDB can not be reached
+    """
+    userlogin().bulk_write([pymongo.UpdateOne({"email": email}, login_history_update(timestamps),
+                                              upsert=True)
+                            for email, timestamps in logins.items()], ordered=False)
+    profile_cache.invalidate_many(list(logins))
+
+
+# Write-behind of the login history, see login_history
+LOGIN_HISTORY = login_history.create_writer(write_login_history)
+
+
+def list_user(email, limit=None, before=None, version=None):
     """
     The function "list_user" retrieves user information from a MongoDB document and returns it in a
-    formatted response.
+    formatted response. The user profile and the login history are fetched with a single
+    aggregation which projects only the fields of the response. Responses are served from the
+    profile_cache when possible.
 
     :param email: The email parameter is a string that represents the email address of the user you
     want to retrieve information for
+    :param limit: The limit parameter is the maximum number of ( most recent ) login entries to
+    return. All the retained entries are returned if it is None
+    :param before: The before parameter is an epoch timestamp, only the login entries older than
+    it are returned. It is used to page through the login history
+    :param version: The version is the profile version the response is labelled with, read
+    before the call, a cached response is only served if it was read under that version
     :return: a dictionary containing information about the user. If the user is not found in the
     database, the dictionary will have a key "user" with the value "Not_Found". If the user is
     found, the dictionary will have keys "username", "email", and "lastlogin". The value of
-    "lastlogin" will be a list of readable dates representing the user's last login
+    "lastlogin" will be a list of readable dates representing the user's last login. If a full
+    page of history was returned, "next_before" holds the value of before for the next page.
+    An email the email_filter does not know is not found without a MongoDB call
     """
+    if not email_filter.FILTER.might_exist(email):
+        return appconstants.USER_NOT_FOUND
+    pipeline = list_user_pipeline(email, limit, before)
+    cache_key = (email, limit, before)
+    if profile_cache.PROFILE_CACHE_ENABLED:
+        response = profile_cache.CACHE.get(cache_key, version)
+        if response is not None:
+            return response
+        snapshot = profile_cache.CACHE.snapshot(email)
     response = {}
     try:
-        cursor = USERS.find_one({"email": email})
-        if cursor is None:
-            response = appconstants.USER_NOT_FOUND
-        else:
-            login_entry_cursor = USERLOGIN.find_one({"email": email})
-            if login_entry_cursor is None:
-                response = {
-                    "username": cursor["username"], "email": cursor["email"]}
-                response["lastlogin"] = appconstants.USER_FIRST_LOGIN
-            else:
-                readable_date_array = []
-                for login in login_entry_cursor["lastlogin"]:
-                    readable_date_array.append(datetime.fromtimestamp(login))
-                response = {"username": cursor["username"], "email": cursor["email"],
-                            "lastlogin": readable_date_array}
+        response = list_user_response(next(users().aggregate(pipeline), None), limit)
+        if response is appconstants.USER_NOT_FOUND:
+            email_filter.FILTER.record_false_positive(email)
+        if profile_cache.PROFILE_CACHE_ENABLED:
+            profile_cache.CACHE.put(cache_key, snapshot, response, version)
     except pymongo.errors.ConnectionFailure as ex:
         response = appconstants.MONGODB_CONNECTIVITY_ISSUE
         logging.error('Exception at list_user %s', str(ex))
     return response
 
 
-def login_user(email, encrypted_password):
+def list_users_lookup(emails):
     """
-    The function `login_user` checks if a user with the given email and encrypted password exists
-    in the MongoDB document, and if so, generates a valid token and updates the user's login
-    history.
+    The function `list_users_lookup` answers, for the users of a batch, the emails the
+    email_filter does not know and the profiles found in the profile_cache.
+
+    :param emails: The emails parameter is a list of email addresses
+    :return: a ( responses, missing, snapshots ) tuple, responses is the dictionary of the
+    responses of each email answered, missing the list of the other emails, to be fetched from
+    MongoDB, and snapshots the profile_cache snapshot of each missing email.
+    """
+    responses = {}
+    missing = []
+    snapshots = {}
+    for email in dict.fromkeys(emails):
+        if not email_filter.FILTER.might_exist(email):
+            responses[email] = appconstants.USER_NOT_FOUND
+            continue
+        if profile_cache.PROFILE_CACHE_ENABLED:
+            response = profile_cache.CACHE.get((email, None, None))
+            if response is not None:
+                responses[email] = response
+                continue
+            snapshots[email] = profile_cache.CACHE.snapshot(email)
+        missing.append(email)
+    return responses, missing, snapshots
+
+
+def list_users_fill(responses, snapshots, profiles, logins):
+    """
+    The function `list_users_fill` formats the profiles fetched for a batch, as list_user does,
+    and stores them in the profile_cache.
+
+    :param responses: The responses is the dictionary of the responses of each email, filled in
+    :param snapshots: The snapshots is the profile_cache snapshot of each fetched email
+    :param profiles: The profiles is the list of the users documents found
+    :param logins: The logins is the list of the userlogin documents found
+    """
+    history = {login["email"]: login.get("lastlogin") for login in logins}
+    found = {profile["email"]: profile for profile in profiles}
+    for email, snapshot in snapshots.items():
+        profile = found.get(email)
+        document = None
+        if profile is not None:
+            document = {"username": profile["username"], "email": email,
+                        "lastlogin": history.get(email)}
+        response = list_user_response(document)
+        if response is appconstants.USER_NOT_FOUND:
+            email_filter.FILTER.record_false_positive(email)
+        if profile_cache.PROFILE_CACHE_ENABLED:
+            profile_cache.CACHE.put((email, None, None), snapshot, response)
+        responses[email] = response
+
+
+def list_users(emails):
+    """
+    The function `list_users` retrieves the profiles of several users, as list_user without limit
+    and before does for one, with a single $in query on each collection. The emails the
+    email_filter does not know and the cached profiles are answered without a MongoDB call.
+
+    :param emails: The emails parameter is a list of email addresses
+    :return: the list of the list_user responses, in the order of emails. If MongoDB can not be
+    reached, the responses not answered otherwise are the MongoDB connectivity exception.
+    """
+    responses, missing, snapshots = list_users_lookup(emails)
+    if missing:
+        try:
+            projection = {"_id": 0, "username": 1, "email": 1}
+            profiles = list(users().find({"email": {"$in": missing}}, projection))
+            logins = list(userlogin().find(
+                {"email": {"$in": [profile["email"] for profile in profiles]}},
+                {"_id": 0, "email": 1, "lastlogin": 1})) if profiles else []
+            list_users_fill(responses, {email: snapshots.get(email) for email in missing},
+                            profiles, logins)
+        except pymongo.errors.ConnectionFailure as ex:
+            logging.error('Exception at list_users %s', str(ex))
+    return [responses.get(email, appconstants.MONGODB_CONNECTIVITY_ISSUE) for email in emails]
+
+
+def login_user(email, password):
+    """
+    The function `login_user` checks if a user with the given email exists in the MongoDB
+    document and the password matches the stored hash, and if so, generates a valid token and
+    records the login in the user's login history. The login is queued to the write-behind of
+    login_history, unless LOGIN_HISTORY_MODE=sync or its queue is full, then it is written before
+    the response. The login history is capped at LOGIN_HISTORY_LIMIT entries.
+    A stored hash of an outdated algorithm ( ex. legacy MD5 ) is replaced on successful login.
+    The token is stored once the MongoDB writes are done, a failed write leaves no session the
+    client never received.
 
     :param email: The email parameter is the email address of the user trying to log in
-    :param encrypted_password: The encrypted password is a string that represents the user's 
-    password after it has been encrypted or hashed for security purposes
+    :param password: The password is a string that represents the user's plain text password,
+    it is verified against the stored hash
     :return: a dictionary containing the status of the user login and a token. The status can be
     either "user login failed" or "user login success", depending on whether the user with the
-    given email and encrypted password exists in the database. If the login is successful, a token
-    is also included in the response.
+    given email and password exists in the database. If the login is successful, a token
+    is also included in the response. In the opaque token mode, the login is refused with the
+    Redis connectivity exception if the token can not be stored, before any work while the Redis
+    circuit breaker is open. An email the email_filter does not know fails without a MongoDB call.
     """
     response = {}
+    if not session_token.is_signed_mode() and not circuit_breaker.REDIS.available():
+        return appconstants.REDIS_CONNECTIVITY_ISSUE
+    if not email_filter.FILTER.might_exist(email):
+        return appconstants.USER_LOGIN_FAILED
     try:
-        cursor = USERS.find_one(
-            {"email": email, "password": encrypted_password})
+        cursor = users().find_one({"email": email}, {"password": 1})
         if cursor is None:
+            email_filter.FILTER.record_false_positive(email)
+        if cursor is None or not password_hasher.verify_password(password, cursor["password"]):
             response = appconstants.USER_LOGIN_FAILED
         else:
-            token = uuid.uuid4().hex[:6].upper()
-            login_entry_cursor = USERLOGIN.find_one({"email": email})
-            if login_entry_cursor is None:
-                login_entry_record = {
-                    "email": email, "lastlogin": [time.time()]}
-                USERLOGIN.insert_one(login_entry_record)
+            if password_hasher.needs_rehash(cursor["password"]):
+                _rehash_password(cursor, password)
+            # Update Login History, queued to the write-behind unless written synchronously
+            if not LOGIN_HISTORY.record(email, time.time()):
+                userlogin().update_one({"email": email}, login_history_update(), upsert=True)
+                profile_cache.invalidate(email)
+            if session_token.is_signed_mode():
+                token = session_token.issue_token(email)
             else:
-                lastlogin = login_entry_cursor["lastlogin"]
-                lastlogin.append(time.time())
-                # Update Login History
-                query = {"email": email}
-                new_value = {"$set": {"lastlogin": lastlogin}}
-                USERLOGIN.update_one(query, new_value)
-            redis_cache.persist_client_token(email, token)
-            response = appconstants.USER_LOGIN_SUCCESS
-            response["token"]= token
+                token = uuid.uuid4().hex[:6].upper()
+                if not redis_cache.persist_client_token(email, token):
+                    return appconstants.REDIS_CONNECTIVITY_ISSUE
+            response = dict(appconstants.USER_LOGIN_SUCCESS, token=token)
+    except password_hasher.PasswordHasherBusy as ex:
+        response = appconstants.PASSWORD_HASHER_BUSY
+        logging.error('Exception at login_user %s', str(ex))
     except pymongo.errors.ConnectionFailure as ex:
         response = appconstants.MONGODB_CONNECTIVITY_ISSUE
         logging.error('Exception at login_user %s', str(ex))
     return response
+
+
+def _rehash_password(cursor, password):
+    """
+    The function `_rehash_password` replaces an outdated password hash with a hash of the
+    configured KDF. The update is conditional on the old hash, so a concurrent password
+    update is never overwritten. A busy hashing pool only postpones the upgrade.
+
+    :param cursor: The cursor is the user document, holding "_id" and the stored "password"
+    :param password: The password is the verified plain text password of the user
+    """
+    try:
+        users().update_one({"_id": cursor["_id"], "password": cursor["password"]},
+                         {"$set": {"password": password_hasher.hash_password(password)}})
+    except password_hasher.PasswordHasherBusy as ex:
+        logging.error('Exception at _rehash_password %s', str(ex))
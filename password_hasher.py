@@ -0,0 +1,266 @@
+"""
+    The module provides functions for hashing and verifying User passwords.
+
+    Passwords are derived with a tunable KDF ( scrypt or PBKDF2 ) on a bounded process pool, so
+    that the Flask workers are not stalled by the KDF. When the pool and its queue are
+    saturated, new requests are shed with PasswordHasherBusy instead of queueing without limit.
+    A pool broken by the death of one of its processes is dropped and recreated on next use, the
+    requests it failed are answered with PasswordHasherBusy.
+
+    The pool is created lazily in a worker which already runs threads, its processes are started
+    by a forkserver instead of forking the threaded worker, a fork would copy the locks held by
+    the other threads ( logging, the connection pools ) into the hashing processes.
+
+    Stored hashes carry the algorithm and its parameters:
+        scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+        pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+    Hashes without a prefix are legacy MD5 hashes, they are verified for backward compatibility
+    and reported as needing a rehash.
+"""
+import os
+import time
+import hmac
+import hashlib
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+
+PASSWORD_HASH_ALGORITHM = os.environ.get("PASSWORD_HASH_ALGORITHM", "scrypt")
+SCRYPT_N = int(os.environ.get("SCRYPT_N", "16384"))
+SCRYPT_R = int(os.environ.get("SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("SCRYPT_P", "1"))
+PBKDF2_ITERATIONS = int(os.environ.get("PBKDF2_ITERATIONS", "260000"))
+# Process pool size, and number of requests allowed to wait for a free process
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE_SIZE = int(os.environ.get("PASSWORD_HASH_QUEUE_SIZE", "64"))
+# Seconds a request waits for its hash before giving up
+PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "5"))
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+_SLOTS = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE)
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the hashing pool and its queue are full, a hash did not complete in time, or
+    the pool broke.
+    """
+
+
+def _derive(algorithm, password, salt, params):
+    """
+    The function `_derive` runs the KDF, it is executed in the worker processes of the pool.
+
+    :param algorithm: The algorithm is either "scrypt" or "pbkdf2_sha256"
+    :param password: The password is the plain text password of the user
+    :param salt: The salt is the random salt of the hash, as bytes
+    :param params: The params is a tuple of the cost parameters of the algorithm
+    :return: the derived key as a hex string
+    """
+    if algorithm == "scrypt":
+        n, r, p = params
+        key = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                             maxmem=256 * n * r * p, dklen=HASH_BYTES)
+    else:
+        key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt,
+                                  params[0], dklen=HASH_BYTES)
+    return key.hex()
+
+
+def _pool():
+    """
+    The function `_pool` returns the process pool, creating it on first use. The pool is
+    recreated in a forked child, as the parent's worker processes are not usable there.
+    """
+    global _POOL, _POOL_PID
+    if _POOL is None or _POOL_PID != os.getpid():
+        with _POOL_LOCK:
+            if _POOL is None or _POOL_PID != os.getpid():
+                _POOL = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("forkserver"))
+                _POOL_PID = os.getpid()
+    return _POOL
+
+
+def _discard_pool(pool, ex):
+    """
+    The function `_discard_pool` drops a broken process pool, the next call of _pool creates a
+    new one. A pool already replaced by another thread is left alone.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not pool:
+            return
+        _POOL = None
+    logging.error('Exception at password hasher pool %s', str(ex))
+    pool.shutdown(wait=False)
+
+
+def _done(pool, future):
+    """
+    The function `_done` releases the slot of a completed KDF run, and drops the pool if the run
+    failed because the pool broke.
+    """
+    _SLOTS.release()
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard_pool(pool, future.exception())
+
+
+def _submit(algorithm, password, salt, params, wait):
+    """
+    The function `_submit` submits a KDF run to the process pool once a slot of the pool is free.
+
+    :param wait: The wait is the number of seconds to wait for a free slot, 0 to shed immediately
+    :return: the future of the derived key, its result raises BrokenProcessPool if the pool
+    broke meanwhile.
+    """
+    acquired = _SLOTS.acquire(timeout=wait) if wait else _SLOTS.acquire(blocking=False)
+    if not acquired:
+        raise PasswordHasherBusy("password hashing queue is full")
+    pool = _pool()
+    try:
+        future = pool.submit(_derive, algorithm, password, salt, params)
+    except BrokenProcessPool as ex:
+        _SLOTS.release()
+        _discard_pool(pool, ex)
+        raise PasswordHasherBusy("password hashing pool is broken") from ex
+    except Exception:
+        _SLOTS.release()
+        raise
+    future.add_done_callback(lambda done: _done(pool, done))
+    return future
+
+
+def _run(algorithm, password, salt, params):
+    """
+    The function `_run` derives a key on the process pool, shedding the request if the pool
+    is saturated.
+
+    :return: the derived key as a hex string
+    """
+    future = _submit(algorithm, password, salt, params, 0)
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError as ex:
+        raise PasswordHasherBusy("password hashing timed out") from ex
+    except BrokenProcessPool as ex:
+        raise PasswordHasherBusy("password hashing pool is broken") from ex
+
+
+def _current_params():
+    """
+    The function `_current_params` returns the configured algorithm and cost parameters.
+    """
+    if PASSWORD_HASH_ALGORITHM == "pbkdf2_sha256":
+        return "pbkdf2_sha256", (PBKDF2_ITERATIONS,)
+    return "scrypt", (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+def _encode(algorithm, params, salt, key):
+    """
+    The function `_encode` encodes a derived key with its algorithm, parameters and salt.
+    """
+    return "$".join([algorithm] + [str(param) for param in params] + [salt.hex(), key])
+
+
+def hash_password(password):
+    """
+    The function `hash_password` hashes a password with the configured KDF.
+
+    :param password: The password is the plain text password of the user
+    :return: the encoded hash, carrying the algorithm, the parameters and the salt
+    """
+    algorithm, params = _current_params()
+    salt = os.urandom(SALT_BYTES)
+    started = time.perf_counter()
+    key = _run(algorithm, password, salt, params)
+    metrics.observe(metrics.PASSWORD_HASH_DURATION, (algorithm, "hash"),
+                    time.perf_counter() - started)
+    return _encode(algorithm, params, salt, key)
+
+
+def hash_passwords(passwords):
+    """
+    The function `hash_passwords` hashes several passwords in parallel, it is meant for bulk
+    imports. At most PASSWORD_HASH_WORKERS passwords are in flight at a time, and a free slot is
+    waited for instead of shedding, so a bulk import slows down rather than starving the
+    interactive requests of the pool.
+
+    :param passwords: The passwords is a list of plain text passwords
+    :return: a list of encoded hashes, in the order of the passwords. An entry is None if its
+    password could not be hashed in time.
+    """
+    algorithm, params = _current_params()
+    hashes = []
+    for start in range(0, len(passwords), PASSWORD_HASH_WORKERS):
+        window = []
+        for password in passwords[start:start + PASSWORD_HASH_WORKERS]:
+            salt = os.urandom(SALT_BYTES)
+            try:
+                window.append((salt, _submit(algorithm, password, salt, params,
+                                             PASSWORD_HASH_TIMEOUT)))
+            except PasswordHasherBusy:
+                window.append((salt, None))
+        for salt, future in window:
+            try:
+                key = None if future is None else future.result(timeout=PASSWORD_HASH_TIMEOUT)
+            except (FutureTimeoutError, BrokenProcessPool):
+                key = None
+            hashes.append(None if key is None else _encode(algorithm, params, salt, key))
+    return hashes
+
+
+def needs_rehash(encoded):
+    """
+    The function `needs_rehash` checks if a stored hash was produced with another algorithm
+    or other parameters than the configured ones.
+
+    :param encoded: The encoded is the stored password hash
+    :return: a boolean value. It returns True if the hash should be replaced.
+    """
+    algorithm, params = _current_params()
+    prefix = "$".join([algorithm] + [str(param) for param in params]) + "$"
+    return not encoded.startswith(prefix)
+
+
+def verify_password(password, encoded):
+    """
+    The function `verify_password` checks a plain text password against a stored hash.
+
+    :param password: The password is the plain text password of the user
+    :param encoded: The encoded is the stored password hash, either a KDF hash produced by
+    hash_password or a legacy MD5 hex digest
+    :return: a boolean value. It returns True if the password matches the hash.
+    """
+    fields = encoded.split("$")
+    started = time.perf_counter()
+    try:
+        if fields[0] == "scrypt" and len(fields) == 6:
+            params = (int(fields[1]), int(fields[2]), int(fields[3]))
+            expected = fields[5]
+            key = _run("scrypt", password, bytes.fromhex(fields[4]), params)
+        elif fields[0] == "pbkdf2_sha256" and len(fields) == 4:
+            expected = fields[3]
+            key = _run("pbkdf2_sha256", password, bytes.fromhex(fields[2]), (int(fields[1]),))
+        elif len(fields) == 1:
+            expected = encoded
+            key = hashlib.md5(password.encode('utf-8')).hexdigest()
+        else:
+            logging.error('Unknown password hash format at verify_password')
+            return False
+    except ValueError as ex:
+        logging.error('Exception at verify_password %s', str(ex))
+        return False
+    metrics.observe(metrics.PASSWORD_HASH_DURATION,
+                    (fields[0] if len(fields) > 1 else "md5", "verify"),
+                    time.perf_counter() - started)
+    return hmac.compare_digest(key, expected)
@@ -0,0 +1,262 @@
+"""
+    The module provides a read-through, in-process cache of the list_user responses.
+
+    Entries are evicted in LRU order beyond PROFILE_CACHE_SIZE entries, and expire after
+    PROFILE_CACHE_TTL seconds. A write to a user's profile or login history evicts the user's
+    entries locally, and publishes an invalidation over Redis pub/sub so that every worker
+    evicts them too.
+
+    The same round trip bumps the version of the user's profile, a counter kept in Redis for
+    PROFILE_VERSION_TTL seconds, which is the weak ETag of the /list/user responses. A request
+    whose If-None-Match holds the current version is answered with 304 Not Modified, without
+    reading MongoDB. The version is read before the profile, and a cached entry records the
+    version read before its own MongoDB read: a versioned response is served from the cache only
+    if the entry has the version just read, otherwise from MongoDB. A worker which reads a bumped
+    version before the invalidation message reaches it hence does not label its stale entry with
+    the new version, and a response is never labelled with a version newer than its content. A
+    version whose bump failed ( Redis unreachable ) may validate a stale response until it
+    expires.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+import redis_cache
+import email_filter
+
+PROFILE_CACHE_ENABLED = os.environ.get("PROFILE_CACHE_ENABLED", "true").lower() == "true"
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "30"))
+PROFILE_ETAG_ENABLED = os.environ.get("PROFILE_ETAG_ENABLED", "true").lower() == "true"
+
+
+class ProfileCache:
+    """
+    The class ProfileCache is a bounded LRU / TTL cache keyed by ( email, limit, before ).
+
+    A read records a snapshot of the user's invalidation generation before querying MongoDB,
+    and the result is stored only if no invalidation happened meanwhile, so a slow read can not
+    store a stale profile after a write.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_email = {}
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._subscriber_started = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def reset(self):
+        """
+        The function reset drops the entries and the subscriber state in a forked child, the
+        subscriber thread is restarted on next use.
+        """
+        self._lock = threading.Lock()
+        self._subscriber_started = False
+        self.clear()
+
+    def get(self, key, version=None):
+        """
+        The function get returns the cached response of a key.
+
+        :param key: The key is the ( email, limit, before ) tuple of the request
+        :param version: The version is the profile version the response is labelled with, the
+        entry must have been stored with it, or None if the response is not labelled
+        :return: the cached response, or None on a miss.
+        """
+        self._ensure_subscribed()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                if version is None or entry[2] == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+            elif entry is not None:
+                self._remove(key)
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def snapshot(self, email):
+        """
+        The function snapshot returns the invalidation generation of the user, to be passed to put.
+        """
+        return self._epoch, self._generations.get(email, 0)
+
+    def put(self, key, snapshot, response, version=None):
+        """
+        The function put stores a response, unless the user was invalidated since the snapshot.
+
+        :param key: The key is the ( email, limit, before ) tuple of the request
+        :param snapshot: The snapshot is the value returned by snapshot before the read
+        :param response: The response is the list_user response to cache
+        :param version: The version is the profile version read before the read, or None
+        """
+        email = key[0]
+        with self._lock:
+            if snapshot != (self._epoch, self._generations.get(email, 0)):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, response, version)
+            self._keys_by_email.setdefault(email, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """
+        The function _remove drops an entry, the caller holds the lock.
+        """
+        del self._entries[key]
+        keys = self._keys_by_email.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_email[key[0]]
+
+    def evict(self, email):
+        """
+        The function evict drops the entries of the user and bumps the user's generation.
+
+        :param email: The email parameter is a string that represents the email address of the user
+        """
+        with self._lock:
+            self._generations[email] = self._generations.get(email, 0) + 1
+            if len(self._generations) > self.max_entries:
+                # bound the generations, the epoch rejects every read in flight instead
+                self._generations.clear()
+                self._epoch += 1
+            for key in list(self._keys_by_email.get(email, ())):
+                self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        """
+        The function clear drops every entry, and rejects every read in flight.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_email.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def stats(self):
+        """
+        The function stats returns the size and the counters of the cache.
+        """
+        return {"enabled": PROFILE_CACHE_ENABLED, "entries": len(self._entries),
+                "max_entries": self.max_entries, "ttl": self.ttl, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions,
+                "invalidations": self.invalidations}
+
+    def _ensure_subscribed(self):
+        """
+        The function _ensure_subscribed starts the invalidation subscriber thread on first use.
+        """
+        if not self._subscriber_started:
+            with self._lock:
+                if not self._subscriber_started:
+                    threading.Thread(target=self._subscribe, daemon=True,
+                                     name="profile-cache-invalidation").start()
+                    self._subscriber_started = True
+
+    def _subscribe(self):
+        """
+        The function _subscribe evicts the users named by the invalidation messages, it is the
+        body of the subscriber thread. Messages may have been missed while disconnected, hence
+        the cache is cleared on every ( re ) subscription. The connection of a broken
+        subscription is released to the pool before subscribing again.
+        """
+        while True:
+            pubsub = None
+            try:
+                pubsub = redis_cache.subscribe_profile_invalidations()
+                self.clear()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self.evict(message["data"].decode('utf-8'))
+            except redis_cache.REDIS_ERRORS as ex:
+                logging.error('Exception at profile cache subscriber %s', str(ex))
+                self.clear()
+                time.sleep(1)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+
+CACHE = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+os.register_at_fork(after_in_child=CACHE.reset)
+
+
+def invalidate(email):
+    """
+    The function invalidate evicts the cached profile of the user in this worker, and publishes
+    the invalidation to the other workers.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    """
+    invalidate_many([email])
+
+
+def invalidate_many(emails):
+    """
+    The function invalidate_many evicts the cached profiles of several users in this worker, and
+    publishes the invalidations to the other workers and bumps the profile versions in a single
+    round trip.
+
+    :param emails: The emails parameter is a list of email addresses
+    """
+    if (PROFILE_CACHE_ENABLED or PROFILE_ETAG_ENABLED) and emails:
+        if PROFILE_CACHE_ENABLED:
+            for email in emails:
+                CACHE.evict(email)
+        redis_cache.publish_profile_invalidations(emails, PROFILE_CACHE_ENABLED,
+                                                  PROFILE_ETAG_ENABLED)
+
+
+def should_version(email):
+    """
+    The function should_version tells if the response of the user carries a version. An email
+    the email_filter does not know is answered without one, its response costs no round trip.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    """
+    return PROFILE_ETAG_ENABLED and email_filter.FILTER.might_exist(email, record=False)
+
+
+def etag(version):
+    """
+    The function etag returns the weak ETag of a profile version, weak since the response is
+    the same whatever its content encoding.
+    """
+    return 'W/"%s"' % version
+
+
+def etag_matches(if_none_match, version):
+    """
+    The function etag_matches checks the If-None-Match header of a request against a profile
+    version, by the weak comparison.
+
+    :param if_none_match: The if_none_match is the value of the header, or None
+    :param version: The version is the current version of the profile
+    :return: a boolean value. It returns True if the response is not modified.
+    """
+    if not if_none_match:
+        return False
+    current = '"%s"' % version
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == current:
+            return True
+    return False
@@ -0,0 +1,303 @@
+"""
+    The module provides an on-demand sampling profiler of the requests.
+
+    The profiler is off by default. It is switched on for a number of seconds through the admin
+    endpoint /admin/profile/start, or toggled with the PROFILE_SIGNAL signal. While it is on, a
+    fraction of the requests ( the sample rate ) is registered, and a sampler thread records the
+    stack of every registered request each PROFILE_INTERVAL seconds. The stacks are aggregated
+    per route, and downloaded as collapsed stacks ( the input of flamegraph.pl / speedscope ) or
+    as an SVG flame graph.
+
+    The samples are wall clock: a request waiting on MongoDB or Redis is sampled in the wait.
+    A request of the Flask app is sampled through the stack of its thread, a request of the
+    ASGI app through the await chain of its task. When the profiler is off, a request only reads
+    the enabled flag.
+
+    The signal is sent to the pid of a worker, never to the gunicorn master: the master handles
+    SIGHUP, SIGTTIN, SIGTTOU, SIGUSR1, SIGUSR2 and SIGWINCH itself ( SIGUSR2 re-executes it ),
+    hence the default SIGURG, which the master and the other processes ignore.
+"""
+import os
+import sys
+import time
+import zlib
+import random
+import signal
+import logging
+import tempfile
+import threading
+from html import escape
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.1"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+PROFILE_DURATION = float(os.environ.get("PROFILE_DURATION", "60"))
+# Signal toggling the profiler, empty to disable, not one of the signals of the gunicorn master
+PROFILE_SIGNAL = os.environ.get("PROFILE_SIGNAL", "SIGURG")
+# Directory the profile is written to when the profiler is stopped by the signal
+PROFILE_DIR = os.environ.get("PROFILE_DIR", tempfile.gettempdir())
+
+MAX_STACK_DEPTH = 128
+
+
+def _frame_name(frame):
+    """
+    The function _frame_name names a frame "module:function".
+    """
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return "%s:%s" % (module, getattr(code, "co_qualname", code.co_name))
+
+
+def _thread_stack(frame):
+    """
+    The function _thread_stack returns the frame names of a thread stack, outermost first.
+    """
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+def _task_stack(task):
+    """
+    The function _task_stack returns the frame names of the await chain of an asyncio task,
+    outermost first.
+    """
+    names = []
+    coroutine = task.get_coro()
+    while coroutine is not None and len(names) < MAX_STACK_DEPTH:
+        frame = getattr(coroutine, "cr_frame", None) or getattr(coroutine, "gi_frame", None)
+        if frame is None:
+            break
+        names.append(_frame_name(frame))
+        coroutine = getattr(coroutine, "cr_await", None) or getattr(coroutine, "gi_yieldfrom",
+                                                                    None)
+    return names
+
+
+class SamplingProfiler:
+    """
+    The class SamplingProfiler samples the stacks of the registered requests.
+
+    A request is registered with begin, keyed by its thread id ( Flask ) or its asyncio task
+    ( ASGI ), and unregistered with end.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = PROFILE_SAMPLE_RATE
+        self.interval = PROFILE_INTERVAL
+        self.started_at = None
+        self.deadline = None
+        self.samples = 0
+        self.requests = 0
+        self._active = {}
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def reset(self):
+        """
+        The function reset switches the profiler off in a forked child, the sampler thread of
+        the parent does not exist there.
+        """
+        self.enabled = False
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, sample_rate=None, duration=None):
+        """
+        The function start switches the profiler on, dropping the previous profile.
+
+        :param sample_rate: The sample_rate is the fraction of the requests profiled, or None
+        for PROFILE_SAMPLE_RATE
+        :param duration: The duration is the number of seconds the profiler stays on, or None
+        for PROFILE_DURATION
+        :return: the status of the profiler
+        """
+        with self._lock:
+            self.sample_rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+            self.started_at = time.time()
+            self.deadline = time.monotonic() + (PROFILE_DURATION if duration is None
+                                                else duration)
+            self.samples = 0
+            self.requests = 0
+            self._stacks = {}
+            self.enabled = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler",
+                                                daemon=True)
+                self._thread.start()
+        return self.status()
+
+    def stop(self):
+        """
+        The function stop switches the profiler off, the profile is kept for download.
+
+        :return: the status of the profiler
+        """
+        self.enabled = False
+        self._active.clear()
+        return self.status()
+
+    def should_sample(self):
+        """
+        The function should_sample decides if a request is profiled.
+        """
+        return self.enabled and random.random() < self.sample_rate
+
+    def begin(self, key, route):
+        """
+        The function begin registers a request.
+
+        :param key: The key is the thread id or the asyncio task of the request
+        :param route: The route is the route of the request, or a function returning it
+        """
+        self._active[key] = route
+        self.requests += 1
+
+    def end(self, key):
+        """
+        The function end unregisters a request.
+        """
+        self._active.pop(key, None)
+
+    def _run(self):
+        """
+        The function _run is the sampler thread, it samples until the profiler is switched off
+        or its deadline passes.
+        """
+        while self.enabled:
+            if time.monotonic() >= self.deadline:
+                self.stop()
+                break
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self):
+        """
+        The function _sample records the stacks of the registered requests.
+        """
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for key, route in list(self._active.items()):
+            if isinstance(key, int):
+                stack = _thread_stack(frames.get(key))
+            else:
+                stack = _task_stack(key)
+            if not stack:
+                continue
+            collapsed = ";".join([route() if callable(route) else route] + stack)
+            self._stacks[collapsed] = self._stacks.get(collapsed, 0) + 1
+            self.samples += 1
+
+    def status(self):
+        """
+        The function status reports the state of the profiler.
+        """
+        return {"enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval": self.interval,
+                "started_at": self.started_at,
+                "remaining_seconds": (max(0.0, round(self.deadline - time.monotonic(), 3))
+                                      if self.enabled else 0.0),
+                "requests_profiled": self.requests,
+                "samples": self.samples,
+                "stacks": len(self._stacks)}
+
+    def collapsed(self):
+        """
+        The function collapsed renders the profile as collapsed stacks, one
+        "route;frame;frame count" line per stack.
+        """
+        return "".join("%s %d\n" % (stack, count)
+                       for stack, count in sorted(dict(self._stacks).items()))
+
+    def svg(self, width=1200, frame_height=16):
+        """
+        The function svg renders the profile as an SVG flame graph, the routes at the bottom.
+        """
+        root = [0, {}]
+        for stack, count in dict(self._stacks).items():
+            node = root
+            node[0] += count
+            for name in stack.split(";"):
+                node = node[1].setdefault(name, [0, {}])
+                node[0] += count
+
+        def depth(node):
+            return 1 + max([depth(child) for child in node[1].values()] or [0])
+
+        height = (depth(root) + 1) * frame_height
+        scale = float(width) / max(root[0], 1)
+        rectangles = []
+
+        def draw(name, node, x, level):
+            node_width = node[0] * scale
+            if node_width < 0.5:
+                return
+            y = height - (level + 1) * frame_height
+            seed = zlib.crc32(name.encode('utf-8'))
+            color = "rgb(%d,%d,%d)" % (205 + seed % 50, 80 + seed % 130, 40 + seed % 50)
+            label = name if node_width > 7 * len(name) else name[:int(node_width / 7)]
+            rectangles.append(
+                '<g><title>%s (%d samples, %.2f%%)</title>'
+                '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s"/>'
+                '<text x="%.1f" y="%d">%s</text></g>' % (
+                    escape(name), node[0], 100.0 * node[0] / max(root[0], 1), x, y,
+                    node_width, frame_height - 1, color, x + 2, y + frame_height - 4,
+                    escape(label)))
+            child_x = x
+            for child_name, child in sorted(node[1].items()):
+                draw(child_name, child, child_x, level + 1)
+                child_x += child[0] * scale
+
+        draw("all", root, 0.0, 0)
+        return ('<?xml version="1.0" standalone="no"?>\n'
+                '<svg version="1.1" width="%d" height="%d" xmlns="http://www.w3.org/2000/svg" '
+                'font-family="Verdana" font-size="11">\n%s\n</svg>\n'
+                % (width, height, "\n".join(rectangles)))
+
+
+PROFILER = SamplingProfiler()
+
+# Download formats of the profile, format: ( media type, render function )
+FORMATS = {"collapsed": ("text/plain", PROFILER.collapsed), "svg": ("image/svg+xml", PROFILER.svg)}
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=PROFILER.reset)
+
+
+def toggle(signum, frame):  # pylint: disable=unused-argument
+    """
+    The function toggle is the signal handler, it switches the profiler on with the default
+    sample rate and duration, or switches it off and writes the profile to PROFILE_DIR.
+    """
+    if not PROFILER.enabled:
+        PROFILER.start()
+        logging.warning('Profiler started by signal, pid %d', os.getpid())
+        return
+    PROFILER.stop()
+    path = os.path.join(PROFILE_DIR, "profile-%d-%d.collapsed" % (os.getpid(), time.time()))
+    try:
+        with open(path, "w", encoding='utf-8') as output:
+            output.write(PROFILER.collapsed())
+        logging.warning('Profiler stopped by signal, profile written to %s', path)
+    except OSError as ex:
+        logging.error('Exception at toggle %s', str(ex))
+
+
+def install_signal_handler():
+    """
+    The function install_signal_handler installs the PROFILE_SIGNAL handler. A handler can only
+    be installed from the main thread, elsewhere the signal is not handled.
+
+    :return: a boolean value. It returns True if the handler was installed.
+    """
+    signum = getattr(signal, PROFILE_SIGNAL, None) if PROFILE_SIGNAL else None
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signum, toggle)
+    return True
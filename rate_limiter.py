@@ -0,0 +1,260 @@
+"""
+    The module provides the rate limits of the routes, ex. the login attempts per email and per
+    client IP, which shed a credential stuffing burst before any password hash or MongoDB call.
+
+    An attempt is counted in Redis by sliding window counters, one per subject ( ex. the email
+    and the IP of a login ), checked and incremented atomically in a single Lua round trip, see
+    redis_cache.RATE_LIMIT_LUA. Each worker also keeps a local pre-filter, which rejects without
+    a Redis call:
+        a subject Redis rejected, until its window rolls over
+        a subject whose attempts allowed by this worker alone already reach the limit, the count
+        in Redis is at least as high
+
+    The limits are configured per route ( the name of the route function ) and subject in
+    RATE_LIMITS, ex. "login_user.email=10/60,login_user.ip=100/60" allows 10 logins per email
+    and 100 per IP in any 60 seconds. If Redis can not be reached the attempts are allowed.
+
+    The client IP is the address of the peer. Behind TRUSTED_PROXY_HOPS reverse proxies it is
+    read from the X-Forwarded-For header, the address appended by the outermost trusted proxy,
+    as werkzeug.middleware.proxy_fix.ProxyFix does for the Flask app.
+"""
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+import redis_cache
+import metrics
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Number of subjects tracked by the local pre-filter of a worker
+RATE_LIMIT_LOCAL_SIZE = int(os.environ.get("RATE_LIMIT_LOCAL_SIZE", "10000"))
+# Number of reverse proxies in front of the app, each appending to X-Forwarded-For
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+
+KEY_PREFIX = "ratelimit:"
+
+LOCAL = "local"
+REDIS = "redis"
+
+
+def parse_limits(value):
+    """
+    The function parse_limits parses the RATE_LIMITS configuration.
+
+    :param value: The value is a comma separated list of <route>.<subject>=<limit>/<seconds>
+    :return: a dictionary of the limits by route, each a dictionary of ( limit, window ) by
+    subject.
+    """
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            name, rate = item.split("=")
+            route, subject = name.strip().split(".")
+            limit, window = rate.split("/")
+            limits.setdefault(route, {})[subject] = (int(limit), int(window))
+    return limits
+
+
+ROUTE_LIMITS = parse_limits(os.environ.get(
+    "RATE_LIMITS", "login_user.email=10/60,login_user.ip=100/60"))
+
+
+def client_ip(peer, forwarded_for):
+    """
+    The function client_ip returns the IP address of the client of a request.
+
+    :param peer: The peer is the address of the peer of the connection, or None
+    :param forwarded_for: The forwarded_for is the value of the X-Forwarded-For header, or None
+    :return: the address appended by the outermost of the TRUSTED_PROXY_HOPS proxies, or the
+    peer if there is no such address.
+    """
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        addresses = forwarded_for.split(",")
+        if len(addresses) >= TRUSTED_PROXY_HOPS:
+            return addresses[-TRUSTED_PROXY_HOPS].strip()
+    return peer
+
+
+def _estimate(state, now, window):
+    """
+    The function _estimate returns the sliding window estimate of the attempts of a local
+    counter, the attempts of the current window plus the overlapping part of the previous one.
+    """
+    current = math.floor(now / window)
+    if state[1] == current:
+        count, previous = state[2], state[3]
+    elif state[1] == current - 1:
+        count, previous = 0, state[2]
+    else:
+        count, previous = 0, 0
+    return previous * (1 - (now / window - current)) + count
+
+
+class RateLimiter:
+    """
+    The class RateLimiter holds the local pre-filter and the counters of the worker.
+
+    :param limits: The limits is the dictionary of the limits by route, see parse_limits
+    :param size: The size is the number of subjects tracked by the local pre-filter
+    """
+
+    def __init__(self, limits, size):
+        self.limits = limits
+        self.size = size
+        # subject key: [ blocked until, window, attempts of the window, of the previous window ]
+        self._subjects = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """
+        The function reset drops the state inherited by a forked child.
+        """
+        self._subjects = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _attempt(self, route, subjects):
+        """
+        The function _attempt lists the limited subjects of an attempt.
+
+        :return: a list of ( subject, key, ( limit, window ) ) tuples, empty if the route is not
+        limited.
+        """
+        if not RATE_LIMIT_ENABLED:
+            return []
+        limits = self.limits.get(route)
+        if not limits:
+            return []
+        return [(subject, KEY_PREFIX + route + ":" + subject + ":" + value, limit)
+                for subject, limit in limits.items()
+                for value in (subjects.get(subject),) if value]
+
+    def _count(self, route, subject, source):
+        key = (route, subject, source)
+        self._counters[key] = self._counters.get(key, 0) + 1
+
+    def _state(self, key):
+        state = self._subjects.get(key)
+        if state is None:
+            state = self._subjects[key] = [0.0, 0, 0, 0]
+            if len(self._subjects) > self.size:
+                self._subjects.popitem(last=False)
+        else:
+            self._subjects.move_to_end(key)
+        return state
+
+    def _local_check(self, route, attempt, now):
+        """
+        The function _local_check runs the local pre-filter.
+
+        :return: the seconds to wait if the attempt is rejected, otherwise 0.
+        """
+        with self._lock:
+            for subject, key, (limit, window) in attempt:
+                state = self._subjects.get(key)
+                if state is None:
+                    continue
+                if state[0] > now:
+                    self._count(route, subject, LOCAL)
+                    return math.ceil(state[0] - now)
+                if _estimate(state, now, window) + 1 > limit:
+                    self._count(route, subject, LOCAL)
+                    return math.ceil(window - (now % window))
+        return 0
+
+    def _record(self, route, attempt, result, now):
+        """
+        The function _record applies the answer of Redis to the local pre-filter.
+
+        :return: the seconds to wait if the attempt is rejected, otherwise 0.
+        """
+        if result is None:
+            return 0
+        index, retry_after = result
+        with self._lock:
+            if index:
+                subject, key, _ = attempt[index - 1]
+                self._state(key)[0] = now + retry_after
+                self._count(route, subject, REDIS)
+                return max(1, retry_after)
+            for subject, key, (_, window) in attempt:
+                state = self._state(key)
+                current = math.floor(now / window)
+                if state[1] != current:
+                    state[3] = state[2] if state[1] == current - 1 else 0
+                    state[1], state[2] = current, 0
+                state[2] += 1
+        return 0
+
+    def check(self, route, **subjects):
+        """
+        The function check counts an attempt on a route.
+
+        :param route: The route is the name of the route function, ex. login_user
+        :param subjects: The subjects are the values the attempt is limited by, ex. email and
+        ip, a missing or empty value is not limited
+        :return: the seconds to wait if the attempt is over a limit, otherwise 0.
+        """
+        attempt = self._attempt(route, subjects)
+        if not attempt:
+            return 0
+        now = time.time()
+        retry_after = self._local_check(route, attempt, now)
+        if retry_after:
+            return retry_after
+        result = redis_cache.hit_rate_limits([key for _, key, _ in attempt],
+                                             [limit for _, _, limit in attempt], now)
+        return self._record(route, attempt, result, now)
+
+    async def check_async(self, route, hit_rate_limits, **subjects):
+        """
+        The function check_async is the asyncio counterpart of check.
+
+        :param hit_rate_limits: The hit_rate_limits is the coroutine function counting the
+        attempt in Redis, ex. async_redis_cache.hit_rate_limits
+        :return: the seconds to wait if the attempt is over a limit, otherwise 0.
+        """
+        attempt = self._attempt(route, subjects)
+        if not attempt:
+            return 0
+        now = time.time()
+        retry_after = self._local_check(route, attempt, now)
+        if retry_after:
+            return retry_after
+        result = await hit_rate_limits([key for _, key, _ in attempt],
+                                       [limit for _, _, limit in attempt], now)
+        return self._record(route, attempt, result, now)
+
+    def stats_counters(self):
+        """
+        The function stats_counters returns the rejected attempts of this worker, by ( route,
+        subject, source ).
+        """
+        with self._lock:
+            return dict(self._counters)
+
+    def stats(self):
+        """
+        The function stats reports the limits and the rejected attempts of this worker.
+        """
+        counters = self.stats_counters()
+        return {"enabled": RATE_LIMIT_ENABLED,
+                "limits": {route: {subject: {"limit": limit, "window": window}
+                                   for subject, (limit, window) in limits.items()}
+                           for route, limits in self.limits.items()},
+                "rejected": [{"route": route, "subject": subject, "source": source,
+                              "count": count}
+                             for (route, subject, source), count in sorted(counters.items())],
+                "tracked_subjects": len(self._subjects)}
+
+
+LIMITER = RateLimiter(ROUTE_LIMITS, RATE_LIMIT_LOCAL_SIZE)
+os.register_at_fork(after_in_child=LIMITER.reset)
+
+metrics.register_gauge("rate_limit_rejected_total", "Attempts rejected by the rate limits, by "
+                       "route, subject and source ( local pre-filter or redis )",
+                       ("route", "subject", "source"),
+                       lambda series: sorted(LIMITER.stats_counters().items()),
+                       metric_type="counter")
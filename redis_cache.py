@@ -1,59 +1,729 @@
 """
     The module provides functions for persisting, removing of Client Token
+
+    The tokens of a user are kept in the hash "session:<email>", mapping each token to its expiry
+    time, hence a user can hold several sessions ( devices ). Sessions expire after SESSION_TTL
+    seconds, and with SESSION_SLIDING_EXPIRY every successful check renews them. Each endpoint's
+    work is a single round trip, the multi step operations run as Lua scripts.
+
+    The keys are spread over the Redis nodes of REDIS_NODES by consistent hashing, see
+    hash_ring, each node with its own connection pool. The keys and the pub/sub channels shared
+    by every user ( ex. the revocation set ) are on the first, primary, node. The operations
+    over several nodes ( the statistics, a ping, the rate limits of an attempt ) query the nodes
+    concurrently, the first node on the calling thread and the others on fan-out threads, up to
+    one per request thread and other node, so a request never queues behind the fan-outs of the
+    other requests.
 """
 import os
+import time
+import functools
+import threading
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 import redis
+import hash_ring
+import metrics
+import circuit_breaker
+
+# Connection pool sizing, a request waits up to REDIS_POOL_TIMEOUT seconds for a free connection
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", "1"))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", "2"))
+# Request threads of a worker which may fan out at once, the threads of gunicorn.conf.py
+REDIS_FAN_OUT_REQUEST_THREADS = int(os.environ.get("WORKER_THREADS", "8"))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", "86400"))
+SESSION_SLIDING_EXPIRY = os.environ.get("SESSION_SLIDING_EXPIRY", "false").lower() == "true"
+# Seconds a profile version is kept, a version missed by a failed bump is replaced after it
+PROFILE_VERSION_TTL = int(os.environ.get("PROFILE_VERSION_TTL", "3600"))
+
+# Errors which mean Redis could not serve the request
+REDIS_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+SESSION_KEY_PREFIX = "session:"
+
+# Stores a token and drops the expired sessions of the user
+# KEYS[1] session key, ARGV now, ttl, token
+PERSIST_LUA = """
+local now = tonumber(ARGV[1])
+local sessions = redis.call('HGETALL', KEYS[1])
+for i = 1, #sessions, 2 do
+    if tonumber(sessions[i + 1]) <= now then
+        redis.call('HDEL', KEYS[1], sessions[i])
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[3], now + tonumber(ARGV[2]))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Counts the live sessions ( or checks a single token ), renewing them on sliding expiry
+# KEYS[1] session key, ARGV now, ttl, sliding ( 1 / 0 ), token ( empty for any token )
+CHECK_LUA = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local sliding = ARGV[3] == '1'
+local alive = 0
+if ARGV[4] ~= '' then
+    local expiry = redis.call('HGET', KEYS[1], ARGV[4])
+    if expiry and tonumber(expiry) > now then
+        alive = 1
+        if sliding then
+            redis.call('HSET', KEYS[1], ARGV[4], now + ttl)
+        end
+    end
+else
+    local sessions = redis.call('HGETALL', KEYS[1])
+    for i = 1, #sessions, 2 do
+        if tonumber(sessions[i + 1]) > now then
+            alive = alive + 1
+            if sliding then
+                redis.call('HSET', KEYS[1], sessions[i], now + ttl)
+            end
+        end
+    end
+end
+if sliding and alive > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return alive
+"""
+
+# Removes a single token ( or every token ) and returns the number of live sessions removed
+# KEYS[1] session key, ARGV now, token ( empty for every token )
+REMOVE_LUA = """
+local now = tonumber(ARGV[1])
+local alive = 0
+if ARGV[2] ~= '' then
+    local expiry = redis.call('HGET', KEYS[1], ARGV[2])
+    if expiry and tonumber(expiry) > now then
+        alive = 1
+    end
+    redis.call('HDEL', KEYS[1], ARGV[2])
+else
+    local sessions = redis.call('HGETALL', KEYS[1])
+    for i = 2, #sessions, 2 do
+        if tonumber(sessions[i]) > now then
+            alive = alive + 1
+        end
+    end
+    redis.call('DEL', KEYS[1])
+end
+return alive
+"""
+
+
+# Sliding window counters of the rate limits, each counter is a hash of the current window
+# ( w ), the attempts of the current window ( c ) and of the previous window ( p ). The attempt
+# is counted on every counter only if no counter is over its limit.
+# KEYS the counters, ARGV now, then the limit and the window ( seconds ) of each counter
+# Returns { 0, 0 }, or the index ( 1-based ) of the counter over its limit and the seconds
+# until its window rolls over
+RATE_LIMIT_LUA = """
+local now = tonumber(ARGV[1])
+local states = {}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[2 * i])
+    local window = tonumber(ARGV[2 * i + 1])
+    local current = math.floor(now / window)
+    local state = redis.call('HMGET', key, 'w', 'c', 'p')
+    local count = tonumber(state[2]) or 0
+    local previous = tonumber(state[3]) or 0
+    if tonumber(state[1]) ~= current then
+        if tonumber(state[1]) == current - 1 then
+            previous = count
+        else
+            previous = 0
+        end
+        count = 0
+    end
+    local elapsed = now / window - current
+    if previous * (1 - elapsed) + count + 1 > limit then
+        return {i, math.ceil((1 - elapsed) * window)}
+    end
+    states[i] = {current, count + 1, previous, window}
+end
+for i, key in ipairs(KEYS) do
+    local state = states[i]
+    redis.call('HSET', key, 'w', state[1], 'c', state[2], 'p', state[3])
+    redis.call('EXPIRE', key, 2 * state[4])
+end
+return {0, 0}
+"""
+
+PROFILE_VERSION_KEY_PREFIX = "profile:version:"
+
+# Returns the version of a profile, created with the current time ( milliseconds ) if missing,
+# so that a version never repeats one which expired
+# KEYS[1] version key, ARGV now, ttl
+PROFILE_VERSION_LUA = """
+local version = redis.call('GET', KEYS[1])
+if not version then
+    version = ARGV[1]
+    redis.call('SET', KEYS[1], version, 'EX', ARGV[2])
+end
+return version
+"""
+
+# Bumps the versions of profiles, the new version is above the current one and the current time
+# KEYS the version keys, ARGV now ( milliseconds ), ttl
+BUMP_PROFILE_VERSIONS_LUA = """
+local now = tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    local version = math.max((tonumber(redis.call('GET', key)) or 0) + 1, now)
+    redis.call('SET', key, string.format('%d', version), 'EX', ARGV[2])
+end
+return #KEYS
+"""
+
+PROFILE_SCRIPTS = (PROFILE_VERSION_LUA, BUMP_PROFILE_VERSIONS_LUA)
+
+# Appends a revocation to the revocation log, scored by the next value of the sequence, and
+# drops the oldest entries revoked before the retention period. The member is
+# "<revoked_at>|<entry>". Returns the sequence of the revocation
+# KEYS[1] revocation log, KEYS[2] sequence, ARGV entry, now, retention
+ADD_REVOCATION_LUA = """
+local sequence = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[1], sequence, ARGV[2] .. '|' .. ARGV[1])
+local horizon = tonumber(ARGV[2]) - tonumber(ARGV[3])
+while true do
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #oldest == 0 or tonumber(string.match(oldest[1], '^([^|]*)|')) >= horizon then
+        break
+    end
+    redis.call('ZREM', KEYS[1], oldest[1])
+end
+return sequence
+"""
+
+SCRIPTS = ((PERSIST_LUA, CHECK_LUA, REMOVE_LUA, RATE_LIMIT_LUA, ADD_REVOCATION_LUA)
+           + PROFILE_SCRIPTS)
+
+# Ring, nodes and fan-out threads of this process, created on first use by _connection
+_CONNECTION = None
+_CONNECTION_LOCK = threading.Lock()
+
+
+def redis_nodes():
+    """
+    The function redis_nodes returns the Redis nodes from the REDIS_NODES environment variable,
+    or the single node of REDIS_HOST and REDIS_PORT, read when the pools are created. The first
+    node is the primary node, which holds the keys and channels shared by every user.
+
+    :return: the list of ( host, port ) tuples of the nodes.
+    """
+    if os.environ.get("REDIS_NODES"):
+        return hash_ring.parse_nodes(os.environ["REDIS_NODES"])
+    return [(os.environ["REDIS_HOST"], int(os.environ["REDIS_PORT"]))]
+
+
+def connection_options(node):
+    """
+    The function connection_options builds the keyword arguments of the connection pool ( sync
+    or asyncio ) of a Redis node, with the REDIS_* pool and timeout settings.
 
-REDIS_HOST = os.environ["REDIS_HOST"]
-REDIS_PORT = int(os.environ["REDIS_PORT"])
-REDIS = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+    :param node: The node is the ( host, port ) tuple of the node
+    """
+    return {"host": node[0], "port": node[1],
+            "max_connections": REDIS_MAX_CONNECTIONS, "timeout": REDIS_POOL_TIMEOUT,
+            "socket_timeout": REDIS_SOCKET_TIMEOUT,
+            "socket_connect_timeout": REDIS_SOCKET_TIMEOUT}
+
+
+def _connection():
+    """
+    The function _connection returns the hash ring, the nodes and the fan-out threads of this
+    process, creating them on first use. Nothing connects at import, hence a worker forked from
+    a pre-loaded parent creates its own pools.
+
+    :return: a tuple of the hash ring, the list of the nodes, each a tuple of its connection
+    pool, its client, called through the Redis circuit breaker, and the dictionary of its
+    registered scripts by Lua source, and the thread pool of the fan-out operations, None with a
+    single node.
+    """
+    global _CONNECTION
+    connection = _CONNECTION
+    if connection is None:
+        with _CONNECTION_LOCK:
+            if _CONNECTION is None:
+                nodes = []
+                for node in redis_nodes():
+                    pool = redis.BlockingConnectionPool(**connection_options(node))
+                    client_ = metrics.instrument_redis(circuit_breaker.guard_redis(
+                        redis.Redis(connection_pool=pool), circuit_breaker.REDIS))
+                    nodes.append((pool, client_, {source: client_.register_script(source)
+                                                  for source in SCRIPTS}))
+                ring = hash_ring.HashRing(redis_nodes(), hash_ring.REDIS_VIRTUAL_NODES)
+                executor = None
+                if len(nodes) > 1:
+                    # every request thread may fan out at once, the threads start on demand
+                    executor = ThreadPoolExecutor(
+                        max_workers=(len(nodes) - 1) * REDIS_FAN_OUT_REQUEST_THREADS,
+                        thread_name_prefix="redis-fan-out")
+                _CONNECTION = (ring, nodes, executor)
+            connection = _CONNECTION
+    return connection
+
+
+def _node(key=None):
+    """
+    The function _node returns the node of a key, or the primary node.
+    """
+    ring, nodes, _ = _connection()
+    return nodes[0 if key is None else ring.index(key)]
+
+
+def client(key=None):
+    """
+    The function client returns the Redis client of the node of a key, or of the primary node.
+
+    :param key: The key is a Redis key, or None for the keys and channels shared by every user
+    """
+    return _node(key)[1]
+
+
+def _script(source, key=None):
+    """
+    The function _script returns the registered script of a Lua source on the node of a key.
+    """
+    return _node(key)[2][source]
+
+
+def _fan_out(calls):
+    """
+    The function _fan_out runs calls to several nodes concurrently, the first one on the calling
+    thread and the others on the fan-out threads.
+
+    :param calls: The calls is a list of functions without arguments
+    :return: the list of their results, in the order of the calls. The first exception of a call
+    is raised.
+    """
+    executor = _connection()[2]
+    if executor is None or len(calls) < 2:
+        return [call() for call in calls]
+    others = []
+    for call in calls[1:]:
+        try:
+            others.append(executor.submit(call))
+        except RuntimeError:
+            # the interpreter is exiting, ex. the login history is flushed at exit
+            others.append(call)
+    first = calls[0]()
+    return [first] + [other.result() if isinstance(other, Future) else other()
+                      for other in others]
+
+
+def close():
+    """
+    The function close disconnects the connection pools of this process, the next call creates
+    new ones.
+    """
+    global _CONNECTION
+    with _CONNECTION_LOCK:
+        connection, _CONNECTION = _CONNECTION, None
+    if connection is not None:
+        for pool, _, _ in connection[1]:
+            pool.disconnect()
+        if connection[2] is not None:
+            connection[2].shutdown(wait=False)
+
+
+def _reset_after_fork():
+    """
+    The function _reset_after_fork drops, in a forked child, the pools inherited from the parent.
+    """
+    global _CONNECTION, _CONNECTION_LOCK
+    _CONNECTION = None
+    _CONNECTION_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def ping():
+    """
+    The function ping checks, through the Redis circuit breaker, that every Redis node answers.
+
+    :return: a boolean value. It returns True if every node answered the PING command.
+    """
+    try:
+        return all(_fan_out([node[1].ping for node in _connection()[1]]))
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at ping %s', str(ex))
+        return False
 
 
 def persist_client_token(email, token):
     """
-    The function persist_client_token stores a client token in Redis using the client's email as the
-    key.
+    The function persist_client_token stores a client token in Redis as a new session of the
+    client, expiring after SESSION_TTL seconds.
 
     :param email: The email parameter is a string that represents the email address of the client
     :param token: The token is a unique identifier or authentication token that is associated with a
     specific client or user. It is used to verify the identity of the client when making requests or
     accessing certain resources
+    :return: a boolean value. It returns True if the token was stored.
     """
+    key = SESSION_KEY_PREFIX + email
     try:
-        REDIS.set(email, token)
-    except redis.exceptions.ConnectionError as ex:
+        _script(PERSIST_LUA, key)(keys=[key], args=[time.time(), SESSION_TTL, token])
+        return True
+    except REDIS_ERRORS as ex:
         logging.error('Exception at persist_client_token %s', str(ex))
+        return False
 
 
-def is_remove_client_token(email):
+def remove_client_tokens(email, token=None):
     """
-    The function `is_remove_client_token` checks if a client token is removed from a Redis database
-    based on the provided email.
+    The function `remove_client_tokens` removes a session of the client, or every session of the
+    client if no token is given, in a single round trip.
 
     :param email: The email parameter is a string that represents the email address of a client
-    :return: a boolean value. It returns True if the status of the REDIS delete operation is 1,
-    indicating that the client token was successfully removed. It returns False otherwise.
+    :param token: The token parameter is the token of the session to remove, or None
+    :return: the number of live sessions removed, 0 if the client was not logged in, or None if
+    Redis could not be reached.
     """
+    key = SESSION_KEY_PREFIX + email
     try:
-        status = REDIS.delete(email)
-        return status == 1
-    except redis.exceptions.ConnectionError as ex:
-        logging.error('Exception at is_remove_client_token %s', str(ex))
-        return 0
+        return _script(REMOVE_LUA, key)(keys=[key], args=[time.time(), token or ""])
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at remove_client_tokens %s', str(ex))
+        return None
 
 
-def is_client_token_persists(email):
+def is_client_token_persists(email, token=None):
     """
-    The function checks if a client token persists in Redis for a given email.
+    The function checks if a client token persists in Redis for a given email. With sliding
+    expiry, the live sessions checked are renewed.
 
     :param email: The email parameter is a string that represents the email address of a client
-    :return: a boolean value. It returns True if the token associated with the given email exists in the
-    REDIS database, and False otherwise.
+    :param token: The token parameter is the token of the session to check, or None to check for
+    any session of the client
+    :return: a boolean value. It returns True if a live token associated with the given email
+    exists in the REDIS database, and False otherwise.
     """
+    key = SESSION_KEY_PREFIX + email
     try:
-        token = REDIS.get(email)
-        return token is not None
-    except redis.exceptions.ConnectionError as ex:
+        alive = _script(CHECK_LUA, key)(keys=[key],
+                                        args=[time.time(), SESSION_TTL,
+                                              1 if SESSION_SLIDING_EXPIRY else 0, token or ""])
+        return alive > 0
+    except REDIS_ERRORS as ex:
         logging.error('Exception at is_client_token_persists %s', str(ex))
         return False
+
+
+def check_client_tokens(sessions):
+    """
+    The function check_client_tokens checks the sessions of several clients, as
+    is_client_token_persists does for one, with a single pipelined round trip per node. The
+    sessions are not renewed, even with sliding expiry, a batch check is not an activity of the
+    clients.
+
+    :param sessions: The sessions is a list of ( email, token ) tuples, token being None to check
+    for any session of the client
+    :return: the list of the boolean values of the sessions, in the order of sessions, or None
+    if Redis could not be reached.
+    """
+    keys = [SESSION_KEY_PREFIX + email for email, _ in sessions]
+    now = time.time()
+
+    def execute(index, positions):
+        node = _connection()[1][index]
+        pipeline = node[1].pipeline(transaction=False)
+        for position in positions:
+            node[2][CHECK_LUA](keys=[keys[position]],
+                               args=[now, SESSION_TTL, 0, sessions[position][1] or ""],
+                               client=pipeline)
+        return positions, pipeline.execute()
+
+    try:
+        alive = [False] * len(sessions)
+        for positions, results in _fan_out([functools.partial(execute, index, positions)
+                                            for index, positions
+                                            in _connection()[0].group(keys).items()]):
+            for position, result in zip(positions, results):
+                alive[position] = result > 0
+        return alive
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at check_client_tokens %s', str(ex))
+        return None
+
+
+def hit_rate_limits(keys, limits, now):
+    """
+    The function hit_rate_limits counts an attempt against the rate limit counters of its
+    subjects ( ex. the email and the client IP of a login ), in a single round trip.
+
+    :param keys: The keys is the list of the counter keys
+    :param limits: The limits is the list of ( limit, window in seconds ) of each counter
+    :param now: The now is the epoch time of the attempt
+    :return: a ( index, retry after ) tuple, index is 0 if the attempt is allowed, otherwise the
+    1-based index of the counter over its limit, and retry after the seconds to wait. None if
+    Redis could not be reached. With several nodes, the counters of each node are checked and
+    incremented by their own script, concurrently, an attempt rejected on a node may still be
+    counted on another one.
+    """
+    def hit(index, positions):
+        args = [now]
+        for position in positions:
+            args.extend(limits[position])
+        rejected, retry_after = _connection()[1][index][2][RATE_LIMIT_LUA](
+            keys=[keys[position] for position in positions], args=args)
+        return (positions[int(rejected) - 1] + 1 if rejected else 0), int(retry_after)
+
+    try:
+        results = _fan_out([functools.partial(hit, index, positions)
+                            for index, positions in _connection()[0].group(keys).items()])
+        return min((result for result in results if result[0]), default=(0, 0))
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at hit_rate_limits %s', str(ex))
+        return None
+
+
+def pool_in_use_connections():
+    """
+    The function pool_in_use_connections returns the number of connections of the pools which
+    are checked out by a request, 0 before the pools are created.
+    """
+    connection = _CONNECTION
+    if connection is None:
+        return 0
+    in_use = 0
+    for pool, _, _ in connection[1]:
+        # pylint: disable=protected-access
+        idle = sum(1 for pooled in list(pool.pool.queue) if pooled is not None)
+        in_use += len(pool._connections) - idle
+    return in_use
+
+
+metrics.register_gauge("redis_pool_connections_in_use", "Connections checked out of the Redis pool",
+                       (), lambda series: [((), pool_in_use_connections())])
+metrics.register_gauge("redis_pool_max_connections", "Maximum size of the Redis pools",
+                       (), lambda series: [((), REDIS_MAX_CONNECTIONS * len(redis_nodes()))])
+
+
+def _node_stats(node):
+    """
+    The function _node_stats fetches the key count and memory usage of a node in a single round
+    trip.
+    """
+    pipeline = node[1].pipeline(transaction=False)
+    pipeline.dbsize()
+    pipeline.info("memory")
+    pipeline.info("stats")
+    keys, memory, stats = pipeline.execute()
+    return {"keys": keys,
+            "used_memory": memory.get("used_memory"),
+            "used_memory_peak": memory.get("used_memory_peak"),
+            "maxmemory": memory.get("maxmemory"),
+            "expired_keys": stats.get("expired_keys"),
+            "evicted_keys": stats.get("evicted_keys")}
+
+
+def session_stats():
+    """
+    The function session_stats reports the key count and memory usage of Redis, summed over
+    the nodes and per node, and the usage of the connection pools. The nodes are queried
+    concurrently, a single round trip each.
+
+    :return: a dictionary of statistics, or None if Redis could not be reached.
+    """
+    try:
+        nodes = _fan_out([functools.partial(_node_stats, node) for node in _connection()[1]])
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at session_stats %s', str(ex))
+        return None
+    stats = {name: sum(node[name] or 0 for node in nodes) for name in nodes[0]}
+    stats.update({"nodes": [dict(node, node="%s:%d" % address)
+                            for node, address in zip(nodes, redis_nodes())],
+                  "pool_max_connections": REDIS_MAX_CONNECTIONS,
+                  "pool_in_use_connections": pool_in_use_connections(),
+                  "session_ttl": SESSION_TTL,
+                  "session_sliding_expiry": SESSION_SLIDING_EXPIRY})
+    return stats
+
+
+# Log of the revoked sessions, a sorted set scored by a sequence incremented by Redis, hence
+# the order of the scores is the order in which the entries were added, whatever the clocks of
+# the workers
+REVOCATION_KEY = "session:revocation-log"
+REVOCATION_SEQUENCE_KEY = "session:revocation-sequence"
+
+
+def add_token_revocation(member, revoked_at, retention):
+    """
+    The function add_token_revocation appends a revoked session ( or a "logout everywhere"
+    cutoff ) to the revocation log, and drops the entries older than the retention period, in
+    a single script.
+
+    :param member: The member is the revocation entry, "sid:<session id>" or
+    "user:<email>:<cutoff>"
+    :param revoked_at: The revoked_at is the epoch time of the revocation
+    :param retention: The retention is the number of seconds an entry is kept, tokens older than
+    that have expired anyway
+    :return: a boolean value. It returns True if the revocation was recorded.
+    """
+    try:
+        _script(ADD_REVOCATION_LUA)(keys=[REVOCATION_KEY, REVOCATION_SEQUENCE_KEY],
+                                    args=[member, revoked_at, retention])
+        return True
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at add_token_revocation %s', str(ex))
+        return False
+
+
+def fetch_token_revocations(since):
+    """
+    The function fetch_token_revocations returns the revocation entries appended after the
+    given sequence, it is used to refresh the local mirror of the revocation log incrementally.
+
+    :param since: The since is the sequence of the last entry read, or None to fetch the whole log
+    :return: a ( entries, sequence ) tuple, entries is the list of ( member, revoked_at,
+    sequence ) tuples in sequence order, and sequence the current sequence of the log. None if
+    Redis could not be reached.
+    """
+    try:
+        pipeline = client().pipeline(transaction=False)
+        pipeline.zrangebyscore(REVOCATION_KEY, "-inf" if since is None else "(%d" % since,
+                               "+inf", withscores=True)
+        pipeline.get(REVOCATION_SEQUENCE_KEY)
+        entries, sequence = pipeline.execute()
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at fetch_token_revocations %s', str(ex))
+        return None
+    revocations = []
+    for entry, score in entries:
+        revoked_at, member = entry.decode('utf-8').split("|", 1)
+        revocations.append((member, float(revoked_at), int(score)))
+    return revocations, int(sequence or 0)
+
+
+# Pub/sub channel of the profile cache invalidations, the message is the email
+PROFILE_INVALIDATION_CHANNEL = "profile:invalidate"
+
+
+def profile_version(email):
+    """
+    The function profile_version returns the version of the profile of the user, bumped by
+    every write to the profile or the login history, see publish_profile_invalidations.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :return: the version, as a string, or None if Redis could not be reached.
+    """
+    key = PROFILE_VERSION_KEY_PREFIX + email
+    try:
+        version = _script(PROFILE_VERSION_LUA, key)(
+            keys=[key], args=[int(time.time() * 1000), PROFILE_VERSION_TTL])
+        return version.decode('utf-8') if isinstance(version, bytes) else str(version)
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at profile_version %s', str(ex))
+        return None
+
+
+def publish_profile_invalidations(emails, publish=True, bump_versions=True):
+    """
+    The function publish_profile_invalidations asks every worker to evict the cached profiles of
+    users, and bumps the versions of the profiles, in a single round trip per node. The
+    messages are published on the primary node, the versions are bumped on their nodes.
+
+    :param emails: The emails parameter is a list of email addresses
+    :param publish: The publish parameter is False to only bump the versions
+    :param bump_versions: The bump_versions parameter is False to only publish the invalidations
+    :return: a boolean value. It returns True if the messages were published.
+    """
+    keys = [PROFILE_VERSION_KEY_PREFIX + email for email in emails] if bump_versions else []
+
+    def execute(index, positions):
+        node = _connection()[1][index]
+        pipeline = node[1].pipeline(transaction=False)
+        if positions:
+            node[2][BUMP_PROFILE_VERSIONS_LUA](
+                keys=[keys[position] for position in positions],
+                args=[int(time.time() * 1000), PROFILE_VERSION_TTL], client=pipeline)
+        if publish and index == 0:
+            for email in emails:
+                pipeline.publish(PROFILE_INVALIDATION_CHANNEL, email)
+        pipeline.execute()
+
+    try:
+        groups = _connection()[0].group(keys)
+        if publish:
+            groups.setdefault(0, [])
+        _fan_out([functools.partial(execute, index, positions)
+                  for index, positions in groups.items()])
+        return True
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at publish_profile_invalidations %s', str(ex))
+        return False
+
+
+def subscribe_profile_invalidations():
+    """
+    The function subscribe_profile_invalidations subscribes to the profile invalidation channel.
+
+    :return: a PubSub object subscribed to the channel, the caller reads the messages from it.
+    It raises one of REDIS_ERRORS if Redis could not be reached.
+    """
+    pubsub = client().pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(PROFILE_INVALIDATION_CHANNEL)
+    except REDIS_ERRORS:
+        pubsub.close()
+        raise
+    return pubsub
+
+
+# Pub/sub channel of the emails added to the email filters, the message is the email
+EMAIL_ADDITION_CHANNEL = "email-filter:add"
+
+# Epoch of the email filters, bumped when additions may have been missed by some workers
+EMAIL_FILTER_EPOCH_KEY = "email-filter:epoch"
+
+
+def publish_email_additions(emails, bump_epoch=False):
+    """
+    The function publish_email_additions asks every worker to add new users to its email
+    filter, in a single round trip.
+
+    :param emails: The emails parameter is a list of email addresses
+    :param bump_epoch: The bump_epoch parameter is True to also bump the epoch of the filters,
+    every worker then rebuilds its filter, see email_filter_epoch
+    :return: a boolean value. It returns True if the messages were published.
+    """
+    try:
+        pipeline = client().pipeline(transaction=False)
+        if bump_epoch:
+            pipeline.incr(EMAIL_FILTER_EPOCH_KEY)
+        for email in emails:
+            pipeline.publish(EMAIL_ADDITION_CHANNEL, email)
+        pipeline.execute()
+        return True
+    except REDIS_ERRORS as ex:
+        logging.error('Exception at publish_email_additions %s', str(ex))
+        return False
+
+
+def email_filter_epoch():
+    """
+    The function email_filter_epoch returns the epoch of the email filters.
+
+    :return: the epoch, an integer. It raises one of REDIS_ERRORS if Redis could not be reached.
+    """
+    return int(client().get(EMAIL_FILTER_EPOCH_KEY) or 0)
+
+
+def subscribe_email_additions():
+    """
+    The function subscribe_email_additions subscribes to the email filter addition channel.
+
+    :return: a PubSub object subscribed to the channel, the caller reads the messages from it.
+    It raises one of REDIS_ERRORS if Redis could not be reached.
+    """
+    pubsub = client().pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(EMAIL_ADDITION_CHANNEL)
+    except REDIS_ERRORS:
+        pubsub.close()
+        raise
+    return pubsub
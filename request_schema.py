@@ -0,0 +1,150 @@
+"""
+    The module provides the request schemas of the routes, which declare the parameters of a
+    route, the mandatory ones and the pattern and the error response of each value.
+
+    A schema is compiled once at import into a flat validator: the patterns of validate_param are
+    compiled, and the error responses are the constant responses of appconstants, encoded once.
+    A request is then validated by a presence check of the mandatory parameters followed by one
+    match per parameter, the first failure being answered with its error response and 400, in the
+    order of the declaration.
+
+    The parameters are read from the query string, and from a JSON object body when the request
+    has the Content-Type application/json, so that the passwords do not have to travel in URLs.
+    A parameter of the body takes precedence over the same parameter of the query string. The
+    string and number values of the body are accepted, the other values are ignored.
+"""
+import re
+import json
+import validate_param
+import appconstants
+
+JSON_MIMETYPE = "application/json"
+
+
+class Field:
+    """
+    The class Field declares a parameter of a request.
+
+    :param name: The name is the name of the parameter
+    :param pattern: The pattern is the pattern of a valid value, or None if any non-empty value
+    is valid
+    :param error: The error is the response of an invalid value
+    :param convert: The convert is the function converting a valid value, ex. int, or None to
+    keep the string
+    :param prefix: The prefix is True if the pattern only has to match the start of the value,
+    as validate_param.is_parameter_value_valid_email
+    """
+
+    def __init__(self, name, pattern=None, error=None, convert=None, prefix=False):
+        self.name = name
+        self.error = error
+        self.convert = convert
+        self.match = None
+        if pattern is not None:
+            compiled = re.compile(pattern)
+            self.match = compiled.match if prefix else compiled.fullmatch
+
+
+USERNAME = Field("username")
+EMAIL = Field("email", validate_param.EMAIL_PATTERN, appconstants.BAD_EMAIL_VALUE, prefix=True)
+PASSWORD = Field("password", validate_param.PASSWORD_PATTERN, appconstants.BAD_PASSWORD_VALUE)
+# the password of a login is checked against the stored hash only
+LOGIN_PASSWORD = Field("password")
+TOKEN = Field("token")
+LIMIT = Field("limit", validate_param.LIMIT_PATTERN, appconstants.BAD_LIMIT_VALUE, int)
+BEFORE = Field("before", validate_param.TIMESTAMP_PATTERN, appconstants.BAD_BEFORE_VALUE, float)
+RATE = Field("rate", validate_param.FRACTION_PATTERN, appconstants.BAD_RATE_VALUE, float)
+SECONDS = Field("seconds", validate_param.SECONDS_PATTERN, appconstants.BAD_SECONDS_VALUE, float)
+
+
+class Schema:
+    """
+    The class Schema is the compiled validator of the parameters of a route.
+
+    :param required: The required is the tuple of the mandatory fields
+    :param missing: The missing is the response of a request missing a mandatory field
+    :param optional: The optional is the tuple of the optional fields, an optional value is only
+    checked when the parameter is given
+    """
+
+    def __init__(self, required, missing, optional=()):
+        fields = tuple(required) + tuple(optional)
+        self.names = tuple(field.name for field in fields)
+        self.required = tuple(field.name for field in required)
+        self.missing = missing
+        self._checks = tuple((field.name, field.match, field.error, field.convert)
+                             for field in fields if field.match is not None)
+
+    def _read(self, query, document):
+        """
+        The function _read reads the parameters of the schema.
+        """
+        if document is None:
+            return {name: query.get(name) for name in self.names}
+        return {name: _string(document[name]) if name in document else query.get(name)
+                for name in self.names}
+
+    def validate(self, query, body=None):
+        """
+        The function validate validates the parameters of a request.
+
+        :param query: The query is the mapping of the query string parameters
+        :param body: The body is the JSON request body, as bytes, or None if the request has no
+        JSON body
+        :return: a ( params, error ) tuple, params is the dictionary of the parameters, the
+        absent optional ones being None, if the request is valid, otherwise error is the error
+        response, answered with 400.
+        """
+        document = None
+        if body:
+            try:
+                document = json.loads(body)
+            except ValueError:
+                return None, appconstants.BAD_JSON_BODY
+            if not isinstance(document, dict):
+                return None, appconstants.BAD_JSON_BODY
+        params = self._read(query, document)
+        for name in self.required:
+            if not params[name]:
+                return None, self.missing
+        for name, match, error, convert in self._checks:
+            value = params[name]
+            if value is not None:
+                if match(value) is None:
+                    return None, error
+                if convert is not None:
+                    params[name] = convert(value)
+        return params, None
+
+
+def _string(value):
+    """
+    The function _string returns a value of a JSON body as a string, or None if it is not a
+    string or a number.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def is_json(content_type):
+    """
+    The function is_json checks if the Content-Type of a request is application/json.
+
+    :param content_type: The content_type is the value of the Content-Type header, or None
+    :return: a boolean value. It returns True if the body of the request is read as parameters.
+    """
+    return (content_type is not None
+            and content_type.split(";", 1)[0].strip().lower() == JSON_MIMETYPE)
+
+
+LIST_USER = Schema((EMAIL,), appconstants.PARAM_EMAIL_ABSENT, (LIMIT, BEFORE))
+CREATE_USER = Schema((USERNAME, EMAIL, PASSWORD), appconstants.MANDATORY_PARAMETER_U_E_P_MISSING)
+LOGIN_USER = Schema((EMAIL, LOGIN_PASSWORD), appconstants.MANDATORY_PARAMETER_E_P_MISSING)
+CHECK_LOGGED_IN = Schema((EMAIL,), appconstants.PARAM_EMAIL_ABSENT, (TOKEN,))
+LOG_OUT = Schema((EMAIL,), appconstants.PARAM_EMAIL_ABSENT, (TOKEN,))
+UPDATE_USER = Schema((USERNAME, EMAIL, PASSWORD), appconstants.MANDATORY_PARAMETER_U_E_P_MISSING)
+DELETE_USER = Schema((USERNAME, EMAIL), appconstants.MANDATORY_PARAMETER_E_U_MISSING)
+START_PROFILER = Schema((), None, (RATE, SECONDS))
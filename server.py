@@ -6,48 +6,287 @@
     a status code.
 """
 
-import hashlib
 import os
 import sys
+import time
 import logging
-from flask import Flask, jsonify, request
+import threading
+from flask import Blueprint, Flask, Response, request, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 import redis_cache
 import mongo_db_connector
 import validate_param
+import request_schema
 import appconstants
+import password_hasher
+import session_token
+import profile_cache
+import email_filter
+import bulk_users
+import batch_lookup
+import metrics
+import profiler
+import circuit_breaker
+import health
+import rate_limiter
+import json_responses
 
-# creating a Flask app
-APP = Flask(__name__)
+# the routes and the request hooks of the API, registered on the app by create_app
+API = Blueprint("api", __name__)
+
+
+def exception_status_code(response):
+    """
+    The function `exception_status_code` maps an exception response to its status code.
+    :param response: The response is a dictionary holding the "exception" key
+    :return: 503 if the request was shed or a backend is unavailable ( ex. its circuit breaker is
+    open ), the request can be retried, otherwise 500.
+    """
+    if response in (appconstants.PASSWORD_HASHER_BUSY, appconstants.MONGODB_CONNECTIVITY_ISSUE,
+                    appconstants.REDIS_CONNECTIVITY_ISSUE, appconstants.EMAIL_INDEXES_MISSING):
+        return 503
+    return 500
+
+
+def json_response(response, status_code):
+    """
+    The function `json_response` builds the JSON response of a route. The body of a constant
+    response is encoded once, see json_responses.
+    :param response: The response is a response of appconstants, or a dictionary
+    :param status_code: The status_code is the HTTP status code of the response
+    :return: the response.
+    """
+    return Response(json_responses.encode(response), status=status_code,
+                    mimetype=json_responses.MIMETYPE)
+
+
+def request_params(schema):
+    """
+    The function `request_params` validates the parameters of the request, read from the query
+    string and from a JSON body, see request_schema.
+    :param schema: The schema is the request_schema.Schema of the route
+    :return: a ( params, error ) tuple, params is the dictionary of the parameters if they are
+    valid, otherwise error is the error response, answered with 400.
+    """
+    body = None
+    if request_schema.is_json(request.content_type):
+        body = request.get_data(cache=True)
+    return schema.validate(request.args, body)
+
+
+def versioned(response, version):
+    """
+    The function `versioned` labels a profile response with the ETag of its version, see
+    profile_cache. The clients revalidate it with If-None-Match.
+    :param response: The response is the response of the route
+    :param version: The version is the profile version read before the profile
+    :return: the response.
+    """
+    response.headers["ETag"] = profile_cache.etag(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def too_many_requests(retry_after):
+    """
+    The function `too_many_requests` builds the response of an attempt over a rate limit.
+    :param retry_after: The retry_after is the number of seconds to wait before a new attempt
+    :return: the response, with the status code 429 and the Retry-After header.
+    """
+    response = json_response(appconstants.TOO_MANY_REQUESTS, 429)
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+@API.before_app_request
+def start_request_timer():
+    """
+    The function `start_request_timer` records the start time of the request, see record_request.
+    """
+    request.environ["metrics.started"] = time.perf_counter()
+
+
+@API.after_app_request
+def record_request(response):
+    """
+    The function `record_request` records the count, the status code and the latency of the
+    request, labelled with the route rule rather than the path to bound the label values. The
+    latency of a streamed response is the time to its first byte.
+    :param response: The response is the response of the request
+    :return: the response, unchanged
+    """
+    started = request.environ.get("metrics.started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.inc(metrics.HTTP_REQUESTS, (route, request.method, str(response.status_code)))
+        metrics.observe(metrics.HTTP_DURATION, (route, request.method),
+                        time.perf_counter() - started)
+    return response
+
+
+@API.after_app_request
+def compress_response(response):
+    """
+    The function `compress_response` gzip compresses a large response body, for the clients
+    accepting it, see json_responses.compress. Streamed and file responses are sent as they are.
+    :param response: The response is the response of the request
+    :return: the response
+    """
+    if (json_responses.RESPONSE_GZIP_ENABLED and response.status_code == 200
+            and not response.is_streamed and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers):
+        body = response.get_data()
+        if len(body) >= json_responses.RESPONSE_GZIP_MIN_SIZE:
+            response.vary.add("Accept-Encoding")
+            if request.accept_encodings["gzip"]:
+                response.set_data(json_responses.compress(body))
+                response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+@API.before_app_request
+def start_profiling():
+    """
+    The function `start_profiling` registers a sample of the requests with the profiler, while
+    the profiler is on.
+    """
+    if profiler.PROFILER.should_sample():
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request.environ["profiler.key"] = threading.get_ident()
+        profiler.PROFILER.begin(threading.get_ident(), request.method + " " + route)
+
+
+@API.teardown_app_request
+def end_profiling(exception):  # pylint: disable=unused-argument
+    """
+    The function `end_profiling` unregisters a profiled request.
+    """
+    key = request.environ.get("profiler.key")
+    if key is not None:
+        profiler.PROFILER.end(key)
+
+
+@API.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    The function `metrics_endpoint()` exposes the metrics in the Prometheus text format, those
+    of all the workers with METRICS_DIR, else those of this worker.
+    :return: the metrics, as text.
+    """
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@API.route('/admin/profile/start', methods=['POST'])
+def start_profiler():
+    """
+    The function `start_profiler()` switches the profiler of this worker on. The optional rate
+    parameter is the fraction of the requests profiled, and the optional seconds parameter the
+    number of seconds the profiler stays on. The admin token is passed in the X-Admin-Token
+    header.
+    :return: a tuple containing a JSON response with the status of the profiler and a status code.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    params, error = request_params(request_schema.START_PROFILER)
+    if error is not None:
+        return json_response(error, 400)
+    return json_response(profiler.PROFILER.start(params["rate"], params["seconds"]), 200)
+
+
+@API.route('/admin/profile/stop', methods=['POST'])
+def stop_profiler():
+    """
+    The function `stop_profiler()` switches the profiler of this worker off, the profile is kept
+    for download.
+    :return: a tuple containing a JSON response with the status of the profiler and a status code.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    return json_response(profiler.PROFILER.stop(), 200)
+
+
+@API.route('/admin/profile/status', methods=['GET'])
+def profiler_status():
+    """
+    The function `profiler_status()` reports the state of the profiler of this worker.
+    :return: a tuple containing a JSON response with the status of the profiler and a status code.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    return json_response(profiler.PROFILER.status(), 200)
+
+
+@API.route('/admin/profile', methods=['GET'])
+def download_profile():
+    """
+    The function `download_profile()` downloads the profile of this worker, as collapsed stacks
+    ( format=collapsed, the default ) or as an SVG flame graph ( format=svg ).
+    :return: the profile as an attachment, or a JSON error response and a status code.
+    """
+    output_format = request.args.get("format", "collapsed")
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    if output_format not in profiler.FORMATS:
+        return json_response(appconstants.BAD_FORMAT_VALUE, 400)
+    mimetype, render = profiler.FORMATS[output_format]
+    return Response(render(), mimetype=mimetype, headers={
+        "Content-Disposition": "attachment; filename=profile-%d.%s" % (os.getpid(),
+                                                                        output_format)})
+
+
+@API.route('/health/live', methods=['GET'])
+def liveness():
+    """
+    The function `liveness()` answers the liveness probe, without calling a backend.
+    :return: a tuple containing a JSON response and the status code 200.
+    """
+    return json_response(appconstants.SERVICE_ALIVE, 200)
+
+
+@API.route('/health/ready', methods=['GET'])
+def readiness():
+    """
+    The function `readiness()` answers the readiness probe, see health.Readiness.check.
+    :return: a tuple containing a JSON response with the status of each backend and the status
+    code 200 if both backends are up, otherwise 503.
+    """
+    response = health.READINESS.check(mongo_db_connector.ping, redis_cache.ping)
+    return json_response(response, 200 if health.is_ready(response) else 503)
 
 
-@APP.route('/list/user', methods=['GET'])
+@API.route('/list/user', methods=['GET'])
 def list_user():
     """
     The function "list_user" takes an email parameter, validates it, and returns a JSON response
-    containing user profile information if the email is valid.
+    containing user profile information if the email is valid. The optional limit and before
+    parameters select a page of the login history. The response carries the ETag of the profile
+    version, a request whose If-None-Match holds it is answered with 304, without reading MongoDB.
     :return: a JSON response and a status code. The JSON response contains the user profile
     information if the email parameter is valid and the email is valid. If the email parameter is
     missing or the email value is not valid, an error message is returned. The status code
     indicates the success or failure of the request.
     """
-    email = request.args.get("email")
-    response = {}
+    params, error = request_params(request_schema.LIST_USER)
+    if error is not None:
+        return json_response(error, 400)
+    email = params["email"]
     status_code = 200
-    if validate_param.is_parameter_value_valid(email):
-        if validate_param.is_parameter_value_valid_email(email):
-            response = mongo_db_connector.list_user(email)
-            if "exception" in response.keys():
-                status_code = 500
-        else:
-            response = appconstants.BAD_EMAIL_VALUE
-            status_code = 400
-    else:
-        status_code = 400
-        response = appconstants.PARAM_EMAIL_ABSENT
-    return (jsonify(response), status_code)
+    version = None
+    if profile_cache.should_version(email):
+        version = redis_cache.profile_version(email)
+    if version is not None and profile_cache.etag_matches(
+            request.headers.get("If-None-Match"), version):
+        return versioned(Response(status=304), version)
+    response = mongo_db_connector.list_user(email, params["limit"], params["before"], version)
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+        version = None
+    if version is not None:
+        return versioned(json_response(response, status_code), version)
+    return json_response(response, status_code)
 
 
-@APP.route('/create/user', methods=['POST'])
+@API.route('/create/user', methods=['POST'])
 def create_user():
     """
     The `create_user` function is a Flask route that creates a new user by validating the provided
@@ -56,123 +295,246 @@ def create_user():
     response contains the response data, which can be either a success message or an error message.
     The status code indicates the success or failure of the request.
     """
-    username = request.args.get("username")
-    email = request.args.get("email")
-    password = request.args.get("password")
-    response = {}
+    params, error = request_params(request_schema.CREATE_USER)
+    if error is not None:
+        return json_response(error, 400)
+    retry_after = rate_limiter.LIMITER.check("create_user", ip=request.remote_addr)
+    if retry_after:
+        return too_many_requests(retry_after)
     status_code = 200
-    if (validate_param.is_parameter_value_valid(username)
-            and validate_param.is_parameter_value_valid(email)
-            and validate_param.is_parameter_value_valid(password)):
-        if validate_param.is_parameter_value_valid_email(email):
-            if validate_param.is_parameter_value_valid_password(password):
-                response = (mongo_db_connector.add_user(
-                    username, email, password))
-                if "exception" in response.keys():
-                    status_code = 500
-            else:
-                response = appconstants.BAD_PASSWORD_VALUE
-        else:
-            response = appconstants.BAD_EMAIL_VALUE
-            status_code = 400
-    else:
-        response = appconstants.MANDATORY_PARAMETER_U_E_P_MISSING
-        status_code = 400
-    return (jsonify(response), status_code)
+    response = mongo_db_connector.add_user(params["username"], params["email"],
+                                           params["password"])
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return json_response(response, status_code)
 
 
-@APP.route('/login/user', methods=['POST'])
+@API.route('/login/user', methods=['POST'])
 def login_user():
     """
     The function `login_user()` is a route handler for the `/login/user` endpoint that handles user
-    login by validating the email and password parameters, encrypting the password, and calling the
-    `login_user()` function from the `mongo_db_connector` module.
+    login by validating the email and password parameters, and calling the `login_user()` function
+    from the `mongo_db_connector` module, which verifies the password against the stored hash.
     :return: a JSON response and a status code. The JSON response contains the response data, which
     could be a success message or an error message. The status code indicates the status of the
     response, such as 200 for a successful request or 400 for a bad request.
     """
-    email = request.args.get("email")
-    password = request.args.get("password")
-    response = {}
+    params, error = request_params(request_schema.LOGIN_USER)
+    if error is not None:
+        return json_response(error, 400)
+    email = params["email"]
+    retry_after = rate_limiter.LIMITER.check("login_user", email=email, ip=request.remote_addr)
+    if retry_after:
+        return too_many_requests(retry_after)
     status_code = 200
-
-    if (validate_param.is_parameter_value_valid(email)
-            and validate_param.is_parameter_value_valid(password)):
-        if validate_param.is_parameter_value_valid_email(email):
-            encrypted_password = hashlib.md5(
-                password.encode('utf-8')).hexdigest()
-            response = (mongo_db_connector.login_user(
-                email, encrypted_password))
-            if "exception" in response.keys():
-                status_code = 500
-        else:
-            response = appconstants.BAD_EMAIL_VALUE
-            status_code = 400
-    else:
-        response = appconstants.MANDATORY_PARAMETER_E_P_MISSING
-        status_code = 400
-    return (jsonify(response), status_code)
+    response = mongo_db_connector.login_user(email, params["password"])
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return json_response(response, status_code)
 
 
-@APP.route('/login/user', methods=['GET'])
+@API.route('/login/user', methods=['GET'])
 def check_logged_in():
     """
     The function `check_logged_in` checks if a user with a given email is logged in and
-    returns a response message indicating their login status.
+    returns a response message indicating their login status. The optional token parameter
+    selects the session to check. In the signed token mode the token parameter is mandatory,
+    and it is verified without a Redis round trip.
     :return: a tuple containing a JSON response and a status code. The JSON response contains a
     message indicating whether the provided email is logged in or not. The status code indicates
     the success or failure of the request.
     """
-    email = request.args.get("email")
-    response = {}
-    status_code = 200
+    params, error = request_params(request_schema.CHECK_LOGGED_IN)
+    if error is not None:
+        return json_response(error, 400)
+    email, token = params["email"], params["token"]
+    if session_token.is_signed_mode():
+        if not validate_param.is_parameter_value_valid(token):
+            return json_response(appconstants.PARAM_TOKEN_ABSENT, 400)
+        logged_in = session_token.is_token_valid(email, token)
+    else:
+        logged_in = redis_cache.is_client_token_persists(email, token)
+    if logged_in:
+        return json_response({"message": email + " is logged in"}, 200)
+    return json_response({"message": email + " is not logged in"}, 200)
 
-    if validate_param.is_parameter_value_valid(email):
-        if validate_param.is_parameter_value_valid_email(email):
-            if redis_cache.is_client_token_persists(email):
-                response = ({"message": email + " is logged in"})
-            else:
-                response = ({"message": email + " is not logged in"})
-        else:
-            response =  appconstants.BAD_EMAIL_VALUE
-            status_code = 400
+
+def log_out_signed(email, token):
+    """
+    The function `log_out_signed()` logs out a user in the signed token mode. The session of the
+    token is revoked, or every session of the user if no token is given.
+    :param email: The email parameter is the email address of the user
+    :param token: The token parameter is the token of the session to log out, or None
+    :return: a dictionary containing a message indicating whether the user was logged out.
+    """
+    if validate_param.is_parameter_value_valid(token):
+        if not session_token.is_token_valid(email, token):
+            return {"message": email + " not logged in. Hence cannot log out"}
+        logged_out = session_token.revoke_token(email, token)
     else:
-        response =  appconstants.PARAM_EMAIL_ABSENT
-        status_code = 400
-    return (jsonify(response), status_code)
+        logged_out = session_token.revoke_all_tokens(email)
+    if logged_out:
+        return {"message": email + " logged out"}
+    return {"message": email + " failed to logged out"}
 
 
-@APP.route('/logout/user', methods=['GET'])
+@API.route('/logout/user', methods=['GET'])
 def log_out():
     """
     The function `log_out()` logs out a user based on their email and returns a response message.
+    The optional token parameter selects the session to log out, without it the user is logged
+    out everywhere.
     :return: a tuple containing a JSON response and a status code. The JSON response contains a
     message indicating whether the user was successfully logged out or not. The status code
     indicates the success or failure of the request.
     """
-    email = request.args.get("email")
-    response = {}
-    status_code = 200
-
-    if validate_param.is_parameter_value_valid(email):
-        if validate_param.is_parameter_value_valid_email(email):
-            if redis_cache.is_client_token_persists(email):
-                if redis_cache.is_remove_client_token(email):
-                    response = ({"message": email + " logged out"})
-                else:
-                    response = ({"message": email + " failed to logged out"})
-            else:
-                response = ({"message": email + " not logged in. Hence cannot log out"})
-        else:
-            response = appconstants.BAD_EMAIL_VALUE
-            status_code = 400
+    params, error = request_params(request_schema.LOG_OUT)
+    if error is not None:
+        return json_response(error, 400)
+    email, token = params["email"], params["token"]
+    if session_token.is_signed_mode():
+        response = log_out_signed(email, token)
     else:
-        response = appconstants.PARAM_EMAIL_ABSENT
-        status_code = 400
-    return (jsonify(response), status_code)
+        removed = redis_cache.remove_client_tokens(email, token)
+        if removed is None:
+            response = ({"message": email + " failed to logged out"})
+        elif removed > 0:
+            response = ({"message": email + " logged out"})
+        else:
+            response = ({"message": email + " not logged in. Hence cannot log out"})
+    return json_response(response, 200)
+
+
+@API.route('/stats/sessions', methods=['GET'])
+def session_stats():
+    """
+    The function `session_stats()` reports the key count and memory usage of the session store.
+    :return: a tuple containing a JSON response and a status code. The JSON response contains the
+    statistics, or an error message if Redis could not be reached.
+    """
+    response = redis_cache.session_stats()
+    if response is None:
+        return json_response(appconstants.REDIS_CONNECTIVITY_ISSUE, 503)
+    return json_response(response, 200)
+
+
+@API.route('/stats/breakers', methods=['GET'])
+def breaker_stats():
+    """
+    The function `breaker_stats()` reports the state of the MongoDB and Redis circuit breakers
+    of this worker.
+    :return: a tuple containing a JSON response and a status code.
+    """
+    return json_response(circuit_breaker.stats(), 200)
+
+
+@API.route('/stats/rate-limits', methods=['GET'])
+def rate_limit_stats():
+    """
+    The function `rate_limit_stats()` reports the rate limits and the rejected attempts of this
+    worker.
+    :return: a tuple containing a JSON response with the rate limit counters and a status code.
+    """
+    return json_response(rate_limiter.LIMITER.stats(), 200)
+
+
+@API.route('/stats/login-history', methods=['GET'])
+def login_history_stats():
+    """
+    The function `login_history_stats()` reports the login history write-behind of this worker.
+    :return: a tuple containing a JSON response with the queue and the counters and a status code.
+    """
+    return json_response(mongo_db_connector.LOGIN_HISTORY.stats(), 200)
+
 
+@API.route('/stats/profile-cache', methods=['GET'])
+def profile_cache_stats():
+    """
+    The function `profile_cache_stats()` reports the size and the hit / miss / eviction counters
+    of the profile cache of this worker.
+    :return: a tuple containing a JSON response and a status code.
+    """
+    return json_response(profile_cache.CACHE.stats(), 200)
+
+
+@API.route('/stats/email-filter', methods=['GET'])
+def email_filter_stats():
+    """
+    The function `email_filter_stats()` reports the size, the false positive rates and the
+    counters of the email filter of this worker.
+    :return: a tuple containing a JSON response and a status code.
+    """
+    return json_response(email_filter.FILTER.stats(), 200)
+
+
+@API.route('/bulk/create/user', methods=['POST'])
+def bulk_create_user():
+    """
+    The function `bulk_create_user()` creates the users of an NDJSON request body, one JSON object
+    with the keys username, email and password per line. The body is read as a stream and
+    written in batches. The admin token is passed in the X-Admin-Token header.
+    :return: a streamed NDJSON response, with one result line per input line, in input order.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    return Response(stream_with_context(bulk_users.create_users(request.stream)),
+                    mimetype="application/x-ndjson")
+
+
+@API.route('/export/users', methods=['GET'])
+def export_users():
+    """
+    The function `export_users()` streams the username and email of every user in email order.
+    The optional after parameter resumes an interrupted export after the given email. The admin
+    token is passed in the X-Admin-Token header.
+    :return: a streamed NDJSON response, with one line per user.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    after = request.args.get("after")
+    return Response(stream_with_context(bulk_users.export_users(after)),
+                    mimetype="application/x-ndjson")
+
+
+@API.route('/batch/login/user', methods=['POST'])
+def batch_check_logged_in():
+    """
+    The function `batch_check_logged_in()` checks the sessions of a batch of users, the JSON
+    body {"emails": [...]} listing an email, or an object with the keys email and token, per
+    user. The sessions are checked with a single Redis round trip per node and chunk, see
+    batch_lookup. The admin token is passed in the X-Admin-Token header.
+    :return: a streamed NDJSON response, with one result line per entry, in input order, or a
+    JSON error response and a status code if the body is not a valid batch.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    entries, error, status_code = batch_lookup.parse_batch(request.get_data())
+    if error is not None:
+        return json_response(error, status_code)
+    return Response(stream_with_context(batch_lookup.session_status(entries)),
+                    mimetype="application/x-ndjson")
+
+
+@API.route('/batch/list/user', methods=['POST'])
+def batch_list_user():
+    """
+    The function `batch_list_user()` returns the profiles of a batch of users, the JSON body
+    {"emails": [...]} listing their emails. The profiles are fetched with a single $in query on
+    each collection per chunk, see batch_lookup. The admin token is passed in the X-Admin-Token
+    header.
+    :return: a streamed NDJSON response, with one result line per entry, in input order, or a
+    JSON error response and a status code if the body is not a valid batch.
+    """
+    if not validate_param.is_admin_token_valid(request.headers.get("X-Admin-Token")):
+        return json_response(appconstants.ADMIN_TOKEN_INVALID, 403)
+    entries, error, status_code = batch_lookup.parse_batch(request.get_data())
+    if error is not None:
+        return json_response(error, status_code)
+    return Response(stream_with_context(batch_lookup.profiles(entries)),
+                    mimetype="application/x-ndjson")
 
-@APP.route('/update/user', methods=['PUT'])
+
+@API.route('/update/user', methods=['PUT'])
 def update_user():
     """
     The function `update_user()` updates a user's information in a database, including their
@@ -181,34 +543,23 @@ def update_user():
     information or an error message, depending on the validation of the parameters. The
     status code indicates the success or failure of the request.
     """
-    username = request.args.get("username")
-    email = request.args.get("email")
-    password = request.args.get("password")
-    response = {}
+    params, error = request_params(request_schema.UPDATE_USER)
+    if error is not None:
+        return json_response(error, 400)
     status_code = 200
-    if (validate_param.is_parameter_value_valid(username) and validate_param.is_parameter_value_valid(email)
-            and validate_param.is_parameter_value_valid(password)):
-        if validate_param.is_parameter_value_valid_email(email):
-            if validate_param.is_parameter_value_valid_password(password):
-                encrypted_password = hashlib.md5(
-                    password.encode('utf-8')).hexdigest()
-                response = (mongo_db_connector.update_user(
-                    username, email, encrypted_password))
-                if "exception" in response.keys():
-                    status_code = 500
-            else:
-                response = appconstants.BAD_PASSWORD_VALUE
-                status_code = 400
-        else:
-            response = appconstants.BAD_EMAIL_VALUE
-            status_code = 400
-    else:
-        response = appconstants.MANDATORY_PARAMETER_U_E_P_MISSING
-        status_code = 400
-    return (jsonify(response), status_code)
+    try:
+        encrypted_password = password_hasher.hash_password(params["password"])
+        response = (mongo_db_connector.update_user(
+            params["username"], params["email"], encrypted_password))
+    except password_hasher.PasswordHasherBusy as ex:
+        response = appconstants.PASSWORD_HASHER_BUSY
+        logging.error('Exception at update_user %s', str(ex))
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return json_response(response, status_code)
 
 
-@APP.route('/delete/user', methods=['DELETE'])
+@API.route('/delete/user', methods=['DELETE'])
 def delete_user():
     """
     The function `delete_user()` is a route in a Python Flask application that deletes a user
@@ -216,23 +567,33 @@ def delete_user():
     :return: a JSON response and a status code. The JSON response contains the response message
     and the status code indicates the success or failure of the request.
     """
-    username = request.args.get("username")
-    email = request.args.get("email")
-    response = {}
+    params, error = request_params(request_schema.DELETE_USER)
+    if error is not None:
+        return json_response(error, 400)
     status_code = 200
-    if (validate_param.is_parameter_value_valid(username)
-            and validate_param.is_parameter_value_valid(email)):
-        if validate_param.is_parameter_value_valid_email(email):
-            response = (mongo_db_connector.delete_user(username, email))
-            if "exception" in response.keys():
-                status_code = 500
-        else:
-            response = appconstants.BAD_EMAIL_VALUE
-            status_code = 400
-    else:
-        response = appconstants.MANDATORY_PARAMETER_E_U_MISSING
-        status_code = 400
-    return (jsonify(response), status_code)
+    response = (mongo_db_connector.delete_user(params["username"], params["email"]))
+    if "exception" in response.keys():
+        status_code = exception_status_code(response)
+    return json_response(response, status_code)
+
+
+def create_app():
+    """
+    The function `create_app()` creates the Flask app. No backend is connected here, the MongoDB
+    and Redis clients are created on first use in each worker, hence the app can be imported
+    and created before the workers are forked, see gunicorn.conf.py. Behind TRUSTED_PROXY_HOPS
+    reverse proxies, the client address is read from X-Forwarded-For.
+    :return: the Flask app.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(API)
+    if rate_limiter.TRUSTED_PROXY_HOPS:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=rate_limiter.TRUSTED_PROXY_HOPS)
+    return app
+
+
+# creating a Flask app
+APP = create_app()
 
 
 if __name__ == '__main__':
@@ -244,4 +605,10 @@ if __name__ == '__main__':
     else:
         logging.info("App Env. MONGODB_HOST %s, MONGODB_PORT %d, REDIS_HOST %s, REDIS_PORT %d ",
                     os.environ["MONGODB_HOST"], os.environ["MONGODB_PORT"], os.environ["REDIS_HOST"], os.environ["REDIS_PORT"])
+        # unique email indexes, required by add_user to reject duplicate emails
+        if not mongo_db_connector.create_indexes():
+            logging.error("Unique email indexes are not in place, the app is not started")
+            sys.exit(1)
+        # the profiler can be toggled with a signal, see profiler.PROFILE_SIGNAL
+        profiler.install_signal_handler()
         APP.run(debug=True)
@@ -0,0 +1,259 @@
+"""
+    The module provides stateless, HMAC signed session tokens.
+
+    In the signed mode ( SESSION_TOKEN_MODE=signed ) a login issues a token carrying the email,
+    a session id, the issue time and the expiry, signed with SESSION_TOKEN_SECRET. A token is
+    verified in-process, without a Redis round trip. Every login gets its own session id, hence
+    a user can be logged in from several devices.
+
+    Logging out records a revocation in a Redis sorted set, either of a single session or a
+    cutoff time for all the sessions of a user ( "logout everywhere" ). Each worker mirrors the
+    revocation set locally, refreshing it incrementally every REVOCATION_REFRESH_INTERVAL seconds.
+"""
+import os
+import hmac
+import time
+import uuid
+import base64
+import hashlib
+import logging
+import threading
+import redis_cache
+
+SESSION_TOKEN_MODE = os.environ.get("SESSION_TOKEN_MODE", "opaque")
+SESSION_TOKEN_SECRET = os.environ.get("SESSION_TOKEN_SECRET", "")
+# Lifetime of a signed token in seconds
+SESSION_TOKEN_TTL = int(os.environ.get("SESSION_TOKEN_TTL", "86400"))
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get("REVOCATION_REFRESH_INTERVAL", "1"))
+
+if SESSION_TOKEN_MODE == "signed" and not SESSION_TOKEN_SECRET:
+    raise RuntimeError("SESSION_TOKEN_SECRET must be set when SESSION_TOKEN_MODE is signed")
+
+
+def is_signed_mode():
+    """
+    The function is_signed_mode checks if the signed session tokens are enabled.
+
+    :return: a boolean value. It returns True if SESSION_TOKEN_MODE is "signed".
+    """
+    return SESSION_TOKEN_MODE == "signed"
+
+
+def _encode(data):
+    """
+    The function _encode encodes bytes as unpadded URL safe base64.
+    """
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode('ascii')
+
+
+def _decode(data):
+    """
+    The function _decode decodes unpadded URL safe base64 to bytes.
+    """
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload):
+    """
+    The function _sign computes the HMAC-SHA256 signature of a token payload.
+    """
+    return hmac.new(SESSION_TOKEN_SECRET.encode('utf-8'), payload, hashlib.sha256).digest()
+
+
+def _now_ms():
+    """
+    The function _now_ms returns the current epoch time in milliseconds.
+    """
+    return int(time.time() * 1000)
+
+
+def issue_token(email):
+    """
+    The function issue_token issues a signed token for a new session of the user.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :return: the token, "<payload>.<signature>", both URL safe base64 encoded
+    """
+    issued_at = _now_ms()
+    expires_at = issued_at + SESSION_TOKEN_TTL * 1000
+    payload = ("%s.%d.%d.%s" % (uuid.uuid4().hex, issued_at, expires_at, email)).encode('utf-8')
+    return _encode(payload) + "." + _encode(_sign(payload))
+
+
+def _parse_token(email, token):
+    """
+    The function _parse_token checks the signature, the owner and the expiry of a token.
+
+    :param email: The email parameter is the email address the token must belong to
+    :param token: The token is the token presented by the client
+    :return: a ( session id, issued at ) tuple, or None if the token is not valid.
+    """
+    try:
+        payload_part, signature_part = token.split(".")
+        payload = _decode(payload_part)
+        if not hmac.compare_digest(_decode(signature_part), _sign(payload)):
+            return None
+        session_id, issued_at, expires_at, token_email = payload.decode('utf-8').split(".", 3)
+        if token_email != email or int(expires_at) <= _now_ms():
+            return None
+        return session_id, int(issued_at)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class RevocationMirror:
+    """
+    The class RevocationMirror holds the local copy of the Redis revocation log of a worker.
+    A background thread pulls the entries appended since the last refresh, by their sequence
+    in the log.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._cutoffs = {}
+        self._since = None
+        self._synced = False
+        self._lock = threading.Lock()
+        self._started = False
+
+    def reset(self):
+        """
+        The function reset forgets the sync state in a forked child, where the refresh thread
+        and the lock of the parent process are not usable. The mirror is reloaded on next use.
+        """
+        self._lock = threading.Lock()
+        self._since = None
+        self._synced = False
+        self._started = False
+
+    def apply(self, member, revoked_at):
+        """
+        The function apply adds a revocation entry to the mirror.
+
+        :param member: The member is "sid:<session id>" or "user:<email>:<cutoff ms>"
+        :param revoked_at: The revoked_at is the epoch time of the revocation
+        """
+        if member.startswith("sid:"):
+            self._sessions[member[4:]] = revoked_at
+        elif member.startswith("user:"):
+            email, cutoff = member[5:].rsplit(":", 1)
+            self._cutoffs[email] = max(int(cutoff), self._cutoffs.get(email, 0))
+
+    def refresh(self):
+        """
+        The function refresh pulls the revocation entries appended since the last refresh, and
+        drops the local entries older than the token lifetime. A log whose sequence went back
+        ( ex. Redis restarted without persistence ) is read again whole.
+
+        :return: a boolean value. It returns True if the mirror is in sync with Redis.
+        """
+        with self._lock:
+            fetched = redis_cache.fetch_token_revocations(self._since)
+            if fetched is not None and self._since and fetched[1] < self._since:
+                fetched = redis_cache.fetch_token_revocations(None)
+            if fetched is None:
+                return self._synced
+            entries, sequence = fetched
+            for member, revoked_at, _ in entries:
+                self.apply(member, revoked_at)
+            # the entries appended after this read carry a higher sequence than the last one read
+            if entries:
+                self._since = entries[-1][2]
+            elif self._since is None or sequence < self._since:
+                self._since = 0
+            horizon = time.time() - SESSION_TOKEN_TTL
+            for session_id, revoked_at in list(self._sessions.items()):
+                if revoked_at < horizon:
+                    del self._sessions[session_id]
+            for email, cutoff in list(self._cutoffs.items()):
+                if cutoff < horizon * 1000:
+                    del self._cutoffs[email]
+            self._synced = True
+            return True
+
+    def _run(self):
+        """
+        The function _run refreshes the mirror periodically, it is the body of the refresh thread.
+        """
+        while True:
+            time.sleep(REVOCATION_REFRESH_INTERVAL)
+            self.refresh()
+
+    def _ensure_started(self):
+        """
+        The function _ensure_started starts the refresh thread on first use.
+        """
+        if not self._started:
+            with self._lock:
+                if not self._started:
+                    threading.Thread(target=self._run, daemon=True,
+                                     name="revocation-mirror").start()
+                    self._started = True
+
+    def is_revoked(self, email, session_id, issued_at):
+        """
+        The function is_revoked checks a session against the mirror. Until the mirror has been
+        loaded once, every session is treated as revoked.
+
+        :param email: The email parameter is the email address of the user
+        :param session_id: The session_id is the session id of the token
+        :param issued_at: The issued_at is the issue time of the token in milliseconds
+        :return: a boolean value. It returns True if the session was revoked.
+        """
+        self._ensure_started()
+        if not self._synced and not self.refresh():
+            logging.error('Revocation set not loaded at is_revoked')
+            return True
+        return session_id in self._sessions or issued_at <= self._cutoffs.get(email, -1)
+
+
+MIRROR = RevocationMirror()
+os.register_at_fork(after_in_child=MIRROR.reset)
+
+
+def is_token_valid(email, token):
+    """
+    The function is_token_valid checks if a token is a valid, unexpired and unrevoked token
+    of the user. No Redis round trip is made.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :param token: The token is the token presented by the client
+    :return: a boolean value. It returns True if the user is logged in with this token.
+    """
+    session = _parse_token(email, token)
+    return session is not None and not MIRROR.is_revoked(email, *session)
+
+
+def revoke_token(email, token):
+    """
+    The function revoke_token logs out the session of a token.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :param token: The token is the token presented by the client
+    :return: a boolean value. It returns True if the revocation was recorded in Redis.
+    """
+    session = _parse_token(email, token)
+    if session is None:
+        return False
+    revoked_at = time.time()
+    member = "sid:" + session[0]
+    if redis_cache.add_token_revocation(member, revoked_at, SESSION_TOKEN_TTL):
+        MIRROR.apply(member, revoked_at)
+        return True
+    return False
+
+
+def revoke_all_tokens(email):
+    """
+    The function revoke_all_tokens logs out every session of the user, by revoking all the
+    tokens issued until now.
+
+    :param email: The email parameter is a string that represents the email address of the user
+    :return: a boolean value. It returns True if the revocation was recorded in Redis.
+    """
+    revoked_at = time.time()
+    member = "user:%s:%d" % (email, _now_ms())
+    if redis_cache.add_token_revocation(member, revoked_at, SESSION_TOKEN_TTL):
+        MIRROR.apply(member, revoked_at)
+        return True
+    return False
@@ -0,0 +1,23 @@
+"""
+    The module configures the tests: the Application modules are imported from the repository
+    root, against the MongoDB and Redis stand-ins of benchmark/standins.py, so the tests run
+    offline.
+
+    $ pip install pytest mongomock "fakeredis[lua]"
+    $ python -m pytest -q test
+"""
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmark"))
+
+for name in ("MONGODB_HOST", "REDIS_HOST"):
+    os.environ.setdefault(name, "localhost")
+for name, port in (("MONGODB_PORT", "27017"), ("REDIS_PORT", "6379")):
+    os.environ.setdefault(name, port)
+
+import standins  # pylint: disable=wrong-import-position
+
+standins.install()
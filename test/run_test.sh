@@ -1,4 +1,10 @@
 #!/bin/bash
+echo "Liveness"
+curl -s -X GET "http://localhost:5000/health/live"
+read
+echo "Readiness"
+curl -s -X GET "http://localhost:5000/health/ready"
+read
 echo "Create user"
 curl -s -X POST "http://localhost:5000/create/user?username=helloworld&email=helloworld@helloworld.com&password=12345678"
 read
@@ -15,14 +21,18 @@ echo "List user"
 curl -s -X GET "http://localhost:5000/list/user?email=helloworld@helloworld.com"
 read
 
-echo "Login user"
-curl -s -X POST "http://localhost:5000/login/user?email=helloworld@helloworld.com&password=910111213"
+echo "Login user ( JSON body )"
+curl -s -X POST -H "Content-Type: application/json" -d '{"email": "helloworld@helloworld.com", "password": "910111213"}' "http://localhost:5000/login/user"
 read
 
 echo "List user"
 curl -s -X GET "http://localhost:5000/list/user?email=helloworld@helloworld.com"
 read
 
+echo "List user, latest login only"
+curl -s -X GET "http://localhost:5000/list/user?email=helloworld@helloworld.com&limit=1"
+read
+
 echo "Is user logged in"
 curl -s -X GET "http://localhost:5000/login/user?email=helloworld@helloworld.com"
 read
@@ -0,0 +1,56 @@
+"""
+    The tests of the email filters of the workers, a new user whose publication to the other
+    workers was missed must not stay a false negative of their filters.
+"""
+import uuid
+import mongo_db_connector
+import email_filter
+
+
+def _worker():
+    """
+    The function _worker returns the email filter of a worker, its maintenance is driven by the
+    test instead of the maintenance thread.
+    """
+    worker = email_filter.EmailFilter(email_filter.count_emails, email_filter.stream_emails,
+                                      0.01, 1000, 1 << 20, 3600)
+    worker._started = True  # pylint: disable=protected-access
+    return worker
+
+
+def test_missed_publish_rebuilds_the_other_workers():
+    # pylint: disable=protected-access
+    email = "unpublished-%s@test.com" % uuid.uuid4().hex[:8]
+    creating, other = _worker(), _worker()
+    for worker in (creating, other):
+        worker._check_epoch()
+        assert worker._rebuild()
+
+    mongo_db_connector.users().insert_one({"username": "u", "email": email, "password": "p"})
+    creating.add(email)
+    creating.unpublished([email])
+    assert creating.might_exist(email)
+    assert not other.might_exist(email)
+
+    creating._publish_unpublished()
+    assert creating.stats()["unpublished"] == 0
+
+    other._check_epoch()
+    assert other.might_exist(email)
+    assert other._rebuild()
+    assert other.might_exist(email)
+    assert other.stats()["rebuilds"] == 2
+
+
+def test_failed_publish_is_kept_for_the_next_attempt(monkeypatch):
+    # pylint: disable=protected-access
+    email = "retried-%s@test.com" % uuid.uuid4().hex[:8]
+    creating = _worker()
+    creating.unpublished([email])
+    monkeypatch.setattr(email_filter.redis_cache, "publish_email_additions",
+                        lambda emails, bump_epoch=False: False)
+
+    creating._publish_unpublished()
+
+    assert creating.stats()["unpublished"] == 1
+    assert creating.stats()["publish_failures"] == 1
@@ -0,0 +1,72 @@
+"""
+    The tests of the login history write-behind, a deleted user must not get its login history
+    back from a batch written concurrently with its deletion.
+"""
+import time
+import uuid
+import threading
+import mongo_db_connector
+import login_history
+
+
+class BlockedWrite:
+    """
+    The class BlockedWrite writes the batches with mongo_db_connector.write_login_history once
+    released, so that a batch can be held in flight.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, logins):
+        self.started.set()
+        assert self.released.wait(5)
+        mongo_db_connector.write_login_history(logins)
+
+
+def _history(email):
+    return mongo_db_connector.userlogin().find_one({"email": email})
+
+
+def test_discard_waits_for_the_batch_in_flight():
+    email = "deleted-%s@test.com" % uuid.uuid4().hex[:8]
+    write = BlockedWrite()
+    writer = login_history.LoginHistoryWriter(write, 100, 10, 0.01)
+    for _ in range(3):
+        assert writer.record(email, time.time())
+    assert write.started.wait(5)
+    # queued after the batch was taken, discarded without being written
+    assert writer.record(email, time.time())
+
+    def delete_user():
+        # the order of mongo_db_connector.delete_user
+        writer.discard(email)
+        mongo_db_connector.userlogin().delete_one({"email": email})
+
+    deleting = threading.Thread(target=delete_user)
+    deleting.start()
+    deleting.join(0.2)
+    assert deleting.is_alive()
+
+    write.released.set()
+    deleting.join(5)
+    assert not deleting.is_alive()
+    assert writer.pending() == 0
+    assert writer.flush()
+    assert _history(email) is None
+    assert writer.written == 3
+
+
+def test_discard_keeps_the_logins_of_other_users():
+    email, other = ("kept-%s@test.com" % uuid.uuid4().hex[:8] for _ in range(2))
+    writer = login_history.LoginHistoryWriter(mongo_db_connector.write_login_history, 100, 10,
+                                              60)
+    writer.record(email, time.time())
+    writer.record(other, time.time())
+
+    writer.discard(email)
+
+    assert writer.flush()
+    assert _history(email) is None
+    assert len(_history(other)["lastlogin"]) == 1
@@ -0,0 +1,64 @@
+"""
+    The tests of the revocation of the signed session tokens across workers, each worker holding
+    its own RevocationMirror of the Redis revocation log.
+"""
+import time
+import uuid
+import types
+import pytest
+import session_token
+
+
+@pytest.fixture(name="secret", autouse=True)
+def fixture_secret(monkeypatch):
+    monkeypatch.setattr(session_token, "SESSION_TOKEN_SECRET", "test-secret")
+
+
+def _email():
+    return "revoked-%s@test.com" % uuid.uuid4().hex[:8]
+
+
+def _revoked_on(mirror, email, token):
+    assert mirror.refresh()
+    # pylint: disable-next=protected-access
+    return mirror.is_revoked(email, *session_token._parse_token(email, token))
+
+
+def test_revoked_token_rejected_by_another_worker():
+    email = _email()
+    token = session_token.issue_token(email)
+    other_worker = session_token.RevocationMirror()
+    assert not _revoked_on(other_worker, email, token)
+
+    assert session_token.revoke_token(email, token)
+
+    assert _revoked_on(other_worker, email, token)
+    assert not session_token.is_token_valid(email, token)
+
+
+def test_logout_everywhere_rejected_by_another_worker():
+    email = _email()
+    tokens = [session_token.issue_token(email) for _ in range(2)]
+    other_worker = session_token.RevocationMirror()
+    assert not any(_revoked_on(other_worker, email, token) for token in tokens)
+
+    time.sleep(0.002)
+    assert session_token.revoke_all_tokens(email)
+
+    assert all(_revoked_on(other_worker, email, token) for token in tokens)
+    assert not _revoked_on(other_worker, email, session_token.issue_token(email))
+
+
+def test_revocation_by_a_worker_with_a_late_clock_is_not_missed(monkeypatch):
+    email = _email()
+    token = session_token.issue_token(email)
+    other_worker = session_token.RevocationMirror()
+    assert not _revoked_on(other_worker, email, token)
+
+    # the revoking worker's clock is a minute behind the last refresh of the other worker
+    late_clock = types.SimpleNamespace(time=lambda now=time.time(): now - 60)
+    with monkeypatch.context() as patch:
+        patch.setattr(session_token, "time", late_clock)
+        assert session_token.revoke_token(email, token)
+
+    assert _revoked_on(other_worker, email, token)
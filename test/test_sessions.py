@@ -0,0 +1,48 @@
+"""
+    The tests of the session store, a user holds one session per device, each expiring on its
+    own, and the sessions are checked and removed in a single round trip.
+"""
+import time
+import uuid
+import redis_cache
+
+
+def _email():
+    return "session-%s@test.com" % uuid.uuid4().hex[:8]
+
+
+def test_sessions_of_several_devices():
+    email = _email()
+    assert redis_cache.persist_client_token(email, "phone")
+    assert redis_cache.persist_client_token(email, "laptop")
+
+    assert redis_cache.remove_client_tokens(email, "phone") == 1
+
+    assert not redis_cache.is_client_token_persists(email, "phone")
+    assert redis_cache.is_client_token_persists(email, "laptop")
+    assert redis_cache.is_client_token_persists(email)
+    assert redis_cache.check_client_tokens([(email, "phone"), (email, "laptop"),
+                                            (_email(), None)]) == [False, True, False]
+
+
+def test_logout_everywhere():
+    email = _email()
+    for token in ("phone", "laptop"):
+        assert redis_cache.persist_client_token(email, token)
+
+    assert redis_cache.remove_client_tokens(email) == 2
+
+    assert not redis_cache.is_client_token_persists(email)
+    assert redis_cache.remove_client_tokens(email) == 0
+
+
+def test_sessions_expire_on_their_own(monkeypatch):
+    email = _email()
+    monkeypatch.setattr(redis_cache, "SESSION_TTL", 1)
+    assert redis_cache.persist_client_token(email, "old")
+    time.sleep(0.6)
+    assert redis_cache.persist_client_token(email, "new")
+    time.sleep(0.6)
+
+    assert not redis_cache.is_client_token_persists(email, "old")
+    assert redis_cache.is_client_token_persists(email, "new")
@@ -2,7 +2,20 @@
     The module provides functions for validating parameter values, including email addresses and
     passwords.
 """
+import os
 import re
+import hmac
+
+# Token of the admin endpoints, the admin endpoints are disabled while it is not set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Patterns of the parameter values, compiled once by request_schema
+EMAIL_PATTERN = r"[^@]+@[^@]+\.[^@]+"
+PASSWORD_PATTERN = r'[A-Za-z0-9@#$%^&+=]{8,}'
+LIMIT_PATTERN = r'[1-9][0-9]{0,3}'
+TIMESTAMP_PATTERN = r'[0-9]{1,12}(\.[0-9]+)?'
+FRACTION_PATTERN = r'0(\.[0-9]+)?|1(\.0+)?'
+SECONDS_PATTERN = r'[1-9][0-9]{0,4}'
 
 def is_parameter_value_valid(parameter):
     """
@@ -24,7 +37,7 @@ def is_parameter_value_valid_email(parameter):
     parameter value is not a valid email address, the match will be unsuccessful and None
     will be returned.
     """
-    return re.match(r"[^@]+@[^@]+\.[^@]+", parameter)
+    return re.match(EMAIL_PATTERN, parameter)
 
 def is_parameter_value_valid_password(parameter):
     """
@@ -36,4 +49,34 @@ def is_parameter_value_valid_password(parameter):
     :return: the result of the re.fullmatch() method, which is a match object if the
     parameter value is a valid password, or None if it is not.
     """
-    return re.fullmatch(r'[A-Za-z0-9@#$%^&+=]{8,}', parameter)
+    return re.fullmatch(PASSWORD_PATTERN, parameter)
+
+def is_parameter_value_valid_limit(parameter):
+    """
+    The function is_parameter_value_valid_limit checks if a given parameter is a valid
+    limit, which should be a positive integer of at most 4 digits.
+    :param parameter: The parameter is a string that represents the limit
+    :return: the result of the re.fullmatch() method, which is a match object if the
+    parameter value is a valid limit, or None if it is not.
+    """
+    return re.fullmatch(LIMIT_PATTERN, parameter)
+
+def is_parameter_value_valid_timestamp(parameter):
+    """
+    The function is_parameter_value_valid_timestamp checks if a given parameter is a valid
+    epoch timestamp, which can include a fractional part.
+    :param parameter: The parameter is a string that represents the epoch timestamp
+    :return: the result of the re.fullmatch() method, which is a match object if the
+    parameter value is a valid timestamp, or None if it is not.
+    """
+    return re.fullmatch(TIMESTAMP_PATTERN, parameter)
+
+def is_admin_token_valid(token):
+    """
+    The function is_admin_token_valid checks the token of an admin request against the
+    ADMIN_TOKEN environment variable, in constant time.
+    :param token: The token is the value of the X-Admin-Token header, or None
+    :return: a boolean value. It returns True if ADMIN_TOKEN is set and the token matches it.
+    """
+    return (len(ADMIN_TOKEN) > 0 and token is not None
+            and hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')))